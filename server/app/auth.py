@@ -1,15 +1,20 @@
 """Authentication utilities."""
+import hashlib
 import os
 import secrets
 import string
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 from jose import JWTError, jwt
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from dotenv import load_dotenv
+from .executor import password_executor
 from .models import User
+from .passwords import get_password_hash, verify_password  # noqa: F401 (re-exported)
 
 # Load environment variables from server/.env
 # auth.py is in server/app/, so parent.parent is server/
@@ -23,48 +28,24 @@ SECRET_KEY = os.getenv('JWT_SECRET_KEY', secrets.token_urlsafe(32))
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('JWT_EXPIRE_MINUTES', '10080'))  # Default 7 days
 
-# Password hashing
-# Use bcrypt with fallback handling for version compatibility
-try:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-except Exception as e:
-    # If bcrypt initialization fails, log warning but continue
-    # The error might be about version detection but bcrypt should still work
-    import warnings
-    warnings.warn(f"bcrypt context initialization warning: {e}")
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Server processes sharing the database (set by serve.py). The caches below are per process and
+# invalidate_user only reaches the process that changed the user, so with several the user cache
+# is off unless AUTH_USER_CACHE_TTL is set explicitly (accepting that much staleness)
+SERVE_WORKERS = int(os.getenv('SERVE_WORKERS', '1'))
 
+# Authentication fast path: seconds a verified token / loaded user stays cached (0 disables)
+AUTH_TOKEN_CACHE_TTL = float(os.getenv('AUTH_TOKEN_CACHE_TTL', '300'))
+AUTH_USER_CACHE_TTL = float(os.getenv('AUTH_USER_CACHE_TTL', '30' if SERVE_WORKERS <= 1 else '0'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash."""
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """``verify_password`` on the bcrypt process pool, awaitable from a request handler."""
+    return await password_executor.run(verify_password, plain_password, hashed_password)
 
 
-def get_password_hash(password: str) -> str:
-    """Hash a password.
-    
-    Note: bcrypt has a 72-byte limit for passwords. If the password exceeds
-    this limit, it will be truncated to 72 bytes (not 72 characters).
-    """
-    # Convert password to bytes to check length
-    password_bytes = password.encode('utf-8')
-    
-    # bcrypt has a 72-byte limit, truncate if necessary
-    if len(password_bytes) > 72:
-        password_bytes = password_bytes[:72]
-        password = password_bytes.decode('utf-8', errors='ignore')
-    
-    try:
-        return pwd_context.hash(password)
-    except Exception as e:
-        # If bcrypt fails, try to handle the error gracefully
-        error_msg = str(e)
-        if "cannot be longer than 72 bytes" in error_msg:
-            # Final fallback: truncate to 72 bytes and try again
-            password_bytes = password.encode('utf-8')[:72]
-            password = password_bytes.decode('utf-8', errors='ignore')
-            return pwd_context.hash(password)
-        raise
+async def get_password_hash_async(password: str) -> str:
+    """``get_password_hash`` on the bcrypt process pool, awaitable from a request handler."""
+    return await password_executor.run(get_password_hash, password)
 
 
 def generate_short_id() -> str:
@@ -122,6 +103,14 @@ def get_user_by_short_id(db: Session, short_id: str) -> Optional[User]:
     return db.query(User).filter(User.short_id == short_id).first()
 
 
+def get_short_ids(db: Session, limit: Optional[int] = None) -> List[str]:
+    """Get the short IDs of the most recently created users."""
+    query = db.query(User.short_id).order_by(User.id.desc())
+    if limit:
+        query = query.limit(limit)
+    return [row.short_id for row in query]
+
+
 def is_email_or_username_taken(db: Session, email: str, username: Optional[str] = None) -> Tuple[bool, str]:
     """Check if email or username is already taken.
     
@@ -139,3 +128,119 @@ def is_email_or_username_taken(db: Session, email: str, username: Optional[str]
     
     return False, ""
 
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire at a per-entry deadline."""
+
+    def __init__(self, ttl: float, max_entries: int = AUTH_CACHE_SIZE) -> None:
+        self.ttl = ttl
+        self.max_entries = max(1, max_entries)
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0
+
+    def get(self, key: Any) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._entries[key]
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return entry[1]
+
+    def put(self, key: Any, value: Any, expires_at: Optional[float] = None) -> None:
+        """Cache ``value`` for ``ttl`` seconds, or until ``expires_at`` if that is sooner."""
+        if not self.enabled:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        with self._lock:
+            self._entries[key] = (deadline, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_where(self, predicate) -> None:
+        with self._lock:
+            for key in [k for k, (_, v) in self._entries.items() if predicate(k, v)]:
+                del self._entries[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+            }
+
+
+def _token_key(token: str) -> str:
+    # Store a digest rather than the bearer token itself
+    return hashlib.sha256(token.encode('utf-8')).hexdigest()
+
+
+def verify_token_cached(token: str) -> Optional[dict]:
+    """Like ``verify_token`` but remembers valid tokens until the cache TTL or their ``exp``.
+
+    Only ``sub`` and ``exp`` are returned on a cache hit. Tokens without an
+    ``exp`` claim are never cached.
+    """
+    key = _token_key(token)
+    cached = token_cache.get(key)
+    if cached is not None and cached['exp'] > time.time():
+        return cached
+    payload = verify_token(token)
+    if payload is not None and payload.get('exp') is not None:
+        exp = float(payload['exp'])
+        token_cache.put(key, {'sub': payload.get('sub'), 'exp': exp}, expires_at=exp)
+    return payload
+
+
+def get_user_by_id_cached(db: Session, user_id: int) -> Optional[User]:
+    """Like ``get_user_by_id`` but served from a short-lived cache when possible.
+
+    A hit is rebuilt from cached column values and merged into ``db`` without
+    a query, so callers can still modify and commit it as usual.
+    """
+    values = user_cache.get(user_id)
+    if values is not None:
+        user = User(**values)
+        make_transient_to_detached(user)
+        return db.merge(user, load=False)
+    user = get_user_by_id(db, user_id)
+    if user is not None:
+        user_cache.put(user_id, {attr.key: getattr(user, attr.key) for attr in User.__mapper__.column_attrs})
+    return user
+
+
+def invalidate_user(user_id: int) -> None:
+    """Drop the cached user and every cached token issued to it; call after mutating the user."""
+    user_cache.discard_where(lambda key, _: key == user_id)
+    subject = str(user_id)
+    token_cache.discard_where(lambda _, value: str(value.get('sub')) == subject)
+
+
+def auth_cache_stats() -> dict:
+    return {'tokens': token_cache.stats(), 'users': user_cache.stats()}
+
+
+# Global shared state
+token_cache = TTLCache(AUTH_TOKEN_CACHE_TTL)
+user_cache = TTLCache(AUTH_USER_CACHE_TTL)
@@ -0,0 +1,353 @@
+"""Inference backends that run the StegaStamp encoder and decoder for ModelRunner.
+
+A backend holds one loaded model and runs it on numpy batches:
+
+* ``encode(images [N, 400, 400, 3], secrets [N, 100]) -> (stegastamp, residual)``
+* ``decode(images [N, 400, 400, 3]) -> bits [N, 100]`` (already rounded to 0/1)
+
+``tf1``/``tf2`` serve the SavedModel in ``<model>/model`` with TensorFlow;
+``tflite`` serves ``encoder.tflite``/``decoder.tflite`` exported by
+``convert_tflite.py`` with the TFLite interpreter (XNNPACK on CPU), which
+needs only ``ai-edge-litert`` or ``tflite-runtime`` instead of the full
+TensorFlow runtime. Which one a model uses is set per model by an optional
+``backend.json`` next to its ``model`` directory, e.g.::
+
+    {"backend": "tflite", "encoder": "tflite/encoder.tflite", "decoder": "tflite/decoder.tflite"}
+
+With ``MODEL_BACKEND=prefer_tflite`` (serve.py's default) a model whose
+backend.json says ``tf`` is served from its TFLite copy anyway, provided
+convert_tflite.py checked that copy and it needs no flex ops.
+"""
+import importlib
+import json
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+
+# Backend for every model, overriding backend.json: 'auto' (use backend.json, else tf), 'tf', 'tflite',
+# or 'prefer_tflite' (like auto, but serve a checked TFLite copy written with convert_tflite.py --no-activate)
+MODEL_BACKEND = os.getenv('MODEL_BACKEND', 'auto').strip().lower()
+# TFLite interpreter threads per replica (0 = use RUNNER_INTRA_OP_THREADS, or the interpreter default)
+TFLITE_THREADS = int(os.getenv('TFLITE_THREADS', '0'))
+
+BACKEND_CONFIG = 'backend.json'
+DEFAULT_TFLITE_ENCODER = os.path.join('tflite', 'encoder.tflite')
+DEFAULT_TFLITE_DECODER = os.path.join('tflite', 'decoder.tflite')
+
+_tf = None
+
+
+def import_tensorflow(intra_op_threads: int = 0, inter_op_threads: int = 0):
+    """Import TensorFlow once per process and apply the eager thread settings."""
+    global _tf
+    if _tf is None:
+        try:
+            import tensorflow as tf  # type: ignore
+        except Exception as e:
+            raise RuntimeError(f'TensorFlow not available: {e}')
+        # TF2 eager threading is process-wide and can only be set before the
+        # runtime starts; TF1 sessions get their own ConfigProto instead.
+        try:
+            if intra_op_threads:
+                tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+            if inter_op_threads:
+                tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+        except RuntimeError:
+            pass
+        _tf = tf
+    return _tf
+
+
+def _tflite_interpreter_module():
+    """The lightest available TFLite interpreter module: LiteRT, tflite-runtime, then full TensorFlow.
+
+    Each provides ``Interpreter`` and ``OpResolverType``.
+    """
+    for name in ('ai_edge_litert.interpreter', 'tflite_runtime.interpreter', 'tensorflow.lite.python.interpreter'):
+        try:
+            return importlib.import_module(name)
+        except ImportError:
+            continue
+    raise RuntimeError('No TFLite interpreter available: install ai-edge-litert or tflite-runtime')
+
+
+def _dir_size_bytes(path: str) -> int:
+    total = 0
+    for root, _dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def model_root(model_dir: str) -> str:
+    """The model's directory under saved_models/ (``model_dir`` is its ``model`` SavedModel folder)."""
+    return os.path.dirname(os.path.normpath(model_dir))
+
+
+def read_backend_config(model_dir: str) -> dict:
+    """``backend.json`` next to ``model_dir``, or ``{}`` if there is none."""
+    path = os.path.join(model_root(model_dir), BACKEND_CONFIG)
+    try:
+        with open(path, encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f'Invalid {BACKEND_CONFIG} for {model_root(model_dir)}: {e}')
+    if not isinstance(config, dict):
+        raise RuntimeError(f'Invalid {BACKEND_CONFIG} for {model_root(model_dir)}: expected an object')
+    return config
+
+
+def has_tflite_copy(model_dir: str, config: dict) -> bool:
+    """Whether backend.json lists TFLite files that convert_tflite.py checked and that need no flex ops."""
+    if 'check' not in config or config.get('flex_ops'):
+        return False
+    root = model_root(model_dir)
+    return all(os.path.isfile(os.path.join(root, config.get(part, default)))
+               for part, default in (('encoder', DEFAULT_TFLITE_ENCODER), ('decoder', DEFAULT_TFLITE_DECODER)))
+
+
+def backend_name(model_dir: str, config: Optional[dict] = None) -> str:
+    """'tf' or 'tflite' for the model at ``model_dir``, after the MODEL_BACKEND override."""
+    if MODEL_BACKEND in ('tf', 'tflite'):
+        return MODEL_BACKEND
+    if config is None:
+        config = read_backend_config(model_dir)
+    name = str(config.get('backend', 'tf')).lower()
+    if name == 'tf' and MODEL_BACKEND == 'prefer_tflite' and has_tflite_copy(model_dir, config):
+        return 'tflite'
+    return name
+
+
+class InferenceBackend:
+    """One loaded model; subclasses implement ``encode``/``decode`` on numpy batches."""
+
+    name = ''
+
+    def __init__(self, model_dir: str) -> None:
+        self.model_dir = model_dir
+        # None until the first multi-row run tells us whether the graph accepts batches
+        self.batch_supported: Optional[bool] = None
+        # Leading dimension of the image input in the signature (None = dynamic or unknown)
+        self.batch_dim: Optional[int] = None
+        # On-disk size, used as the memory estimate for the cache budget
+        self.size_bytes = 0
+
+    def encode(self, images: np.ndarray, secrets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        raise NotImplementedError
+
+    def decode(self, images: np.ndarray) -> Optional[np.ndarray]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class TF1Backend(InferenceBackend):
+    """TF1 SavedModel with a ``serving_default`` signature: secret/image -> stegastamp/residual/decoded."""
+
+    name = 'tf1'
+
+    def __init__(self, model_dir: str, intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+        super().__init__(model_dir)
+        tf = import_tensorflow(intra_op_threads, inter_op_threads)
+        from tensorflow.python.saved_model import signature_constants, tag_constants  # type: ignore
+
+        self.graph = tf.Graph()
+        config = tf.compat.v1.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads,
+        )
+        self.sess = tf.compat.v1.Session(graph=self.graph, config=config)
+        self.input_secret = None
+        self.input_image = None
+        self.output_stegastamp = None
+        self.output_residual = None
+        self.output_decoded = None
+        try:
+            with self.graph.as_default():
+                # model_dir 已经是完整路径（如 stega/model），直接使用
+                model = tf.compat.v1.saved_model.loader.load(self.sess, [tag_constants.SERVING], model_dir)
+
+                sig = model.signature_def[signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+                # Inputs
+                if 'secret' in sig.inputs:
+                    self.input_secret = self.graph.get_tensor_by_name(sig.inputs['secret'].name)
+                if 'image' in sig.inputs:
+                    self.input_image = self.graph.get_tensor_by_name(sig.inputs['image'].name)
+                    dims = sig.inputs['image'].tensor_shape.dim
+                    if dims and dims[0].size > 0:
+                        self.batch_dim = int(dims[0].size)
+
+                # Outputs (encoder)
+                if 'stegastamp' in sig.outputs:
+                    self.output_stegastamp = self.graph.get_tensor_by_name(sig.outputs['stegastamp'].name)
+                if 'residual' in sig.outputs:
+                    self.output_residual = self.graph.get_tensor_by_name(sig.outputs['residual'].name)
+
+                # Outputs (decoder)
+                if 'decoded' in sig.outputs:
+                    self.output_decoded = self.graph.get_tensor_by_name(sig.outputs['decoded'].name)
+
+            missing = []
+            if self.input_secret is None:
+                missing.append('secret input')
+            if self.input_image is None:
+                missing.append('image input')
+            if self.output_stegastamp is None:
+                missing.append('stegastamp output')
+            if self.output_residual is None:
+                missing.append('residual output')
+            if self.output_decoded is None:
+                missing.append('decoded output')
+            if missing:
+                raise RuntimeError(f'TF1 SavedModel signatures missing: {", ".join(missing)}')
+        except Exception:
+            self.close()
+            raise
+
+    def encode(self, images: np.ndarray, secrets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.sess is None:
+            raise RuntimeError('Model is not loaded')
+        feed = {self.input_secret: secrets, self.input_image: images}
+        hidden_img, residual = self.sess.run([self.output_stegastamp, self.output_residual], feed_dict=feed)
+        return hidden_img, residual
+
+    def decode(self, images: np.ndarray) -> Optional[np.ndarray]:
+        if self.sess is None:
+            raise RuntimeError('Model is not loaded')
+        return self.sess.run(self.output_decoded, feed_dict={self.input_image: images})
+
+    def close(self) -> None:
+        try:
+            if self.sess is not None:
+                self.sess.close()
+        finally:
+            self.sess = None
+            self.graph = None
+
+
+class TF2Backend(InferenceBackend):
+    """TF2 SavedModel exposing ``hide(secret [N, 1, 100], image)`` and ``reveal(image)`` functions."""
+
+    name = 'tf2'
+
+    def __init__(self, model_dir: str, intra_op_threads: int = 0, inter_op_threads: int = 0) -> None:
+        super().__init__(model_dir)
+        self._tf = import_tensorflow(intra_op_threads, inter_op_threads)
+        self.module = self._tf.saved_model.load(model_dir)
+        self.hide = getattr(self.module, 'hide', None)
+        self.reveal = getattr(self.module, 'reveal', None)
+        if self.hide is None or self.reveal is None:
+            raise RuntimeError('SavedModel missing hide/reveal functions')
+
+    def encode(self, images: np.ndarray, secrets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        if self.hide is None:
+            raise RuntimeError('TF2 model is not loaded')
+        tf = self._tf
+        image_tensor = tf.convert_to_tensor(images, dtype=tf.float32)
+        secret_tensor = tf.convert_to_tensor(secrets, dtype=tf.float32)
+        secret_tensor = tf.expand_dims(secret_tensor, axis=1)  # align with TF signature [N, 1, 100]
+
+        outputs = self.hide(secret=secret_tensor, image=image_tensor)
+        hidden_img = outputs.get('stega')
+        residual = outputs.get('residual')
+        if hidden_img is None or residual is None:
+            raise RuntimeError('TF2 encoder outputs missing expected tensors')
+        return hidden_img.numpy(), residual.numpy()
+
+    def decode(self, images: np.ndarray) -> Optional[np.ndarray]:
+        if self.reveal is None:
+            raise RuntimeError('TF2 model is not loaded')
+        tf = self._tf
+        outputs = self.reveal(image=tf.convert_to_tensor(images, dtype=tf.float32))
+        decoded = outputs.get('decoded')
+        if decoded is None:
+            return None
+        return tf.round(tf.sigmoid(decoded)).numpy()
+
+    def close(self) -> None:
+        self.module = None
+        self.hide = None
+        self.reveal = None
+
+
+class TFLiteBackend(InferenceBackend):
+    """Encoder and decoder ``.tflite`` files written by ``convert_tflite.py``.
+
+    Each file has one ``serving_default`` signature: the encoder takes
+    ``secret``/``image`` and returns ``stegastamp``/``residual``, the decoder
+    takes ``image`` and returns rounded ``decoded`` bits. Inputs are resized
+    to the batch at hand, so batches of any size run in one invocation.
+    Float ops run on the interpreter's default XNNPACK delegate unless
+    backend.json's ``xnnpack`` turns it off for a part.
+    """
+
+    name = 'tflite'
+
+    def __init__(self, model_dir: str, config: Optional[dict] = None, num_threads: int = 0) -> None:
+        super().__init__(model_dir)
+        config = config or {}
+        root = model_root(model_dir)
+        tflite = _tflite_interpreter_module()
+        threads = int(config.get('num_threads') or num_threads or 0) or None
+        xnnpack = config.get('xnnpack', {})
+        self.paths = []
+        self._runners = {}
+        for part, default in (('encoder', DEFAULT_TFLITE_ENCODER), ('decoder', DEFAULT_TFLITE_DECODER)):
+            path = os.path.join(root, config.get(part, default))
+            if not os.path.isfile(path):
+                raise RuntimeError(f'TFLite {part} not found: {path} (run convert_tflite.py)')
+            options = {}
+            if not xnnpack.get(part, True):
+                # convert_tflite.py found this part's XNNPACK output wrong; use the reference kernels
+                options['experimental_op_resolver_type'] = tflite.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+            interpreter = tflite.Interpreter(model_path=path, num_threads=threads, **options)
+            self._runners[part] = interpreter.get_signature_runner()
+            self.paths.append(path)
+        self.size_bytes = sum(os.path.getsize(path) for path in self.paths)
+        # The signature runner resizes its inputs per call, so any batch size works
+        self.batch_supported = True
+
+    def encode(self, images: np.ndarray, secrets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        outputs = self._runners['encoder'](
+            secret=np.ascontiguousarray(secrets, dtype=np.float32),
+            image=np.ascontiguousarray(images, dtype=np.float32),
+        )
+        return outputs['stegastamp'], outputs['residual']
+
+    def decode(self, images: np.ndarray) -> Optional[np.ndarray]:
+        outputs = self._runners['decoder'](image=np.ascontiguousarray(images, dtype=np.float32))
+        return outputs['decoded']
+
+    def close(self) -> None:
+        self._runners = {}
+
+
+def load_backend(model_dir: str, intra_op_threads: int = 0, inter_op_threads: int = 0) -> InferenceBackend:
+    """Load the model at ``model_dir`` with the backend chosen by MODEL_BACKEND / its backend.json.
+
+    The ``tf`` backend tries the TF1 signature first, then TF2 functions.
+    """
+    config = read_backend_config(model_dir)
+    choice = backend_name(model_dir, config)
+    if choice == 'tflite':
+        return TFLiteBackend(model_dir, config, TFLITE_THREADS or intra_op_threads)
+    if choice != 'tf':
+        raise RuntimeError(f'Unknown backend "{choice}" for {model_root(model_dir)}, use tf or tflite')
+
+    try:
+        backend = TF1Backend(model_dir, intra_op_threads, inter_op_threads)
+    except Exception as tf1_error:
+        try:
+            backend = TF2Backend(model_dir, intra_op_threads, inter_op_threads)
+        except Exception as exc:
+            raise RuntimeError(f'Failed to load model. TF1 error: {tf1_error}; TF2 error: {exc}')
+    backend.size_bytes = _dir_size_bytes(model_dir)
+    return backend
@@ -0,0 +1,120 @@
+"""Incremental zip and multipart writers for multi-image responses."""
+import io
+import json
+import re
+import secrets
+import zipfile
+from typing import Dict, List, Optional
+from urllib.parse import quote
+
+
+class _DrainBuffer(io.RawIOBase):
+    """Unseekable sink whose contents are taken out after every entry."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._data = bytearray()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._data += data
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = bytes(self._data)
+        self._data.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """Builds a zip archive entry by entry; each call returns the bytes ready to send.
+
+    Entries are stored uncompressed (the images are already compressed) and
+    the archive is written with data descriptors, so nothing needs to seek.
+    """
+
+    media_type = 'application/zip'
+
+    def __init__(self) -> None:
+        self._sink = _DrainBuffer()
+        self._zip = zipfile.ZipFile(self._sink, mode='w', compression=zipfile.ZIP_STORED)
+        self.manifest: List[dict] = []
+
+    def add(self, name: str, data: bytes, content_type: str, item: dict) -> bytes:
+        self._zip.writestr(name, data)
+        self.manifest.append({**item, 'file': name})
+        return self._sink.drain()
+
+    def add_error(self, item: dict) -> bytes:
+        self.manifest.append(item)
+        return b''
+
+    def close(self) -> bytes:
+        self._zip.writestr('manifest.json', json.dumps({'items': self.manifest}, ensure_ascii=False, indent=2))
+        self._zip.close()
+        return self._sink.drain()
+
+
+_CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]')
+# Characters that may not appear inside the quoted filename parameter (quotes, backslash, non-ASCII)
+_UNSAFE_FILENAME = re.compile(r'[^\x20-\x7e]|["\\]')
+
+
+def content_disposition(filename: str) -> str:
+    """``attachment`` header value for a client-supplied file name.
+
+    Control characters are dropped. The quoted ``filename`` is an ASCII
+    fallback; the exact name is added as RFC 5987 ``filename*`` if they differ.
+    """
+    filename = _CONTROL_CHARS.sub('', filename)
+    fallback = _UNSAFE_FILENAME.sub('_', filename)
+    if fallback == filename:
+        return f'attachment; filename="{filename}"'
+    return f'attachment; filename="{fallback}"; filename*=UTF-8\'\'{quote(filename, safe="")}'
+
+
+class MultipartWriter:
+    """Builds a ``multipart/mixed`` body part by part; failed items become JSON parts."""
+
+    def __init__(self, boundary: Optional[str] = None) -> None:
+        self.boundary = boundary or f'stega-{secrets.token_hex(12)}'
+        self.media_type = f'multipart/mixed; boundary={self.boundary}'
+
+    def _part(self, headers: Dict[str, str], body: bytes) -> bytes:
+        head = ''.join(f'{key}: {value}\r\n' for key, value in headers.items())
+        return f'--{self.boundary}\r\n{head}\r\n'.encode('utf-8') + body + b'\r\n'
+
+    def add(self, name: str, data: bytes, content_type: str, item: dict) -> bytes:
+        return self._part({
+            'Content-Type': content_type,
+            'Content-Disposition': content_disposition(name),
+            'Content-Length': str(len(data)),
+            'X-Item-Index': str(item['index']),
+            'X-Item-Status': 'ok',
+        }, data)
+
+    def add_error(self, item: dict) -> bytes:
+        body = json.dumps(item, ensure_ascii=False).encode('utf-8')
+        return self._part({
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Length': str(len(body)),
+            'X-Item-Index': str(item['index']),
+            'X-Item-Status': 'error',
+        }, body)
+
+    def close(self) -> bytes:
+        return f'--{self.boundary}--\r\n'.encode('utf-8')
+
+
+def response_writer(requested: Optional[str], accept: Optional[str]):
+    """Zip unless ``requested`` (or else the Accept header) asks for multipart."""
+    choice = (requested or '').strip().lower()
+    if not choice and accept and 'multipart/mixed' in accept and 'application/zip' not in accept:
+        choice = 'multipart'
+    if choice in ('', 'zip'):
+        return ZipStreamWriter()
+    if choice in ('multipart', 'multipart/mixed'):
+        return MultipartWriter()
+    raise ValueError(f'unsupported response format "{requested}", use zip or multipart')
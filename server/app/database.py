@@ -46,6 +46,6 @@ def get_db():
 
 def init_db():
     """Initialize database tables."""
-    from .models import User, VerificationCode, OperationLog
+    from .models import User, VerificationCode, OperationLog, EmailOutbox
     Base.metadata.create_all(bind=engine)
 
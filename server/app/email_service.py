@@ -3,12 +3,18 @@ import os
 import smtplib
 import secrets
 import string
+import threading
+import time
 from datetime import datetime, timedelta
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 from dotenv import load_dotenv
 from pathlib import Path
+from sqlalchemy import or_, and_
+from .database import SessionLocal
+from .metrics import registry
+from .models import EmailOutbox, VerificationCode
 
 # Load environment variables
 env_path = Path(__file__).resolve().parent.parent / '.env'
@@ -20,6 +26,23 @@ SMTP_PORT = int(os.getenv('SMTP_PORT', '587'))
 SMTP_USER = os.getenv('SMTP_USER', '')
 SMTP_PASSWORD = os.getenv('SMTP_PASSWORD', '')
 SMTP_FROM = os.getenv('SMTP_FROM', SMTP_USER)
+SMTP_STARTTLS = os.environ.get('SMTP_STARTTLS', '1').lower() in ('1', 'true', 'yes')
+SMTP_TIMEOUT = float(os.getenv('SMTP_TIMEOUT', '30'))
+# Seconds an idle pooled SMTP connection is kept open before it is closed
+SMTP_IDLE_TIMEOUT = float(os.getenv('SMTP_IDLE_TIMEOUT', '60'))
+
+# Outbox: emails are stored in email_outbox and sent by a background thread
+EMAIL_OUTBOX = os.environ.get('EMAIL_OUTBOX', '1').lower() in ('1', 'true', 'yes')
+EMAIL_MAX_ATTEMPTS = int(os.getenv('EMAIL_MAX_ATTEMPTS', '6'))
+# Retry delay doubles per failed attempt, starting at the base and capped at the max
+EMAIL_RETRY_BASE_SECONDS = float(os.getenv('EMAIL_RETRY_BASE_SECONDS', '5'))
+EMAIL_RETRY_MAX_SECONDS = float(os.getenv('EMAIL_RETRY_MAX_SECONDS', '600'))
+# How often the sender looks for due retries and rows queued by other processes
+EMAIL_POLL_SECONDS = float(os.getenv('EMAIL_POLL_SECONDS', '5'))
+# A row left in 'sending' this long (e.g. the process died mid-send) is picked up again
+EMAIL_CLAIM_TIMEOUT_SECONDS = float(os.getenv('EMAIL_CLAIM_TIMEOUT_SECONDS', '300'))
+
+EMAILS = registry.counter('stega_emails_total', 'Outbox emails by outcome', ('result',))
 
 
 def generate_verification_code(length: int = 6) -> str:
@@ -27,26 +50,15 @@ def generate_verification_code(length: int = 6) -> str:
     return ''.join(secrets.choice(string.digits) for _ in range(length))
 
 
-def send_verification_email(email: str, code: str, code_type: str = 'email_verify') -> bool:
-    """Send verification code email.
-    
-    Args:
-        email: Recipient email address
-        code: Verification code
-        code_type: Type of code (email_verify or password_reset)
-    
-    Returns:
-        True if sent successfully, False otherwise
-    """
-    if not SMTP_USER or not SMTP_PASSWORD:
-        # If SMTP not configured, just log and return True (for development)
-        print(f"[DEV MODE] Verification code for {email}: {code} (type: {code_type})")
-        return True
-    
-    try:
-        if code_type == 'email_verify':
-            subject = 'StegaCam 邮箱验证'
-            body = f"""
+def smtp_configured() -> bool:
+    return bool(SMTP_USER and SMTP_PASSWORD)
+
+
+def build_verification_message(email: str, code: str, code_type: str = 'email_verify') -> MIMEMultipart:
+    """Build the verification code email for ``code_type`` (email_verify or password_reset)."""
+    if code_type == 'email_verify':
+        subject = 'StegaCam 邮箱验证'
+        body = f"""
 尊敬的用户，
 
 您的邮箱验证码是：{code}
@@ -57,9 +69,9 @@ def send_verification_email(email: str, code: str, code_type: str = 'email_verif
 
 StegaCam 团队
 """
-        else:  # password_reset
-            subject = 'StegaCam 密码重置验证码'
-            body = f"""
+    else:  # password_reset
+        subject = 'StegaCam 密码重置验证码'
+        body = f"""
 尊敬的用户，
 
 您的密码重置验证码是：{code}
@@ -70,20 +82,238 @@ StegaCam 团队
 
 StegaCam 团队
 """
-        
-        msg = MIMEMultipart()
-        msg['From'] = SMTP_FROM
-        msg['To'] = email
-        msg['Subject'] = subject
-        msg.attach(MIMEText(body, 'plain', 'utf-8'))
-        
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+
+    msg = MIMEMultipart()
+    msg['From'] = SMTP_FROM
+    msg['To'] = email
+    msg['Subject'] = subject
+    msg.attach(MIMEText(body, 'plain', 'utf-8'))
+    return msg
+
+
+def _open_smtp() -> smtplib.SMTP:
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+    try:
+        if SMTP_STARTTLS:
             server.starttls()
-            server.login(SMTP_USER, SMTP_PASSWORD)
+        server.login(SMTP_USER, SMTP_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_verification_email(email: str, code: str, code_type: str = 'email_verify') -> bool:
+    """Send verification code email over a fresh connection.
+
+    Args:
+        email: Recipient email address
+        code: Verification code
+        code_type: Type of code (email_verify or password_reset)
+
+    Returns:
+        True if sent successfully, False otherwise
+    """
+    if not smtp_configured():
+        # If SMTP not configured, just log and return True (for development)
+        print(f"[DEV MODE] Verification code for {email}: {code} (type: {code_type})")
+        return True
+
+    try:
+        msg = build_verification_message(email, code, code_type)
+        server = _open_smtp()
+        try:
             server.send_message(msg)
-        
+        finally:
+            server.quit()
         return True
     except Exception as e:
         print(f"Failed to send email: {e}")
         return False
 
+
+class SMTPConnection:
+    """A logged-in SMTP session reused across messages, reopened when dropped and closed when idle."""
+
+    def __init__(self, idle_timeout: float = SMTP_IDLE_TIMEOUT) -> None:
+        self.idle_timeout = idle_timeout
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+        self.connects = 0
+
+    def send(self, msg: MIMEMultipart) -> None:
+        if self._server is not None:
+            try:
+                self._server.send_message(msg)
+                self._last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, OSError):
+                # The server closed the session; reconnect once below
+                self.close()
+        self._server = _open_smtp()
+        self.connects += 1
+        self._server.send_message(msg)
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self) -> None:
+        if self._server is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+            self.close()
+
+    def close(self) -> None:
+        server, self._server = self._server, None
+        if server is None:
+            return
+        try:
+            server.quit()
+        except Exception:
+            server.close()
+
+
+class EmailOutboxSender:
+    """Background thread that delivers pending ``EmailOutbox`` rows.
+
+    Rows are claimed with a conditional UPDATE, so several server processes
+    can drain the same table without sending an email twice. Failed sends
+    are retried with exponential backoff up to ``max_attempts``.
+    """
+
+    def __init__(
+        self,
+        session_factory=SessionLocal,
+        max_attempts: int = EMAIL_MAX_ATTEMPTS,
+        poll_seconds: float = EMAIL_POLL_SECONDS,
+        batch_size: int = 20,
+    ) -> None:
+        self._session_factory = session_factory
+        self.max_attempts = max(1, max_attempts)
+        self.poll_seconds = poll_seconds
+        self.batch_size = batch_size
+        self._connection = SMTPConnection()
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='email-outbox', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Stop after the current message; unsent rows stay pending for the next start."""
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        self._wake.set()
+        thread.join(timeout)
+        self._thread = None
+
+    def notify(self) -> None:
+        """Wake the sender because a new row was queued."""
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                processed = self._drain_once()
+            except Exception as e:
+                print(f"Email outbox error: {e}")
+                processed = 0
+            if processed:
+                continue
+            self._connection.close_if_idle()
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+        self._connection.close()
+
+    @staticmethod
+    def _claimable(now: datetime):
+        """Rows due for a (re)try, or left in 'sending' by a sender that died."""
+        stale = now - timedelta(seconds=EMAIL_CLAIM_TIMEOUT_SECONDS)
+        return or_(
+            and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+            and_(EmailOutbox.status == 'sending', EmailOutbox.claimed_at < stale),
+        )
+
+    def _drain_once(self) -> int:
+        db = self._session_factory()
+        try:
+            now = datetime.utcnow()
+            candidates = [row_id for (row_id,) in db.query(EmailOutbox.id).filter(self._claimable(now))
+                          .order_by(EmailOutbox.id).limit(self.batch_size)]
+            processed = 0
+            for row_id in candidates:
+                if self._stopping.is_set():
+                    break
+                if not self._claim(db, row_id, now):
+                    continue
+                self._deliver(db, db.get(EmailOutbox, row_id))
+                processed += 1
+            return processed
+        finally:
+            db.close()
+
+    def _claim(self, db, row_id: int, now: datetime) -> bool:
+        # The claim re-checks the row's state in the UPDATE itself, so of several
+        # senders that picked the same candidate only one gets it
+        claimed = db.query(EmailOutbox).filter(EmailOutbox.id == row_id, self._claimable(now)).update(
+            {'status': 'sending', 'claimed_at': now}, synchronize_session=False
+        )
+        db.commit()
+        return claimed == 1
+
+    def _deliver(self, db, row: EmailOutbox) -> None:
+        verification = db.get(VerificationCode, row.verification_code_id)
+        if verification is None or verification.used or verification.expires_at <= datetime.utcnow():
+            # Superseded or expired before it could be sent
+            row.status = 'skipped'
+            db.commit()
+            EMAILS.inc(result='skipped')
+            return
+        try:
+            if smtp_configured():
+                msg = build_verification_message(verification.email, verification.code, verification.code_type)
+                self._connection.send(msg)
+            else:
+                print(f"[DEV MODE] Verification code for {verification.email}: {verification.code} "
+                      f"(type: {verification.code_type})")
+        except Exception as e:
+            self._connection.close()
+            row.attempts += 1
+            row.last_error = f'{type(e).__name__}: {e}'[:1000]
+            if row.attempts >= self.max_attempts:
+                row.status = 'failed'
+                EMAILS.inc(result='failed')
+                print(f"Failed to send email to {verification.email} after {row.attempts} attempts: {e}")
+            else:
+                delay = min(EMAIL_RETRY_MAX_SECONDS, EMAIL_RETRY_BASE_SECONDS * 2 ** (row.attempts - 1))
+                row.status = 'pending'
+                row.next_attempt_at = datetime.utcnow() + timedelta(seconds=delay)
+                EMAILS.inc(result='retry')
+            db.commit()
+            return
+        row.status = 'sent'
+        row.attempts += 1
+        row.sent_at = datetime.utcnow()
+        db.commit()
+        EMAILS.inc(result='sent')
+
+    def stats(self) -> dict:
+        return {
+            'running': self.running,
+            'smtp_connects': self._connection.connects,
+            'sent': int(EMAILS.value(result='sent')),
+            'retried': int(EMAILS.value(result='retry')),
+            'failed': int(EMAILS.value(result='failed')),
+            'skipped': int(EMAILS.value(result='skipped')),
+        }
+
+
+# Global shared sender (started by the app when EMAIL_OUTBOX is enabled)
+email_outbox = EmailOutboxSender()
@@ -0,0 +1,110 @@
+"""Dedicated, bounded executors for inference and password hashing."""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+from .metrics import STAGE_SECONDS
+
+
+# Threads that run upload decoding + inference, and how many more jobs may wait for one
+INFERENCE_THREADS = int(os.getenv('INFERENCE_THREADS', '16'))
+INFERENCE_QUEUE_SIZE = int(os.getenv('INFERENCE_QUEUE_SIZE', '64'))
+# Seconds suggested to clients in the Retry-After header when the queue is full
+INFERENCE_RETRY_AFTER = int(os.getenv('INFERENCE_RETRY_AFTER', '2'))
+
+# Worker processes for bcrypt, and how many more hash/verify calls may wait for one
+PASSWORD_WORKERS = int(os.getenv('PASSWORD_WORKERS', '2'))
+PASSWORD_QUEUE_SIZE = int(os.getenv('PASSWORD_QUEUE_SIZE', '64'))
+
+
+class ExecutorFull(RuntimeError):
+    """Raised when the executor already holds as many jobs as it may queue."""
+
+
+class BoundedExecutor:
+    """Thread or process pool that rejects new work once ``max_workers + queue_size`` jobs are pending.
+
+    It is kept separate from Starlette's request threadpool so that slow
+    inference never starves auth or health-check handlers. With
+    ``processes=True`` jobs run in worker processes, which keeps CPU-bound
+    pure-Python work (bcrypt) from holding the GIL in the server process;
+    ``fn`` and its arguments must then be picklable.
+    """
+
+    def __init__(self, max_workers: int, queue_size: int, name: str, processes: bool = False) -> None:
+        self.max_workers = max(1, max_workers)
+        self.queue_size = max(0, queue_size)
+        self.processes = processes
+        self.name = name
+        # Created on first use, so a process forked after import (serve.py) gets its own queues and locks
+        self._executor = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._rejected = 0
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if self.processes:
+                    # Spawn rather than fork: the server process may already be running TensorFlow threads
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=self.name)
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        with self._lock:
+            if self._pending >= self.max_workers + self.queue_size:
+                self._rejected += 1
+                raise ExecutorFull('Inference queue is full')
+            self._pending += 1
+        try:
+            executor = self._get_executor()
+            if self.processes:
+                future = executor.submit(fn, *args, **kwargs)
+            else:
+                future = executor.submit(self._timed, time.perf_counter(), fn, args, kwargs)
+        except Exception:
+            self._done(None)
+            raise
+        future.add_done_callback(self._done)
+        return future
+
+    @staticmethod
+    def _timed(submitted_at: float, fn, args, kwargs):
+        STAGE_SECONDS.observe(time.perf_counter() - submitted_at, stage='executor_wait')
+        return fn(*args, **kwargs)
+
+    async def run(self, fn, *args, **kwargs):
+        """Submit ``fn`` and await its result from the event loop."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def _done(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'threads': self.max_workers,
+                'queue_size': self.queue_size,
+                'pending': self._pending,
+                'queued': max(0, self._pending - self.max_workers),
+                'rejected': self._rejected,
+            }
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            executor = self._executor
+        if executor is not None:
+            executor.shutdown(wait=wait)
+
+
+# Global shared executors
+inference_executor = BoundedExecutor(INFERENCE_THREADS, INFERENCE_QUEUE_SIZE, 'inference')
+password_executor = BoundedExecutor(PASSWORD_WORKERS, PASSWORD_QUEUE_SIZE, 'password', processes=True)
@@ -0,0 +1,182 @@
+"""Asynchronous encode/decode jobs: submission, status, retention and change notifications."""
+import asyncio
+import itertools
+import os
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .executor import BoundedExecutor, inference_executor
+from .metrics import registry
+
+
+# Seconds a finished job (and its result) is kept for polling
+JOB_RESULT_TTL = float(os.getenv('JOB_RESULT_TTL', '600'))
+# Most unfinished + retained jobs held in memory (encoded images included); submissions beyond it are rejected
+JOB_MAX_JOBS = int(os.getenv('JOB_MAX_JOBS', '256'))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED = (SUCCEEDED, FAILED)
+
+JOBS = registry.counter('stega_jobs_total', 'Asynchronous jobs by kind and outcome', ('kind', 'result'))
+
+
+class JobStoreFull(RuntimeError):
+    """Raised when the store already holds ``JOB_MAX_JOBS`` jobs."""
+
+
+class Job:
+    __slots__ = ('id', 'kind', 'user_id', 'seq', 'status', 'created_at', 'started_at', 'finished_at',
+                 'expires_at', 'error', 'result', 'info')
+
+    def __init__(self, kind: str, user_id: Optional[int], seq: int, info: Optional[dict] = None) -> None:
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.seq = seq
+        self.status = QUEUED
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.expires_at: Optional[float] = None
+        self.error: Optional[str] = None
+        self.result: Any = None
+        self.info = info or {}
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED
+
+
+class JobStore:
+    """In-process registry of jobs run on a ``BoundedExecutor``.
+
+    The work function's return value becomes ``job.result`` and an exception
+    marks the job failed with its message; callers decide what a result
+    means for their job kind. Subscribers (for server-sent events) receive
+    a snapshot every time a job changes. Finished jobs are kept for ``ttl``
+    seconds. Jobs live in this process's memory only.
+    """
+
+    def __init__(self, executor: BoundedExecutor, ttl: float = JOB_RESULT_TTL, max_jobs: int = JOB_MAX_JOBS) -> None:
+        self._executor = executor
+        self.ttl = ttl
+        self.max_jobs = max(1, max_jobs)
+        self._jobs: Dict[str, Job] = {}
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]]] = {}
+        self._seq = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, user_id: Optional[int], fn: Callable, *args, info: Optional[dict] = None) -> Job:
+        """Register a job and queue ``fn(*args)`` on the executor.
+
+        Raises ``JobStoreFull`` or the executor's ``ExecutorFull`` when there
+        is no room; the job is not kept in either case.
+        """
+        self.purge()
+        with self._lock:
+            if len(self._jobs) >= self.max_jobs:
+                raise JobStoreFull('Too many jobs')
+            job = Job(kind, user_id, next(self._seq), info)
+            self._jobs[job.id] = job
+        try:
+            self._executor.submit(self._run, job, fn, args)
+        except Exception:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        return job
+
+    def _run(self, job: Job, fn: Callable, args: tuple) -> None:
+        self._update(job, status=RUNNING, started_at=time.time())
+        try:
+            result = fn(*args)
+        except Exception as e:
+            self._finish(job, FAILED, error=str(e) or type(e).__name__)
+            JOBS.inc(kind=job.kind, result='failed')
+            return
+        self._finish(job, SUCCEEDED, result=result)
+        JOBS.inc(kind=job.kind, result='succeeded')
+
+    def _finish(self, job: Job, status: str, result: Any = None, error: Optional[str] = None) -> None:
+        now = time.time()
+        self._update(job, status=status, result=result, error=error, finished_at=now, expires_at=now + self.ttl)
+
+    def _update(self, job: Job, **changes) -> None:
+        with self._lock:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            subscribers = list(self._subscribers.get(job.id, ()))
+        if subscribers:
+            snapshot = self.snapshot(job)
+            for loop, queue in subscribers:
+                loop.call_soon_threadsafe(queue.put_nowait, snapshot)
+
+    def get(self, job_id: str, user_id: Optional[int] = None) -> Optional[Job]:
+        """Return the job if it exists, has not expired and (when given) belongs to ``user_id``."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None or (job.expires_at is not None and job.expires_at <= time.time()):
+            return None
+        if user_id is not None and job.user_id != user_id:
+            return None
+        return job
+
+    def queue_position(self, job: Job) -> Optional[int]:
+        """1-based position among queued jobs (in submission order), or None once it has started."""
+        with self._lock:
+            if job.status != QUEUED:
+                return None
+            return 1 + sum(1 for j in self._jobs.values() if j.status == QUEUED and j.seq < job.seq)
+
+    def snapshot(self, job: Job) -> dict:
+        return {
+            'job_id': job.id,
+            'kind': job.kind,
+            'status': job.status,
+            'queue_position': self.queue_position(job),
+            'created_at': job.created_at,
+            'started_at': job.started_at,
+            'finished_at': job.finished_at,
+            'expires_at': job.expires_at,
+            'error': job.error,
+        }
+
+    def subscribe(self, job: Job) -> asyncio.Queue:
+        """Queue that receives a snapshot on every change of ``job``; call from the event loop."""
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job.id, []).append((asyncio.get_running_loop(), queue))
+        return queue
+
+    def unsubscribe(self, job: Job, queue: asyncio.Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(job.id, [])
+            self._subscribers[job.id] = [s for s in subscribers if s[1] is not queue]
+            if not self._subscribers[job.id]:
+                del self._subscribers[job.id]
+
+    def purge(self) -> int:
+        """Drop finished jobs whose retention has run out."""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job.expires_at is not None and job.expires_at <= now]
+            for job_id in expired:
+                del self._jobs[job_id]
+            return len(expired)
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts: Dict[str, int] = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {'jobs': len(self._jobs), 'max_jobs': self.max_jobs, 'ttl': self.ttl, 'by_status': counts}
+
+
+# Global shared job store (jobs run on the inference executor)
+job_store = JobStore(inference_executor)
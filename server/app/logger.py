@@ -1,9 +1,144 @@
 """Operation logging utilities."""
-from typing import Optional
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
 from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .metrics import STAGE_SECONDS, registry
 from .models import OperationLog
 
 
+# Buffered writer: records are queued in memory and inserted in bulk by a background thread
+OPLOG_ASYNC = os.environ.get('OPLOG_ASYNC', '1').lower() in ('1', 'true', 'yes')
+OPLOG_QUEUE_SIZE = int(os.getenv('OPLOG_QUEUE_SIZE', '10000'))
+OPLOG_BATCH_SIZE = int(os.getenv('OPLOG_BATCH_SIZE', '200'))
+OPLOG_FLUSH_INTERVAL_MS = int(os.getenv('OPLOG_FLUSH_INTERVAL_MS', '1000'))
+
+OPLOG_DROPPED = registry.counter('stega_oplog_dropped_total', 'Operation log records dropped because the queue was full')
+OPLOG_WRITTEN = registry.counter('stega_oplog_written_total', 'Operation log records inserted by the background writer')
+OPLOG_FAILED = registry.counter('stega_oplog_failed_total', 'Operation log records lost to failed bulk inserts')
+
+_STOP = object()
+
+
+class OperationLogWriter:
+    """Background thread that bulk-inserts queued operation log records.
+
+    A batch is written when ``batch_size`` records are waiting or when the
+    oldest one has waited ``flush_interval_ms``. ``created_at`` is still set
+    by the database, so it can trail the request by up to one flush interval.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = OPLOG_QUEUE_SIZE,
+        batch_size: int = OPLOG_BATCH_SIZE,
+        flush_interval_ms: int = OPLOG_FLUSH_INTERVAL_MS,
+        session_factory=SessionLocal,
+    ) -> None:
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000.0
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+        self._session_factory = session_factory
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.running:
+                return
+            self._thread = threading.Thread(target=self._run, name='oplog-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: Optional[float] = 10.0) -> None:
+        """Write everything still queued, then stop the thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None:
+                return
+            self._queue.put(_STOP)
+            thread.join(timeout)
+            self._thread = None
+
+    def enqueue(self, record: dict) -> bool:
+        """Queue one record without blocking; returns False (and counts it) if the queue is full."""
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            OPLOG_DROPPED.inc()
+            return False
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._drain()
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            if stopping:
+                self._drain()
+                return
+
+    def _drain(self) -> None:
+        batch: List[dict] = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                batch.append(item)
+            if len(batch) >= self.batch_size:
+                self._write(batch)
+                batch = []
+        if batch:
+            self._write(batch)
+
+    def _write(self, batch: List[dict]) -> None:
+        db = self._session_factory()
+        try:
+            with STAGE_SECONDS.time(stage='log_flush'):
+                db.bulk_insert_mappings(OperationLog, batch)
+                db.commit()
+            OPLOG_WRITTEN.inc(len(batch))
+        except Exception as e:
+            print(f"Failed to write {len(batch)} operation logs: {e}")
+            OPLOG_FAILED.inc(len(batch))
+            db.rollback()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        return {
+            'running': self.running,
+            'queued': self._queue.qsize(),
+            'queue_size': self._queue.maxsize,
+            'written': int(OPLOG_WRITTEN.value()),
+            'dropped': int(OPLOG_DROPPED.value()),
+            'failed': int(OPLOG_FAILED.value()),
+        }
+
+
 def log_operation(
     db: Session,
     operation_type: str,
@@ -13,7 +148,7 @@ def log_operation(
     user_agent: Optional[str] = None
 ):
     """Log an operation.
-    
+
     Args:
         db: Database session
         operation_type: Type of operation (e.g., 'register', 'login', 'encode', 'decode')
@@ -21,25 +156,34 @@ def log_operation(
         operation_detail: Additional details (optional)
         ip_address: IP address (optional)
         user_agent: User agent string (optional)
-    
+
     Note: This function will not raise exceptions to avoid breaking the main flow.
+    While the background writer is running the record is only queued and
+    ``db`` is not used; otherwise it is written synchronously through ``db``.
     """
     try:
         # Truncate user_agent if too long
         if user_agent and len(user_agent) > 500:
             user_agent = user_agent[:500]
-        
-        log = OperationLog(
+
+        record = dict(
             user_id=user_id,
             operation_type=operation_type,
             operation_detail=operation_detail,
             ip_address=ip_address,
             user_agent=user_agent
         )
-        db.add(log)
-        db.commit()
+        if log_writer.running:
+            log_writer.enqueue(record)
+            return
+        with STAGE_SECONDS.time(stage='log_operation'):
+            db.add(OperationLog(**record))
+            db.commit()
     except Exception as e:
         # Don't raise exception, just log to console
         print(f"Failed to log operation {operation_type}: {e}")
         db.rollback()
 
+
+# Global shared writer (started by the app when OPLOG_ASYNC is enabled)
+log_writer = OperationLogWriter()
@@ -0,0 +1,316 @@
+"""Cached catalogue of the models under saved_models/ and their metadata.
+
+The directory is scanned once and then re-checked in the background (or on
+an explicit reload), so resolving a model name on the request path only
+reads memory. A model is re-inspected when the mtime or size of its
+``model/`` directory, ``saved_model.pb``, ``variables/`` or ``backend.json``
+changes.
+"""
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .backends import (
+    BACKEND_CONFIG, DEFAULT_TFLITE_DECODER, DEFAULT_TFLITE_ENCODER, _dir_size_bytes, backend_name, read_backend_config,
+)
+
+
+APP_ROOT = Path(__file__).resolve().parents[2]
+DEFAULT_MODELS_DIR = APP_ROOT / 'server' / 'saved_models'
+
+# Seconds between background checks for added, removed or replaced models; 0 disables them
+MODEL_REGISTRY_REFRESH_SECONDS = float(os.getenv('MODEL_REGISTRY_REFRESH_SECONDS', '30'))
+
+# Signature keys the TF1 loader in ModelRunner requires
+_TF1_INPUTS = ('secret', 'image')
+_TF1_OUTPUTS = ('stegastamp', 'residual', 'decoded')
+_TF2_FUNCTIONS = ('hide', 'reveal')
+
+
+class ModelInfo(NamedTuple):
+    name: str
+    root: str  # e.g. saved_models/stega
+    model_path: str  # root + '/model', the SavedModel directory handed to ModelRunner
+    format: Optional[str]  # SavedModel format 'tf1'/'tf2' (for tflite, the one it was converted from), or None
+    signatures: Dict[str, dict]
+    size_bytes: int
+    version: str
+    scanned_at: float
+    error: Optional[str] = None
+    backend: str = 'tf'  # 'tf' (SavedModel) or 'tflite', see backends.py
+    quantization: Optional[dict] = None  # mode and base_model of a variant written by convert_tflite.py --quantize
+
+    def describe(self) -> dict:
+        return {
+            'name': self.name,
+            'backend': self.backend,
+            'format': self.format,
+            'signatures': self.signatures,
+            'size_bytes': self.size_bytes,
+            'version': self.version,
+            'scanned_at': self.scanned_at,
+            'error': self.error,
+            'quantization': self.quantization,
+        }
+
+
+def _fingerprint(root: str) -> Optional[str]:
+    """mtime/size of the files that change when a model is replaced or converted, plus the backend in use.
+
+    None if the directory holds neither a SavedModel nor a backend.json.
+    """
+    model_path = os.path.join(root, 'model')
+    parts = []
+    for path in (model_path, os.path.join(model_path, 'saved_model.pb'), os.path.join(model_path, 'variables'),
+                 os.path.join(root, BACKEND_CONFIG)):
+        try:
+            st = os.stat(path)
+        except OSError:
+            parts.append('-')
+            continue
+        parts.append(f'{st.st_mtime_ns}:{st.st_size}')
+    if parts[0] == '-' and parts[3] == '-':
+        return None
+    try:
+        parts.append(backend_name(model_path))
+    except RuntimeError:
+        parts.append('invalid')
+    return '/'.join(parts)
+
+
+def _shape(tensor_shape) -> Optional[List[Optional[int]]]:
+    if tensor_shape.unknown_rank:
+        return None
+    return [dim.size if dim.size >= 0 else None for dim in tensor_shape.dim]
+
+
+def _tensor_specs(value, found: Dict[str, Optional[list]]) -> Dict[str, Optional[list]]:
+    """Collect ``name -> shape`` from a (nested) TF2 StructuredValue."""
+    kind = value.WhichOneof('kind')
+    if kind == 'tensor_spec_value':
+        found[value.tensor_spec_value.name] = _shape(value.tensor_spec_value.shape)
+    elif kind in ('tuple_value', 'list_value'):
+        for item in getattr(value, kind).values:
+            _tensor_specs(item, found)
+    elif kind == 'dict_value':
+        for key, item in value.dict_value.fields.items():
+            if item.WhichOneof('kind') == 'tensor_spec_value' and not item.tensor_spec_value.name:
+                found[key] = _shape(item.tensor_spec_value.shape)
+            else:
+                _tensor_specs(item, found)
+    return found
+
+
+def read_signatures(model_path: str) -> Tuple[Optional[str], Dict[str, dict]]:
+    """Parse ``saved_model.pb`` without loading the graph; returns ``(format, signatures)``.
+
+    TF1 models expose the ``serving_default`` signature ModelRunner loads;
+    TF2 models expose ``hide``/``reveal`` functions, whose input and output
+    specs are reported under those names.
+    """
+    from tensorflow.core.protobuf import saved_model_pb2  # type: ignore
+
+    saved_model = saved_model_pb2.SavedModel()
+    with open(os.path.join(model_path, 'saved_model.pb'), 'rb') as f:
+        saved_model.ParseFromString(f.read())
+    if not saved_model.meta_graphs:
+        return None, {}
+    meta_graph = saved_model.meta_graphs[0]
+
+    signatures = {}
+    for key, sig in meta_graph.signature_def.items():
+        if key.startswith('__'):
+            continue
+        signatures[key] = {
+            'inputs': {name: _shape(t.tensor_shape) for name, t in sig.inputs.items()},
+            'outputs': {name: _shape(t.tensor_shape) for name, t in sig.outputs.items()},
+        }
+    serving = signatures.get('serving_default')
+    if serving and all(k in serving['inputs'] for k in _TF1_INPUTS) \
+            and all(k in serving['outputs'] for k in _TF1_OUTPUTS):
+        return 'tf1', signatures
+
+    graph = meta_graph.object_graph_def
+    if graph.nodes:
+        children = {child.local_name: child.node_id for child in graph.nodes[0].children}
+        if all(name in children for name in _TF2_FUNCTIONS):
+            for name in _TF2_FUNCTIONS:
+                node = graph.nodes[children[name]]
+                for concrete in node.function.concrete_functions:
+                    fn = graph.concrete_functions[concrete]
+                    signatures[name] = {
+                        'inputs': _tensor_specs(fn.canonicalized_input_signature, {}),
+                        'outputs': _tensor_specs(fn.output_signature, {}),
+                    }
+            return 'tf2', signatures
+    return None, signatures
+
+
+def inspect_model(name: str, root: str, version: str) -> ModelInfo:
+    model_path = os.path.join(root, 'model')
+    error = None
+    backend = 'tf'
+    quantization = None
+    try:
+        config = read_backend_config(model_path)
+        backend = backend_name(model_path, config)
+        if backend == 'tflite':
+            # Recorded by convert_tflite.py, so a TFLite-only deployment never imports TensorFlow here
+            fmt, signatures = config.get('source_format'), config.get('signatures', {})
+            paths = [os.path.join(root, config.get(part, default))
+                     for part, default in (('encoder', DEFAULT_TFLITE_ENCODER), ('decoder', DEFAULT_TFLITE_DECODER))]
+            size_bytes = sum(os.path.getsize(path) for path in paths)
+            quantization = config.get('quantization')
+        else:
+            fmt, signatures = read_signatures(model_path)
+            size_bytes = _dir_size_bytes(model_path)
+            if fmt is None:
+                error = 'SavedModel has neither TF1 serving signatures nor TF2 hide/reveal functions'
+    except Exception as e:
+        fmt, signatures, size_bytes = None, {}, 0
+        error = f'{type(e).__name__}: {e}'
+    return ModelInfo(name, root, model_path, fmt, signatures, size_bytes, version, time.time(), error, backend,
+                     quantization)
+
+
+class ModelRegistry:
+    """Models found under ``models_dir`` (sub-directories with a ``model`` folder or a backend.json), plus ``MODEL_DIR``.
+
+    ``MODEL_DIR``, when set, names the default model directory and may lie
+    outside ``models_dir``; it is inspected like the others. Lookups never
+    touch the filesystem once the first scan has run.
+    """
+
+    def __init__(self, models_dir: Path = DEFAULT_MODELS_DIR,
+                 refresh_seconds: float = MODEL_REGISTRY_REFRESH_SECONDS) -> None:
+        self.models_dir = Path(models_dir)
+        self.refresh_seconds = refresh_seconds
+        self._models: Dict[str, ModelInfo] = {}
+        self._default: Optional[ModelInfo] = None
+        self._by_path: Dict[str, ModelInfo] = {}
+        self._scanned = False
+        self._scans = 0
+        self._last_scan: Optional[float] = None
+        self._lock = threading.Lock()
+        self._scan_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _ensure_scanned(self) -> None:
+        if not self._scanned:
+            self.scan()
+
+    def _reuse_or_inspect(self, name: str, root: str, old: Optional[ModelInfo]) -> Optional[ModelInfo]:
+        version = _fingerprint(root)
+        if version is None:
+            return None
+        if old is not None and old.version == version and old.root == root:
+            return old
+        return inspect_model(name, root, version)
+
+    def scan(self) -> List[str]:
+        """Re-check the models directory; returns the names that were added, removed or replaced."""
+        with self._scan_lock:
+            with self._lock:
+                old_models, old_default = dict(self._models), self._default
+            models: Dict[str, ModelInfo] = {}
+            try:
+                entries = sorted(p for p in self.models_dir.iterdir() if p.is_dir())
+            except OSError:
+                entries = []
+            for entry in entries:
+                info = self._reuse_or_inspect(entry.name, str(entry), old_models.get(entry.name))
+                if info is not None:
+                    models[entry.name] = info
+
+            default = None
+            env_dir = os.environ.get('MODEL_DIR')
+            if env_dir:
+                root = os.path.normpath(env_dir)
+                default = self._reuse_or_inspect(os.path.basename(root), root, old_default)
+
+            changed = sorted(name for name in set(old_models) | set(models)
+                             if old_models.get(name) is not models.get(name))
+            by_path = {os.path.normpath(info.model_path): info for info in models.values()}
+            if default is not None:
+                by_path[os.path.normpath(default.model_path)] = default
+            with self._lock:
+                self._models, self._default, self._by_path = models, default, by_path
+                self._scanned = True
+                self._scans += 1
+                self._last_scan = time.time()
+        if changed and self._scans > 1:
+            print(f"Model registry: changed models: {', '.join(changed)}")
+        return changed
+
+    def names(self) -> List[str]:
+        self._ensure_scanned()
+        with self._lock:
+            return sorted(self._models)
+
+    def get(self, name: str) -> Optional[ModelInfo]:
+        self._ensure_scanned()
+        with self._lock:
+            return self._models.get(name)
+
+    def default(self) -> Optional[ModelInfo]:
+        """The ``MODEL_DIR`` model if it is set and holds a SavedModel."""
+        self._ensure_scanned()
+        with self._lock:
+            return self._default
+
+    def version(self, model_path: str) -> Optional[str]:
+        """Fingerprint of the model at ``model_path`` (as passed to ModelRunner), if it is known."""
+        self._ensure_scanned()
+        with self._lock:
+            info = self._by_path.get(os.path.normpath(model_path))
+        return info.version if info is not None else None
+
+    def models(self) -> List[ModelInfo]:
+        self._ensure_scanned()
+        with self._lock:
+            return [self._models[name] for name in sorted(self._models)]
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Scan now and keep re-checking every ``refresh_seconds`` in a background thread."""
+        self.scan()
+        if self.refresh_seconds <= 0 or self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name='model-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        thread = self._thread
+        if thread is None:
+            return
+        self._stopping.set()
+        thread.join(timeout=5.0)
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stopping.wait(self.refresh_seconds):
+            try:
+                self.scan()
+            except Exception as e:
+                print(f"Failed to refresh model registry: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'models': len(self._models),
+                'default': self._default.name if self._default is not None else None,
+                'scans': self._scans,
+                'last_scan': self._last_scan,
+                'refresh_seconds': self.refresh_seconds,
+            }
+
+
+# Global shared registry
+model_registry = ModelRegistry()
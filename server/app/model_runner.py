@@ -1,192 +1,259 @@
 import io
+import logging
 import os
 import threading
-from typing import Optional, Tuple, Literal
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
 import numpy as np
-from PIL import Image, ImageOps
+from PIL import Image
 
+from .backends import InferenceBackend, load_backend
+from .metrics import DECODE_ROTATIONS, DECODES, MODEL_LOADS, RUNNER_WAIT_SECONDS, STAGE_SECONDS
+from .preprocess import apply_orientation, rotations, to_model_input
+
+logger = logging.getLogger(__name__)
 
 BCH_POLYNOMIAL = 137
 BCH_BITS = 5
 
+ROTATIONS = (0, 90, 180, 270)
+# Run all four rotations through the decoder as one batch instead of one call each
+DECODE_BATCH_ROTATIONS = os.environ.get('DECODE_BATCH_ROTATIONS', '1').lower() in ('1', 'true', 'yes')
+
+# Replica pool: number of independently loaded runners and TF threads per runner (0 = TF default)
+RUNNER_POOL_SIZE = int(os.getenv('RUNNER_POOL_SIZE', '1'))
+RUNNER_INTRA_OP_THREADS = int(os.getenv('RUNNER_INTRA_OP_THREADS', '0'))
+RUNNER_INTER_OP_THREADS = int(os.getenv('RUNNER_INTER_OP_THREADS', '0'))
+
+# Resident model cache per runner: max number of models and total on-disk size (0 = no size limit)
+MODEL_CACHE_SIZE = int(os.getenv('MODEL_CACHE_SIZE', '2'))
+MODEL_CACHE_MAX_MB = int(os.getenv('MODEL_CACHE_MAX_MB', '0'))
+
+# Precomputed secret bit vectors shared by all runners (one entry per short_id)
+SECRET_CACHE_SIZE = int(os.getenv('SECRET_CACHE_SIZE', '10000'))
+
+# Full-resolution encode: largest crop (in pixels) the residual is applied to; bigger crops are downscaled
+ENCODE_FULLRES_MAX_PIXELS = int(os.getenv('ENCODE_FULLRES_MAX_PIXELS', str(24 * 1000 * 1000)))
+# Rows of the full-resolution image processed per step, bounding the float32 scratch memory
+FULLRES_STRIP_ROWS = 256
+
+
+def _fit_box(width: int, height: int, size: Tuple[int, int] = (400, 400)) -> Tuple[int, int, int, int]:
+    """Centered crop box that ImageOps.fit uses to reach the aspect ratio of ``size``."""
+    output_ratio = size[0] / size[1]
+    if width / height > output_ratio:
+        crop_width, crop_height = height * output_ratio, height
+    else:
+        crop_width, crop_height = width, width / output_ratio
+    left = int(round((width - crop_width) / 2))
+    top = int(round((height - crop_height) / 2))
+    return left, top, left + int(round(crop_width)), top + int(round(crop_height))
+
+
+def _linear_taps(src_size: int, dst_size: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Pixel-center aligned bilinear sampling positions, as used by PIL/TF resize
+    pos = (np.arange(dst_size, dtype=np.float32) + 0.5) * (src_size / dst_size) - 0.5
+    pos = np.clip(pos, 0, src_size - 1)
+    lo = np.floor(pos).astype(np.intp)
+    hi = np.minimum(lo + 1, src_size - 1)
+    return lo, hi, (pos - lo).astype(np.float32)
+
+
+def add_upsampled_residual(pixels: np.ndarray, residual: np.ndarray) -> None:
+    """Bilinearly upsample a [h, w, 3] residual to ``pixels`` and add it in place.
+
+    ``pixels`` is a uint8 [H, W, 3] image; the residual is in [0, 1] image
+    units. Work is done in strips of FULLRES_STRIP_ROWS rows so the float32
+    scratch space never exceeds one strip, whatever the image size.
+    """
+    height, width = pixels.shape[:2]
+    residual = np.asarray(residual, dtype=np.float32) * 255.0
+    y_lo, y_hi, y_w = _linear_taps(residual.shape[0], height)
+    x_lo, x_hi, x_w = _linear_taps(residual.shape[1], width)
+    x_w = x_w[np.newaxis, :, np.newaxis]
+    for start in range(0, height, FULLRES_STRIP_ROWS):
+        stop = min(start + FULLRES_STRIP_ROWS, height)
+        wy = y_w[start:stop, np.newaxis, np.newaxis]
+        rows = residual[y_lo[start:stop]] * (1.0 - wy) + residual[y_hi[start:stop]] * wy
+        strip = rows[:, x_lo] * (1.0 - x_w)
+        strip += rows[:, x_hi] * x_w
+        strip += pixels[start:stop]
+        np.clip(strip, 0, 255, out=strip)
+        pixels[start:stop] = strip
+
+
+class SecretBitsCache:
+    """Bounded LRU of ready-to-feed [100] float32 secret bit vectors.
+
+    Entries are keyed by the secret string and the BCH parameters, so a
+    change of ``BCH_POLYNOMIAL``/``BCH_BITS`` never serves stale bits.
+    """
+
+    def __init__(self, max_entries: int = SECRET_CACHE_SIZE) -> None:
+        self.max_entries = max(0, max_entries)
+        self._entries: 'OrderedDict[Tuple[str, int, int], np.ndarray]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get_many(self, secret_strs: Sequence[str]) -> List[Optional[np.ndarray]]:
+        found: List[Optional[np.ndarray]] = []
+        with self._lock:
+            for secret_str in secret_strs:
+                key = (secret_str, BCH_POLYNOMIAL, BCH_BITS)
+                bits = self._entries.get(key)
+                if bits is None:
+                    self._misses += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                found.append(bits)
+        return found
+
+    def put(self, secret_str: str, bits: np.ndarray) -> None:
+        if self.max_entries == 0:
+            return
+        bits = np.array(bits, dtype=np.float32)
+        bits.flags.writeable = False
+        with self._lock:
+            self._entries[(secret_str, BCH_POLYNOMIAL, BCH_BITS)] = bits
+            self._entries.move_to_end((secret_str, BCH_POLYNOMIAL, BCH_BITS))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_entries,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
 
 class ModelRunner:
-    """Loads a SavedModel once and provides encode/decode helpers.
+    """Keeps recently used models resident and provides encode/decode helpers.
 
-    This class is NOT thread-safe; guard calls with an external lock.
+    Each model is run by an ``InferenceBackend`` (TF1/TF2 SavedModel or
+    TFLite, chosen per model; see backends.py). Up to ``cache_size`` models (and at most ``cache_max_bytes`` of them, by
+    on-disk size) stay loaded; the least recently used one is evicted first.
+
+    This class is NOT thread-safe; use one replica per thread via RunnerPool.
     """
 
-    def __init__(self) -> None:
-        # Lazy TensorFlow import/handles
-        self._tf = None
-        self._tag_constants = None
-        self._signature_constants = None
-        self._graph = None
-        self._sess = None
-        self._tf2_module = None
-        self._tf2_hide = None
-        self._tf2_reveal = None
-        self._mode: Optional[Literal['tf1', 'tf2']] = None
-        self._model_dir: Optional[str] = None
-
-        # Tensor handles
-        self._input_secret = None
-        self._input_image = None
-        self._output_stegastamp = None
-        self._output_residual = None
-        self._output_decoded = None
+    def __init__(
+        self,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        cache_size: int = MODEL_CACHE_SIZE,
+        cache_max_bytes: int = MODEL_CACHE_MAX_MB * 1024 * 1024,
+    ) -> None:
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+
+        # Resident models in LRU order (last = most recently used) and the active one
+        self._models: 'OrderedDict[str, InferenceBackend]' = OrderedDict()
+        self._model: Optional[InferenceBackend] = None
+        self._cache_size = max(1, cache_size)
+        self._cache_max_bytes = cache_max_bytes
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
 
         # BCH codec (lazy)
         self._bch = None
 
     @property
     def model_dir(self) -> Optional[str]:
-        return self._model_dir
+        return self._model.model_dir if self._model is not None else None
 
-    def _close(self) -> None:
-        try:
-            if self._sess is not None:
-                self._sess.close()
-        finally:
-            self._sess = None
-            self._graph = None
-            self._input_secret = None
-            self._input_image = None
-            self._output_stegastamp = None
-            self._output_residual = None
-            self._output_decoded = None
-            self._tf2_module = None
-            self._tf2_hide = None
-            self._tf2_reveal = None
-            self._mode = None
-
-    def _ensure_tf(self) -> None:
-        if self._tf is None:
-            try:
-                import tensorflow as tf  # type: ignore
-                from tensorflow.python.saved_model import tag_constants  # type: ignore
-                from tensorflow.python.saved_model import signature_constants  # type: ignore
-                self._tf = tf
-                self._tag_constants = tag_constants
-                self._signature_constants = signature_constants
-            except Exception as e:
-                raise RuntimeError(f'TensorFlow not available: {e}')
-
-    def _load_tf1_model(self, model_dir: str) -> None:
-        tf = self._tf
-        graph = tf.Graph()
-        sess = tf.compat.v1.Session(graph=graph)
-        with graph.as_default():
-            # model_dir 已经是完整路径（如 stega/model），直接使用
-            model = tf.compat.v1.saved_model.loader.load(sess, [self._tag_constants.SERVING], model_dir)
-
-            sig = model.signature_def[self._signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
-            # Inputs
-            if 'secret' in sig.inputs:
-                input_secret_name = sig.inputs['secret'].name
-                self._input_secret = graph.get_tensor_by_name(input_secret_name)
-            if 'image' in sig.inputs:
-                input_image_name = sig.inputs['image'].name
-                self._input_image = graph.get_tensor_by_name(input_image_name)
-
-            # Outputs (encoder)
-            if 'stegastamp' in sig.outputs:
-                output_stegastamp_name = sig.outputs['stegastamp'].name
-                self._output_stegastamp = graph.get_tensor_by_name(output_stegastamp_name)
-            if 'residual' in sig.outputs:
-                output_residual_name = sig.outputs['residual'].name
-                self._output_residual = graph.get_tensor_by_name(output_residual_name)
-
-            # Outputs (decoder)
-            if 'decoded' in sig.outputs:
-                output_decoded_name = sig.outputs['decoded'].name
-                self._output_decoded = graph.get_tensor_by_name(output_decoded_name)
-
-        missing = []
-        if self._input_secret is None:
-            missing.append('secret input')
-        if self._input_image is None:
-            missing.append('image input')
-        if self._output_stegastamp is None:
-            missing.append('stegastamp output')
-        if self._output_residual is None:
-            missing.append('residual output')
-        if self._output_decoded is None:
-            missing.append('decoded output')
-        if missing:
-            raise RuntimeError(f'TF1 SavedModel signatures missing: {", ".join(missing)}')
-
-        self._graph = graph
-        self._sess = sess
-        self._tf2_module = None
-        self._tf2_hide = None
-        self._tf2_reveal = None
-        self._mode = 'tf1'
-        self._model_dir = model_dir
-
-    def _load_tf2_model(self, model_dir: str) -> None:
-        tf = self._tf
-        module = tf.saved_model.load(model_dir)
-        hide_fn = getattr(module, 'hide', None)
-        reveal_fn = getattr(module, 'reveal', None)
-        if hide_fn is None or reveal_fn is None:
-            raise RuntimeError('SavedModel missing hide/reveal functions')
-        self._tf2_module = module
-        self._tf2_hide = hide_fn
-        self._tf2_reveal = reveal_fn
-        self._graph = None
-        self._sess = None
-        self._input_secret = None
-        self._input_image = None
-        self._output_stegastamp = None
-        self._output_residual = None
-        self._output_decoded = None
-        self._mode = 'tf2'
-        self._model_dir = model_dir
+    @property
+    def _mode(self) -> Optional[str]:
+        """Name of the active model's backend: 'tf1', 'tf2' or 'tflite'."""
+        return self._model.name if self._model is not None else None
+
+    def close(self) -> None:
+        """Unload every resident model."""
+        for model in self._models.values():
+            model.close()
+        self._models.clear()
+        self._model = None
+
+    def cache_stats(self) -> dict:
+        return {
+            'resident': list(self._models),
+            'size': len(self._models),
+            'max_size': self._cache_size,
+            'bytes': sum(m.size_bytes for m in self._models.values()),
+            'max_bytes': self._cache_max_bytes,
+            'hits': self._hits,
+            'misses': self._misses,
+            'evictions': self._evictions,
+        }
 
     def load(self, model_dir: str) -> None:
-        if self._model_dir == model_dir and (
-            (self._mode == 'tf1' and self._sess is not None) or (self._mode == 'tf2' and self._tf2_module is not None)
-        ):
+        """Make ``model_dir`` the active model, loading it from disk on a cache miss."""
+        cached = self._models.get(model_dir)
+        if cached is not None:
+            self._models.move_to_end(model_dir)
+            self._model = cached
+            self._hits += 1
             return
-        self._close()
-        self._ensure_tf()
-
-        tf1_error = None
-        try:
-            self._load_tf1_model(model_dir)
-            return
-        except Exception as exc:
-            tf1_error = exc
-            self._close()
-
-        try:
-            self._ensure_tf()
-            self._load_tf2_model(model_dir)
-        except Exception as exc:
-            detail = f'Failed to load model. TF1 error: {tf1_error}; TF2 error: {exc}'
-            raise RuntimeError(detail)
+        self._misses += 1
+
+        started = time.perf_counter()
+        loaded = load_backend(model_dir, self._intra_op_threads, self._inter_op_threads)
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage='model_load')
+        MODEL_LOADS.inc(model=os.path.basename(os.path.dirname(os.path.normpath(model_dir))))
+
+        self._models[model_dir] = loaded
+        self._model = loaded
+        self._evict()
+
+    def _evict(self) -> None:
+        # Never evict the model that was just made active
+        while len(self._models) > 1 and (
+            len(self._models) > self._cache_size
+            or (self._cache_max_bytes > 0
+                and sum(m.size_bytes for m in self._models.values()) > self._cache_max_bytes)
+        ):
+            _, oldest = self._models.popitem(last=False)
+            oldest.close()
+            self._evictions += 1
 
     def _preprocess_image(self, pil_img: Image.Image) -> np.ndarray:
         # Apply EXIF orientation if not already applied
         # (This is a safety measure in case the image wasn't processed earlier)
-        pil_img = ImageOps.exif_transpose(pil_img)
-        image = np.array(ImageOps.fit(pil_img.convert('RGB'), (400, 400)), dtype=np.float32)
-        image /= 255.0
-        return image
+        return to_model_input(apply_orientation(pil_img))
 
-    def _bits_to_message(self, secret_bits: np.ndarray) -> Optional[str]:
-        packet_binary = ''.join([str(int(round(bit))) for bit in secret_bits[:96]])
-        packet = bytes(int(packet_binary[i:i + 8], 2) for i in range(0, len(packet_binary), 8))
-        packet = bytearray(packet)
+    def _get_bch(self):
         if self._bch is None:
             try:
                 import bchlib  # type: ignore
                 self._bch = bchlib.BCH(BCH_POLYNOMIAL, BCH_BITS)
             except Exception as e:
                 raise RuntimeError(f'BCH library not available: {e}')
-        data, ecc = packet[:-self._bch.ecc_bytes], packet[-self._bch.ecc_bytes:]
-        bitflips = self._bch.decode_inplace(data, ecc)
+        return self._bch
+
+    @staticmethod
+    def _pack_bits(secret_bits: np.ndarray) -> np.ndarray:
+        """Round [N, 100] decoder bits and pack the first 96 into [N, 12] bytes (MSB first)."""
+        bits = np.asarray(secret_bits)[..., :96] > 0.5
+        return np.packbits(bits, axis=-1)
+
+    def _packet_to_message(self, packet: bytearray) -> Optional[str]:
+        bch = self._get_bch()
+        data, ecc = packet[:-bch.ecc_bytes], packet[-bch.ecc_bytes:]
+        bitflips = bch.decode_inplace(data, ecc)
         if bitflips != -1:
             try:
                 return data.decode('utf-8')
@@ -194,113 +261,310 @@ class ModelRunner:
                 return None
         return None
 
-    def _decode_bits(self, image: np.ndarray) -> Optional[str]:
-        if self._sess is None or self._graph is None or self._input_image is None or self._output_decoded is None:
-            raise RuntimeError('Model is not loaded or decoder signatures are missing')
+    def _bits_to_message(self, secret_bits: np.ndarray) -> Optional[str]:
+        return self._packet_to_message(bytearray(self._pack_bits(secret_bits).tobytes()))
 
-        feed = {self._input_image: [image]}
-        secret_bits = self._sess.run([self._output_decoded], feed_dict=feed)[0][0]
+    def _bits_to_messages(self, secret_bits: np.ndarray) -> List[Optional[str]]:
+        """BCH-decode every row of a [N, 100] bit matrix."""
+        packets = self._pack_bits(secret_bits)
+        return [self._packet_to_message(bytearray(row.tobytes())) for row in packets]
 
-        return self._bits_to_message(secret_bits)
+    def _run_decoder(self, images: np.ndarray) -> Optional[np.ndarray]:
+        """Run the decoder once on a [N, 400, 400, 3] batch and return [N, 100] bits."""
+        if self._model is None:
+            raise RuntimeError('Model is not loaded')
+        return self._model.decode(images)
 
-    def _encode_secret_to_bits(self, secret_str: str) -> list:
-        if len(secret_str) > 7:
-            raise ValueError('Can only encode 56 bits (7 characters) with ECC')
-        if self._bch is None:
+    def _run_encoder(self, images: np.ndarray, secrets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Run the encoder once on [N, 400, 400, 3] images and [N, 100] secrets."""
+        if self._model is None:
+            raise RuntimeError('Model is not loaded')
+        return self._model.encode(images, secrets)
+
+    @staticmethod
+    def _is_batch_dimension_error(model: InferenceBackend, exc: Exception) -> bool:
+        """True if ``exc`` looks like the graph rejecting a batch bigger than one."""
+        if model.batch_dim is not None and model.batch_dim != 1:
+            # The signature declares a batch dimension other than 1, so this is not it
+            return False
+        names = {cls.__name__ for cls in type(exc).__mro__}
+        if 'InvalidArgumentError' in names:
+            return True
+        if isinstance(exc, ValueError):
+            message = str(exc).lower()
+            return 'shape' in message or 'dimension' in message
+        return False
+
+    def _run_batched(self, fn, *arrays):
+        # Some exported graphs pin the batch dimension to 1; fall back to one
+        # call per row the first time a batched run is rejected for its shape.
+        m = self._model
+        count = len(arrays[0])
+        if count > 1 and m is not None and m.batch_supported is not False:
             try:
-                import bchlib  # type: ignore
-                self._bch = bchlib.BCH(BCH_POLYNOMIAL, BCH_BITS)
+                outputs = fn(*arrays)
+                m.batch_supported = True
+                return outputs
             except Exception as e:
-                raise RuntimeError(f'BCH library not available: {e}')
-        data = bytearray(secret_str + ' ' * (7 - len(secret_str)), 'utf-8')
-        ecc = self._bch.encode(data)
-        packet = data + ecc
-        packet_binary = ''.join(format(x, '08b') for x in packet)
-        bits = [int(x) for x in packet_binary]
-        bits.extend([0, 0, 0, 0])
+                if m.batch_supported or not self._is_batch_dimension_error(m, e):
+                    raise
+                m.batch_supported = False
+                logger.warning(f'{m.model_dir}: batched run rejected ({type(e).__name__}: {e}); '
+                               'running one row at a time from now on')
+        if count == 1:
+            return fn(*arrays)
+        rows = [fn(*(array[i:i + 1] for array in arrays)) for i in range(count)]
+        if any(row is None for row in rows):
+            return None
+        if isinstance(rows[0], tuple):
+            return tuple(np.concatenate(parts) for parts in zip(*rows))
+        return np.concatenate(rows)
+
+    def _compute_secret_bits(self, secret_strs: Sequence[str]) -> np.ndarray:
+        """BCH-encode each secret and unpack the packets into a [N, 100] float32 bit matrix."""
+        bch = self._get_bch()
+        packets = []
+        for secret_str in secret_strs:
+            if len(secret_str) > 7:
+                raise ValueError('Can only encode 56 bits (7 characters) with ECC')
+            data = bytearray(secret_str + ' ' * (7 - len(secret_str)), 'utf-8')
+            packets.append(bytes(data + bch.encode(data)))
+        packet_bytes = np.frombuffer(b''.join(packets), dtype=np.uint8).reshape(len(packets), -1)
+        packet_bits = np.unpackbits(packet_bytes, axis=1)
+        # Pad every row with four zero bits, as the model takes 100-bit secrets
+        bits = np.zeros((len(packets), packet_bits.shape[1] + 4), dtype=np.float32)
+        bits[:, :packet_bits.shape[1]] = packet_bits
         return bits
 
+    def _encode_secrets_to_bits(self, secret_strs: Sequence[str]) -> np.ndarray:
+        """Return the [N, 100] secret bits, computing only the ones missing from ``secret_cache``."""
+        rows = secret_cache.get_many(secret_strs)
+        missing = list(dict.fromkeys(s for s, row in zip(secret_strs, rows) if row is None))
+        if missing:
+            computed = dict(zip(missing, self._compute_secret_bits(missing)))
+            for secret_str, bits in computed.items():
+                secret_cache.put(secret_str, bits)
+            rows = [computed[s] if row is None else row for s, row in zip(secret_strs, rows)]
+        return np.stack(rows)
+
+    def _encode_secret_to_bits(self, secret_str: str) -> np.ndarray:
+        return self._encode_secrets_to_bits([secret_str])[0]
+
+    def check_bch(self) -> None:
+        """Load the BCH codec now; raises RuntimeError if bchlib is not available."""
+        self._get_bch()
+
+    def secret_bits(self, secret_strs: Sequence[str]) -> np.ndarray:
+        """The [N, 100] bits the encoder embeds for each secret: its BCH packet plus padding."""
+        return self._encode_secrets_to_bits(secret_strs)
+
+    def encode_bits(self, images: np.ndarray, secret_bits: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Run the encoder on [N, 400, 400, 3] model inputs and [N, 100] secret bits; returns (stegastamp, residual)."""
+        return self._run_batched(self._run_encoder, images, secret_bits)
+
+    def decode_bits(self, images: np.ndarray) -> Optional[np.ndarray]:
+        """Run the decoder on [N, 400, 400, 3] model inputs as given (no rotations, no BCH); returns [N, 100] bits."""
+        return self._run_batched(self._run_decoder, images)
+
     def encode(self, pil_img: Image.Image, secret_str: str) -> Tuple[Image.Image, Image.Image, Image.Image]:
-        if self._mode == 'tf1':
-            if self._sess is None or self._graph is None or self._input_secret is None or self._input_image is None:
-                raise RuntimeError('Model is not loaded or encoder signatures are missing')
-
-            image = self._preprocess_image(pil_img)
-            secret_bits = self._encode_secret_to_bits(secret_str)
-
-            feed = {self._input_secret: [secret_bits], self._input_image: [image]}
-            outputs = [self._output_stegastamp, self._output_residual]
-            hidden_img, residual = self._sess.run(outputs, feed_dict=feed)
-        elif self._mode == 'tf2':  
-            if self._tf2_hide is None or self._tf is None:
-                raise RuntimeError('TF2 model is not loaded')
-            tf = self._tf
-            image = self._preprocess_image(pil_img)
-            secret_bits = self._encode_secret_to_bits(secret_str)
-
-            image_tensor = tf.convert_to_tensor(image, dtype=tf.float32)
-            image_tensor = tf.expand_dims(image_tensor, axis=0)
-            secret_tensor = tf.convert_to_tensor(secret_bits, dtype=tf.float32)
-            secret_tensor = tf.expand_dims(secret_tensor, axis=0)  # [1, 100]
-            secret_tensor = tf.expand_dims(secret_tensor, axis=0)  # align with TF signature [1, 1, 100]
-
-            outputs = self._tf2_hide(secret=secret_tensor, image=image_tensor)
-            hidden_img = outputs.get('stega')
-            residual = outputs.get('residual')
-            if hidden_img is None or residual is None:
-                raise RuntimeError('TF2 encoder outputs missing expected tensors')
-            hidden_img = hidden_img.numpy()
-            residual = residual.numpy()
-        else:
+        return self.encode_batch([pil_img], [secret_str])[0]
+
+    def encode_batch(
+        self,
+        pil_imgs: Sequence[Image.Image],
+        secret_strs: Sequence[str],
+        full_resolution: bool = False,
+    ) -> List[Tuple[Image.Image, Image.Image, Image.Image]]:
+        """Encode several images in one encoder call; returns (hidden, raw, residual) per image.
+
+        With ``full_resolution`` the model still runs at 400x400, but the
+        hidden image is the original crop with the residual upsampled onto
+        it instead of the 400x400 model output.
+        """
+        if self._model is None:
             raise RuntimeError('Model is not loaded')
-
-        rescaled = (hidden_img[0] * 255).astype(np.uint8)
-        raw_img = (image * 255).astype(np.uint8)
-        residual = residual[0] + 0.5
-        residual = (residual * 255).astype(np.uint8)
-
-        im_raw = Image.fromarray(np.array(raw_img))
-        im_hidden = Image.fromarray(np.array(rescaled))
-        im_residual = Image.fromarray(np.squeeze(np.array(residual)))
-        return im_hidden, im_raw, im_residual
-
-    def decode(self, pil_img: Image.Image) -> Optional[str]:
-        if self._mode == 'tf1':
-            if self._sess is None or self._graph is None or self._input_image is None or self._output_decoded is None:
-                raise RuntimeError('Model is not loaded or decoder signatures are missing')
-
-            rotations = (0, 90, 180, 270)
-            for angle in rotations:
-                rotated = pil_img if angle == 0 else pil_img.rotate(angle, expand=True)
-                image = self._preprocess_image(rotated)
-                code = self._decode_bits(image)
+        if len(pil_imgs) != len(secret_strs):
+            raise ValueError('encode_batch needs one secret per image')
+
+        with STAGE_SECONDS.time(stage='preprocess'):
+            images = np.stack([self._preprocess_image(pil_img) for pil_img in pil_imgs])
+        with STAGE_SECONDS.time(stage='bch_encode'):
+            secrets = self._encode_secrets_to_bits(secret_strs)
+        with STAGE_SECONDS.time(stage='infer_encode'):
+            hidden_imgs, residuals = self._run_batched(self._run_encoder, images, secrets)
+
+        results = []
+        for pil_img, image, hidden_img, residual in zip(pil_imgs, images, hidden_imgs, residuals):
+            if full_resolution:
+                with STAGE_SECONDS.time(stage='fullres_residual'):
+                    im_hidden = self._fullres_hidden(pil_img, residual)
+            else:
+                rescaled = (hidden_img * 255).astype(np.uint8)
+                im_hidden = Image.fromarray(rescaled)
+            raw_img = (image * 255).astype(np.uint8)
+            residual = residual + 0.5
+            residual = (residual * 255).astype(np.uint8)
+
+            im_raw = Image.fromarray(raw_img)
+            im_residual = Image.fromarray(np.squeeze(residual))
+            results.append((im_hidden, im_raw, im_residual))
+        return results
+
+    def _fullres_hidden(self, pil_img: Image.Image, residual: np.ndarray) -> Image.Image:
+        pil_img = apply_orientation(pil_img).convert('RGB')
+        crop = pil_img.crop(_fit_box(*pil_img.size))
+        area = crop.width * crop.height
+        if area > ENCODE_FULLRES_MAX_PIXELS:
+            scale = (ENCODE_FULLRES_MAX_PIXELS / area) ** 0.5
+            crop = crop.resize((max(1, int(crop.width * scale)), max(1, int(crop.height * scale))), Image.LANCZOS)
+        pixels = np.array(crop)
+        add_upsampled_residual(pixels, residual)
+        return Image.fromarray(pixels)
+
+    def _first_valid_code(self, packets: np.ndarray) -> Optional[str]:
+        """Return the first packed row (in rotation order) that BCH-decodes to a message."""
+        tried = 0
+        code = None
+        with STAGE_SECONDS.time(stage='bch_decode'):
+            for row in packets:
+                tried += 1
+                code = self._packet_to_message(bytearray(row.tobytes()))
                 if code is not None:
-                    return code
-            return None
+                    break
+        DECODE_ROTATIONS.inc(tried)
+        return code
+
+    def decode(self, pil_img: Image.Image, batched: Optional[bool] = None) -> Optional[str]:
+        """Try every rotation and return the first valid code in rotation order.
+
+        In batched mode all rotations go through the decoder as a single
+        [4, 400, 400, 3] tensor; otherwise they are tried one at a time and
+        the loop stops at the first hit.
+        """
+        return self.decode_batch([pil_img], batched=batched)[0]
+
+    def _decode_sequential(self, pil_img: Image.Image) -> Optional[str]:
+        with STAGE_SECONDS.time(stage='preprocess'):
+            base = self._preprocess_image(pil_img)
+        for angle in ROTATIONS:
+            image = np.ascontiguousarray(np.rot90(base, k=angle // 90))
+            with STAGE_SECONDS.time(stage='infer_decode'):
+                secret_bits = self._run_decoder(image[np.newaxis])
+            if secret_bits is None:
+                continue
+            code = self._first_valid_code(self._pack_bits(secret_bits))
+            if code is not None:
+                return code
+        return None
 
-        if self._mode == 'tf2':
-            if self._tf2_reveal is None or self._tf is None:
-                raise RuntimeError('TF2 model is not loaded')
-            tf = self._tf
-            rotations = (0, 90, 180, 270)
-            for angle in rotations:
-                rotated = pil_img if angle == 0 else pil_img.rotate(angle, expand=True)
-                image = self._preprocess_image(rotated)
-                image_tensor = tf.convert_to_tensor(image, dtype=tf.float32)
-                image_tensor = tf.expand_dims(image_tensor, axis=0)
-                outputs = self._tf2_reveal(image=image_tensor)
-                decoded = outputs.get('decoded')
-                if decoded is None:
-                    continue
-                secret_bits = tf.round(tf.sigmoid(decoded)).numpy()[0]
-                code = self._bits_to_message(secret_bits)
-                if code is not None:
-                    return code
-            return None
+    def decode_batch(self, pil_imgs: Sequence[Image.Image], batched: Optional[bool] = None) -> List[Optional[str]]:
+        """Decode several images, all rotations of all images in one decoder call."""
+        if self._model is None:
+            raise RuntimeError('Model is not loaded')
+        if batched is None:
+            batched = DECODE_BATCH_ROTATIONS
+        if not batched:
+            codes = [self._decode_sequential(pil_img) for pil_img in pil_imgs]
+        else:
+            codes = self._decode_rotations_batched(pil_imgs)
+        for code in codes:
+            DECODES.inc(result='success' if code is not None else 'failure')
+        return codes
+
+    def _decode_rotations_batched(self, pil_imgs: Sequence[Image.Image]) -> List[Optional[str]]:
+        # Each upload is resized once; its rotations are exact 90-degree turns of that array
+        with STAGE_SECONDS.time(stage='preprocess'):
+            images = np.concatenate([rotations(self._preprocess_image(pil_img), ROTATIONS) for pil_img in pil_imgs])
+        with STAGE_SECONDS.time(stage='infer_decode'):
+            secret_bits = self._run_batched(self._run_decoder, images)
+        if secret_bits is None:
+            return [None] * len(pil_imgs)
+        # Pack all rows in one go; BCH still stops at the first valid rotation per image
+        packets = self._pack_bits(secret_bits)
+        step = len(ROTATIONS)
+        return [self._first_valid_code(packets[i:i + step]) for i in range(0, len(packets), step)]
+
+
+class RunnerPool:
+    """Fixed set of ModelRunner replicas, each handed to one thread at a time."""
+
+    def __init__(
+        self,
+        size: int = RUNNER_POOL_SIZE,
+        intra_op_threads: int = RUNNER_INTRA_OP_THREADS,
+        inter_op_threads: int = RUNNER_INTER_OP_THREADS,
+    ) -> None:
+        self.replicas = [ModelRunner(intra_op_threads, inter_op_threads) for _ in range(max(1, size))]
+        self._free = list(self.replicas)
+        self._cond = threading.Condition()
 
-        raise RuntimeError('Model is not loaded')
+    @property
+    def size(self) -> int:
+        return len(self.replicas)
+
+    @contextmanager
+    def acquire(self, model_dir: Optional[str] = None) -> Iterator[ModelRunner]:
+        """Borrow a free replica, preferring one that already has ``model_dir`` loaded."""
+        started = time.perf_counter()
+        with self._cond:
+            while not self._free:
+                self._cond.wait()
+            replica = next((r for r in self._free if r.model_dir == model_dir), self._free[-1])
+            self._free.remove(replica)
+        RUNNER_WAIT_SECONDS.observe(time.perf_counter() - started)
+        try:
+            yield replica
+        finally:
+            self._release(replica)
+
+    @contextmanager
+    def acquire_replica(self, index: int) -> Iterator[ModelRunner]:
+        """Borrow one specific replica, waiting until it is free."""
+        replica = self.replicas[index]
+        with self._cond:
+            while replica not in self._free:
+                self._cond.wait()
+            self._free.remove(replica)
+        try:
+            yield replica
+        finally:
+            self._release(replica)
+
+    def _release(self, replica: ModelRunner) -> None:
+        with self._cond:
+            self._free.append(replica)
+            self._cond.notify_all()
+
+    def resident_models(self) -> Dict[str, int]:
+        """Number of replicas that have each model directory loaded."""
+        counts: Dict[str, int] = {}
+        for replica in self.replicas:
+            for model_dir in list(replica._models):
+                key = os.path.normpath(model_dir)
+                counts[key] = counts.get(key, 0) + 1
+        return counts
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                'size': self.size,
+                'free': len(self._free),
+                'model_cache': [r.cache_stats() for r in self.replicas],
+            }
+
+
+def prefill_secret_cache(secret_strs: Sequence[str]) -> int:
+    """Precompute bit vectors for ``secret_strs`` (e.g. every users.short_id); returns the count added."""
+    valid = [s for s in dict.fromkeys(secret_strs) if s and len(s) <= 7][:secret_cache.max_entries]
+    if not valid:
+        return 0
+    # A throwaway runner keeps the BCH codec off the replicas that may be serving requests
+    bits = ModelRunner()._compute_secret_bits(valid)
+    for secret_str, row in zip(valid, bits):
+        secret_cache.put(secret_str, row)
+    return len(valid)
 
 
 # Global shared state
-runner = ModelRunner()
-global_lock = threading.Lock()
+secret_cache = SecretBitsCache()
+pool = RunnerPool()
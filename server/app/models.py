@@ -70,3 +70,26 @@ class OperationLog(Base):
     def __repr__(self):
         return f"<OperationLog(id={self.id}, user_id={self.user_id}, operation_type={self.operation_type})>"
 
+
+
+class EmailOutbox(Base):
+    """Queued outgoing verification email, drained by the background sender."""
+    __tablename__ = 'email_outbox'
+
+    id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    verification_code_id = Column(Integer, ForeignKey('verification_codes.id'), nullable=False, comment='验证码ID')
+    status = Column(String(20), default='pending', nullable=False, comment='状态: pending, sending, sent, failed, skipped')
+    attempts = Column(Integer, default=0, nullable=False, comment='发送尝试次数')
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, comment='下次尝试时间')
+    claimed_at = Column(DateTime(timezone=True), nullable=True, comment='发送进程认领时间')
+    last_error = Column(Text, nullable=True, comment='最近一次错误')
+    created_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, comment='创建时间')
+    sent_at = Column(DateTime(timezone=True), nullable=True, comment='发送时间')
+
+    # Indexes
+    __table_args__ = (
+        Index('idx_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, verification_code_id={self.verification_code_id}, status={self.status})>"
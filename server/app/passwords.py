@@ -0,0 +1,49 @@
+"""Password hashing (bcrypt).
+
+Kept free of database and web imports so the bcrypt worker processes,
+which import this module on their own, start quickly.
+"""
+from passlib.context import CryptContext
+
+# Password hashing
+# Use bcrypt with fallback handling for version compatibility
+try:
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+except Exception as e:
+    # If bcrypt initialization fails, log warning but continue
+    # The error might be about version detection but bcrypt should still work
+    import warnings
+    warnings.warn(f"bcrypt context initialization warning: {e}")
+    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash."""
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def get_password_hash(password: str) -> str:
+    """Hash a password.
+    
+    Note: bcrypt has a 72-byte limit for passwords. If the password exceeds
+    this limit, it will be truncated to 72 bytes (not 72 characters).
+    """
+    # Convert password to bytes to check length
+    password_bytes = password.encode('utf-8')
+    
+    # bcrypt has a 72-byte limit, truncate if necessary
+    if len(password_bytes) > 72:
+        password_bytes = password_bytes[:72]
+        password = password_bytes.decode('utf-8', errors='ignore')
+    
+    try:
+        return pwd_context.hash(password)
+    except Exception as e:
+        # If bcrypt fails, try to handle the error gracefully
+        error_msg = str(e)
+        if "cannot be longer than 72 bytes" in error_msg:
+            # Final fallback: truncate to 72 bytes and try again
+            password_bytes = password.encode('utf-8')[:72]
+            password = password_bytes.decode('utf-8', errors='ignore')
+            return pwd_context.hash(password)
+        raise
@@ -0,0 +1,53 @@
+"""Upload decoding and model-input preprocessing."""
+from typing import BinaryIO, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from .metrics import STAGE_SECONDS
+
+MODEL_INPUT_SIZE = (400, 400)
+EXIF_ORIENTATION = 0x0112
+
+# Modes that can be resized first and converted to RGB afterwards without changing the result
+_RESIZE_BEFORE_CONVERT = ('RGB', 'L')
+
+
+def apply_orientation(pil_img: Image.Image) -> Image.Image:
+    """Apply the EXIF orientation, skipping the copy ``exif_transpose`` makes when there is none."""
+    if pil_img.getexif().get(EXIF_ORIENTATION, 1) == 1:
+        return pil_img
+    return ImageOps.exif_transpose(pil_img)
+
+
+def open_image(fileobj: BinaryIO, draft_size: Optional[Tuple[int, int]] = MODEL_INPUT_SIZE) -> Image.Image:
+    """Open an upload and apply its EXIF orientation exactly once.
+
+    For JPEGs with a ``draft_size`` the decoder uses DCT scaling to produce
+    the smallest image that is still at least ``draft_size`` on both sides,
+    so a 12 MP photo is decoded at roughly 1/4 or 1/8 scale. Pass
+    ``draft_size=None`` when the full resolution is needed.
+    """
+    with STAGE_SECONDS.time(stage='image_decode'):
+        pil_img = Image.open(fileobj)
+        if draft_size is not None and pil_img.format == 'JPEG':
+            pil_img.draft('RGB', draft_size)
+        # Decode here rather than lazily so the time is attributed to this stage
+        pil_img.load()
+    with STAGE_SECONDS.time(stage='exif_orientation'):
+        return apply_orientation(pil_img)
+
+
+def to_model_input(pil_img: Image.Image, size: Tuple[int, int] = MODEL_INPUT_SIZE) -> np.ndarray:
+    """Center-crop and resize to ``size`` and return a normalized [H, W, 3] float32 array."""
+    if pil_img.mode in _RESIZE_BEFORE_CONVERT:
+        fitted = ImageOps.fit(pil_img, size).convert('RGB')
+    else:
+        fitted = ImageOps.fit(pil_img.convert('RGB'), size)
+    # One float32 allocation: scale straight from the uint8 view
+    return np.multiply(np.asarray(fitted), np.float32(1.0 / 255.0), dtype=np.float32)
+
+
+def rotations(image: np.ndarray, angles: Tuple[int, ...] = (0, 90, 180, 270)) -> np.ndarray:
+    """Stack counter-clockwise rotations of one preprocessed [H, W, 3] image into [len(angles), H, W, 3]."""
+    return np.stack([np.rot90(image, k=angle // 90) for angle in angles])
@@ -0,0 +1,293 @@
+"""Content-addressed caches for encode and decode results.
+
+Keys hash the uploaded bytes together with the model (path and the model
+registry's version fingerprint, so replacing a model invalidates its
+entries) and, for encode, the message and output options. Decode results
+live in a per-process LRU; encoded files live in a size-capped directory
+that several worker processes on one host can share.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from .metrics import registry
+from .model_registry import model_registry
+
+try:
+    import fcntl  # type: ignore
+except ImportError:  # Windows: eviction scans are simply not serialized across processes
+    fcntl = None
+
+
+APP_ROOT = Path(__file__).resolve().parents[2]
+
+DECODE_CACHE_SIZE = int(os.getenv('DECODE_CACHE_SIZE', '10000'))  # 0 disables
+DECODE_CACHE_TTL = float(os.getenv('DECODE_CACHE_TTL', '3600'))
+ENCODE_CACHE_DIR = os.getenv('ENCODE_CACHE_DIR', str(APP_ROOT / 'server' / 'cache' / 'encoded'))
+ENCODE_CACHE_MAX_MB = int(os.getenv('ENCODE_CACHE_MAX_MB', '512'))  # 0 disables
+ENCODE_CACHE_TTL = float(os.getenv('ENCODE_CACHE_TTL', '86400'))
+
+_HASH_CHUNK = 1024 * 1024
+
+CACHE_LOOKUPS = registry.counter('stega_result_cache_lookups_total', 'Result cache lookups', ('cache', 'result'))
+
+
+def hash_upload(fileobj: BinaryIO) -> str:
+    """SHA-256 of an upload's bytes; the file position is restored afterwards."""
+    position = fileobj.tell()
+    digest = hashlib.sha256()
+    while True:
+        chunk = fileobj.read(_HASH_CHUNK)
+        if not chunk:
+            break
+        digest.update(chunk)
+    fileobj.seek(position)
+    return digest.hexdigest()
+
+
+def _model_version(model_path: str) -> str:
+    version = model_registry.version(model_path)
+    if version is not None:
+        return version
+    try:
+        return str(os.stat(model_path).st_mtime_ns)
+    except OSError:
+        return '0'
+
+
+def result_key(upload_digest: str, model_path: str, *parts) -> str:
+    """Cache key for one upload, model and any extra request parameters (message, format, ...)."""
+    material = '\0'.join([upload_digest, os.path.abspath(model_path), _model_version(model_path)]
+                         + [str(p) for p in parts])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+class DecodeResultCache:
+    """In-memory LRU of decoded messages (``None`` for images without a valid code) with a TTL."""
+
+    def __init__(self, max_entries: int = DECODE_CACHE_SIZE, ttl: float = DECODE_CACHE_TTL) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Optional[str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str) -> Tuple[bool, Optional[str]]:
+        """Return ``(found, message)``; a found entry may hold ``None``."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                CACHE_LOOKUPS.inc(cache='decode', result='hit')
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self._misses += 1
+        CACHE_LOOKUPS.inc(cache='decode', result='miss')
+        return False, None
+
+    def put(self, key: str, message: Optional[str]) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, message)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+class EncodedFileCache:
+    """Size-capped directory of encoded outputs, one file per key.
+
+    Safe for several processes: files are written to a temporary name and
+    renamed into place, readers tolerate files vanishing, and a file's
+    mtime is bumped on every hit so eviction removes the least recently
+    used entries first. Entries older than ``ttl`` since their last use
+    are treated as missing and removed.
+
+    The directory's total size is kept in a ``.size`` file that every
+    process updates under the ``.lock`` flock, so the cap holds for the
+    directory as a whole rather than per process.
+    """
+
+    def __init__(self, directory: str = ENCODE_CACHE_DIR, max_bytes: int = ENCODE_CACHE_MAX_MB * 1024 * 1024,
+                 ttl: float = ENCODE_CACHE_TTL) -> None:
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._approx_bytes: Optional[int] = None
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def _path(self, key: str) -> Path:
+        # Two-level fan-out keeps directories small
+        return self.directory / key[:2] / key
+
+    def get(self, key: str) -> Optional[bytes]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - path.stat().st_mtime > self.ttl:
+                # Left in the shared total until the next eviction scan recounts it
+                path.unlink()
+                raise FileNotFoundError(path)
+            data = path.read_bytes()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self._misses += 1
+            CACHE_LOOKUPS.inc(cache='encode', result='miss')
+            return None
+        with self._lock:
+            self._hits += 1
+        CACHE_LOOKUPS.inc(cache='encode', result='hit')
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        if not self.enabled or len(data) > self.max_bytes:
+            return
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as tmp:
+                    tmp.write(data)
+                with self._locked():
+                    try:
+                        replaced = path.stat().st_size
+                    except OSError:
+                        replaced = 0
+                    os.replace(tmp_name, path)
+                    total = self._read_total()
+                    if total is None:
+                        self._evict_locked()
+                        return
+                    total += len(data) - replaced
+                    if total > self.max_bytes:
+                        self._evict_locked()
+                    else:
+                        self._write_total(total)
+            except BaseException:
+                try:
+                    os.unlink(tmp_name)
+                except OSError:
+                    pass
+                raise
+        except OSError as e:
+            print(f"Failed to store encoded result in cache: {e}")
+
+    def evict(self) -> None:
+        """Delete expired entries, then the least recently used ones until under ``max_bytes``."""
+        with self._locked():
+            self._evict_locked()
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold the thread lock and the directory's ``.lock`` flock shared with other processes."""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with self._lock, open(self.directory / '.lock', 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def _read_total(self) -> Optional[int]:
+        # None when no process has scanned the directory yet (or the file is damaged)
+        try:
+            return int((self.directory / '.size').read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write_total(self, total: int) -> None:
+        (self.directory / '.size').write_text(str(total))
+        self._approx_bytes = total
+
+    def _evict_locked(self) -> None:
+        entries = []
+        now = time.time()
+        for path in self.directory.glob('*/*'):
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if path.name.startswith('.tmp-'):
+                # Leftover from a process that died mid-write, or another process's write in progress
+                if now - st.st_mtime > 3600:
+                    self._unlink(path)
+                continue
+            if now - st.st_mtime > self.ttl:
+                self._unlink(path)
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        entries.sort()
+        # Evict down to 90% so that one put doesn't trigger a scan every time
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in entries:
+            if total <= target:
+                break
+            if self._unlink(path):
+                total -= size
+        self._write_total(total)
+
+    def _unlink(self, path: Path) -> bool:
+        try:
+            path.unlink()
+        except OSError:
+            return False
+        self._evictions += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'directory': str(self.directory),
+                'max_bytes': self.max_bytes,
+                'approx_bytes': self._approx_bytes,
+                'ttl': self.ttl,
+                'hits': self._hits,
+                'misses': self._misses,
+                'evictions': self._evictions,
+            }
+
+
+# Global shared caches
+decode_cache = DecodeResultCache()
+encode_cache = EncodedFileCache()
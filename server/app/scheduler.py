@@ -0,0 +1,196 @@
+"""Micro-batching inference scheduler in front of ModelRunner."""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Deque, Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from .metrics import BATCH_SIZE, QUEUE_WAIT_SECONDS
+from .model_runner import RunnerPool, pool
+
+
+# A batch is flushed when it reaches INFER_MAX_BATCH jobs or when its oldest
+# job has waited INFER_MAX_WAIT_MS milliseconds, whichever comes first.
+INFER_MAX_BATCH = int(os.getenv('INFER_MAX_BATCH', '8'))
+INFER_MAX_WAIT_MS = float(os.getenv('INFER_MAX_WAIT_MS', '5'))
+
+QueueKey = Tuple[str, str]  # (kind, model_path); kind is encode, encode_full or decode
+
+
+class _Job:
+    __slots__ = ('args', 'future', 'enqueued_at')
+
+    def __init__(self, args: tuple) -> None:
+        self.args = args
+        self.future: Future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class InferenceScheduler:
+    """Queues encode/decode jobs per model and runs each queue as one batched call.
+
+    Callers get a ``concurrent.futures.Future`` back from ``submit_*``; the
+    blocking ``encode``/``decode`` helpers wait on it. One worker thread runs
+    per pool replica, so up to ``pool.size`` batches execute concurrently.
+    """
+
+    def __init__(
+        self,
+        pool: RunnerPool,
+        max_batch: int = INFER_MAX_BATCH,
+        max_wait_ms: float = INFER_MAX_WAIT_MS,
+    ) -> None:
+        self._pool = pool
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queues: Dict[QueueKey, Deque[_Job]] = {}
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._stopping = False
+        self._batches = 0
+        self._jobs = 0
+
+    def submit_encode(
+        self, model_path: str, pil_img: Image.Image, secret_str: str, full_resolution: bool = False
+    ) -> Future:
+        kind = 'encode_full' if full_resolution else 'encode'
+        return self._submit((kind, model_path), (pil_img, secret_str))
+
+    def submit_decode(self, model_path: str, pil_img: Image.Image) -> Future:
+        return self._submit(('decode', model_path), (pil_img,))
+
+    def encode(self, model_path: str, pil_img: Image.Image, secret_str: str, full_resolution: bool = False):
+        return self.submit_encode(model_path, pil_img, secret_str, full_resolution).result()
+
+    def decode(self, model_path: str, pil_img: Image.Image) -> Optional[str]:
+        return self.submit_decode(model_path, pil_img).result()
+
+    def queue_depth(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def stats(self) -> dict:
+        with self._cond:
+            depth = {f'{kind}:{os.path.basename(os.path.dirname(path))}': len(q)
+                     for (kind, path), q in self._queues.items() if q}
+            return {
+                'queue_depth': sum(depth.values()),
+                'queues': depth,
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000.0,
+                'batches_run': self._batches,
+                'jobs_run': self._jobs,
+            }
+
+    def start(self) -> None:
+        with self._cond:
+            if self._threads:
+                return
+            self._stopping = False
+            for i in range(self._pool.size):
+                thread = threading.Thread(target=self._worker, name=f'inference-scheduler-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Stop the workers after the queued jobs have been flushed."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            threads = self._threads
+        for thread in threads:
+            thread.join()
+        with self._cond:
+            self._threads = []
+
+    def _submit(self, key: QueueKey, args: tuple) -> Future:
+        job = _Job(args)
+        with self._cond:
+            if self._stopping:
+                raise RuntimeError('Inference scheduler is shutting down')
+            self._queues.setdefault(key, deque()).append(job)
+            self._cond.notify()
+        if not self._threads:
+            self.start()
+        return job.future
+
+    def _next_ready(self) -> Tuple[Optional[QueueKey], Optional[float]]:
+        """Return the queue to flush now, or how long to sleep before checking again."""
+        now = time.monotonic()
+        ready_key = None
+        ready_since = None
+        timeout = None
+        for key, queue in self._queues.items():
+            if not queue:
+                continue
+            head = queue[0].enqueued_at
+            if len(queue) >= self.max_batch or self._stopping or now - head >= self.max_wait:
+                if ready_since is None or head < ready_since:
+                    ready_key, ready_since = key, head
+            else:
+                remaining = head + self.max_wait - now
+                timeout = remaining if timeout is None else min(timeout, remaining)
+        return ready_key, timeout
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    key, timeout = self._next_ready()
+                    if key is not None:
+                        break
+                    if self._stopping:
+                        return
+                    self._cond.wait(timeout)
+                queue = self._queues[key]
+                jobs = [queue.popleft() for _ in range(min(self.max_batch, len(queue)))]
+                if any(self._queues.values()):
+                    # Hand the remaining work to another idle worker
+                    self._cond.notify()
+            self._run(key, jobs)
+
+    def _run(self, key: QueueKey, jobs: List[_Job]) -> None:
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        kind, model_path = key
+        now = time.monotonic()
+        for job in jobs:
+            QUEUE_WAIT_SECONDS.observe(now - job.enqueued_at, kind=kind)
+        BATCH_SIZE.observe(len(jobs), kind=kind)
+        try:
+            results = self._run_batch(kind, model_path, [job.args for job in jobs])
+        except Exception as exc:
+            if len(jobs) == 1:
+                jobs[0].future.set_exception(exc)
+                return
+            # Re-run one at a time so a single bad upload doesn't fail its neighbours
+            for job in jobs:
+                try:
+                    job.future.set_result(self._run_batch(kind, model_path, [job.args])[0])
+                except Exception as job_exc:
+                    job.future.set_exception(job_exc)
+            return
+        for job, result in zip(jobs, results):
+            job.future.set_result(result)
+
+    def _run_batch(self, kind: str, model_path: str, batch: List[tuple]) -> list:
+        with self._pool.acquire(model_path) as runner:
+            runner.load(model_path)
+            if kind in ('encode', 'encode_full'):
+                results = runner.encode_batch(
+                    [a[0] for a in batch], [a[1] for a in batch], full_resolution=(kind == 'encode_full')
+                )
+            else:
+                results = runner.decode_batch([a[0] for a in batch])
+        with self._cond:
+            self._batches += 1
+            self._jobs += len(batch)
+        return results
+
+
+# Global shared scheduler
+scheduler = InferenceScheduler(pool)
@@ -1,71 +1,141 @@
+import asyncio
 import io
+import json
 import os
 import re
+import secrets
+import time
+from concurrent.futures import Future
 from pathlib import Path
-from typing import Optional
+from typing import List, Optional, Tuple
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Depends, status
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends, status
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr
-from PIL import Image, ImageOps
+from PIL import Image, UnidentifiedImageError
 from sqlalchemy.orm import Session
 
-from .model_runner import runner, global_lock
-from .database import get_db, init_db
+from .model_runner import pool, secret_cache, prefill_secret_cache
+from .model_registry import model_registry, ModelInfo, DEFAULT_MODELS_DIR
+from .preprocess import open_image, MODEL_INPUT_SIZE
+from .output import negotiate, save_options, write_image, encode_bytes, ChunkStream, OutputFormat, JPEG_WARNING
+from .batch import response_writer
+from .jobs import job_store, JobStoreFull, Job, SUCCEEDED
+from .result_cache import decode_cache, encode_cache, hash_upload, result_key
+from .scheduler import scheduler
+from .executor import inference_executor, password_executor, ExecutorFull, INFERENCE_RETRY_AFTER
+from .warmup import readiness, start_warm_up
+from .metrics import registry, STAGE_SECONDS
+from .database import get_db, init_db, SessionLocal
 from .models import User
 from .auth import (
-    verify_password, get_password_hash, generate_short_id,
-    create_access_token, verify_token, get_user_by_email_or_username,
-    get_user_by_id, is_email_or_username_taken, SECRET_KEY
+    verify_password_async, get_password_hash_async, generate_short_id,
+    create_access_token, get_user_by_email_or_username,
+    get_short_ids, is_email_or_username_taken, SECRET_KEY,
+    verify_token_cached, get_user_by_id_cached, invalidate_user, auth_cache_stats
 )
 from .verification import create_verification_code, verify_code
-from .logger import log_operation
+from .logger import log_operation, log_writer, OPLOG_ASYNC
+from .email_service import email_outbox, EMAIL_OUTBOX
 from fastapi import Request
 
 
 APP_ROOT = Path(__file__).resolve().parents[2]
-DEFAULT_MODELS_DIR = APP_ROOT / 'server' / 'saved_models'
 TMP_DIR = APP_ROOT / 'server' / 'tmp'
 TMP_DIR.mkdir(parents=True, exist_ok=True)
 
 MESSAGE_RE = re.compile(r'^[A-Za-z0-9]{7}$')
+# Default for the encode `full_resolution` form field
+ENCODE_FULL_RESOLUTION = os.environ.get('ENCODE_FULL_RESOLUTION', '').lower() in ('1', 'true', 'yes')
+SECRET_CACHE_PREFILL = os.environ.get('SECRET_CACHE_PREFILL', '1').lower() in ('1', 'true', 'yes')
+# Most images accepted by one /encode/batch or /decode/batch request
+BATCH_MAX_IMAGES = int(os.getenv('BATCH_MAX_IMAGES', '50'))
+# Shared secret for admin endpoints (X-Admin-Token header); empty disables them
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN', '')
+# Seconds between keep-alive comments on an idle job event stream
+JOB_EVENTS_KEEPALIVE = float(os.getenv('JOB_EVENTS_KEEPALIVE', '15'))
 
 app = FastAPI(title='ImageProcess Stega API', version='v1')
 
 # Security
 security = HTTPBearer()
 
+registry.gauge('stega_executor_pending', 'Jobs running or queued on the inference executor',
+               lambda: inference_executor.stats()['pending'])
+registry.gauge('stega_scheduler_queue_depth', 'Jobs waiting in the batching scheduler', scheduler.queue_depth)
+registry.gauge('stega_runners_free', 'Idle ModelRunner replicas', lambda: pool.stats()['free'])
+
+
+class RequestStartMiddleware:
+    """Stamp each request's arrival time so handlers can measure body parsing and dependencies."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            scope.setdefault('state', {})['received_at'] = time.perf_counter()
+        await self.app(scope, receive, send)
+
+
+app.add_middleware(RequestStartMiddleware)
+
+
+def _observe_upload(req: Optional[Request]) -> None:
+    """Record the time from request arrival to handler entry (multipart spooling, auth)."""
+    received_at = getattr(req.state, 'received_at', None) if req else None
+    if received_at is not None:
+        STAGE_SECONDS.observe(time.perf_counter() - received_at, stage='upload')
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
-    """Initialize database tables on startup."""
+    """Initialize database tables, prefill the secret cache and start warming up the models."""
     init_db()
+    model_registry.start()
+    if OPLOG_ASYNC:
+        log_writer.start()
+    if EMAIL_OUTBOX:
+        email_outbox.start()
+    if SECRET_CACHE_PREFILL:
+        db = SessionLocal()
+        try:
+            prefill_secret_cache(get_short_ids(db, limit=secret_cache.max_entries))
+        except Exception as e:
+            print(f"Failed to prefill secret cache: {e}")
+        finally:
+            db.close()
+    start_warm_up(pool, model_registry, readiness)
 
 
 def resolve_model_dir(model_name: Optional[str]) -> Path:
-    base = DEFAULT_MODELS_DIR
+    """Model root directory for a request, looked up in the model registry (no filesystem access)."""
     if model_name:
-        model_path = base / model_name
-        if not model_path.exists() or not model_path.is_dir():
+        info = model_registry.get(model_name)
+        if info is None:
             raise HTTPException(
                 status_code=400,
-                detail=f'Model "{model_name}" not found. Available models: {", ".join([p.name for p in base.iterdir() if p.is_dir()])}'
+                detail=f'Model "{model_name}" not found. Available models: {", ".join(model_registry.names())}'
             )
-        return model_path
+        return Path(info.root)
     # fallback: env MODEL_DIR
+    default = model_registry.default()
+    if default is not None:
+        return Path(default.root)
     env_dir = os.environ.get('MODEL_DIR')
     if env_dir:
         return Path(env_dir)
     # If only one subdir, use it
-    subs = [p for p in base.iterdir() if p.is_dir()]
-    if len(subs) == 1:
-        return subs[0]
-    if len(subs) == 0:
+    names = model_registry.names()
+    if len(names) == 1:
+        return Path(model_registry.get(names[0]).root)
+    if len(names) == 0:
         raise HTTPException(status_code=500, detail='No models found in saved_models directory')
     raise HTTPException(
         status_code=400,
-        detail=f'MODEL_DIR not set and multiple models found. Please specify model parameter. Available models: {", ".join([p.name for p in subs])}'
+        detail=f'MODEL_DIR not set and multiple models found. Please specify model parameter. Available models: {", ".join(names)}'
     )
 
 
@@ -149,7 +219,7 @@ async def get_current_user(
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    payload = verify_token(token)
+    payload = verify_token_cached(token)
     if payload is None:
         # Log token verification failure for debugging
         import logging
@@ -178,7 +248,7 @@ async def get_current_user(
             detail="无效的认证令牌：用户ID格式错误",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    user = get_user_by_id(db, user_id=user_id)
+    user = get_user_by_id_cached(db, user_id=user_id)
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -188,13 +258,89 @@ async def get_current_user(
     return user
 
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush queued inference jobs and operation logs before exiting."""
+    inference_executor.shutdown(wait=True)
+    password_executor.shutdown(wait=True)
+    scheduler.stop()
+    log_writer.stop()
+    email_outbox.stop()
+    model_registry.stop()
+
+
 @app.get('/api/v1/ping')
 def ping():
+    """Liveness: the process is up and answering."""
     return {'ok': True}
 
 
+@app.get('/api/v1/ready')
+def ready():
+    """Readiness: the default model (or, without one, any preloaded model) is warm.
+
+    Preloaded models that failed are listed under ``errors`` and retried in
+    the background; they don't take the instance out of rotation.
+    """
+    snapshot = readiness.snapshot()
+    if not snapshot['ready']:
+        return JSONResponse(status_code=503, content=snapshot)
+    return snapshot
+
+
+@app.get('/api/v1/stats')
+def stats():
+    """Runtime statistics for the inference path."""
+    return {
+        'executor': inference_executor.stats(),
+        'password_pool': password_executor.stats(),
+        'scheduler': scheduler.stats(),
+        'runners': pool.stats(),
+        'secret_cache': secret_cache.stats(),
+        'readiness': readiness.snapshot(),
+        'operation_log': log_writer.stats(),
+        'auth_cache': auth_cache_stats(),
+        'email_outbox': email_outbox.stats(),
+        'result_cache': {'decode': decode_cache.stats(), 'encode': encode_cache.stats()},
+        'jobs': job_store.stats(),
+        'model_registry': model_registry.stats(),
+    }
+
+
+@app.get('/metrics', response_class=PlainTextResponse)
+def metrics():
+    """Per-stage latency histograms and counters in the Prometheus text format."""
+    return PlainTextResponse(registry.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _find_unused_short_id(db: Session, max_attempts: int = 10) -> Optional[str]:
+    for _ in range(max_attempts):
+        candidate_id = generate_short_id()
+        existing = db.query(User).filter(User.short_id == candidate_id).first()
+        if not existing:
+            return candidate_id
+    return None
+
+
+def _insert_user(db: Session, user: User) -> None:
+    try:
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    except Exception:
+        db.rollback()
+        raise
+
+
+def _commit_password_hash(db: Session, user: User, password_hash: str) -> None:
+    user.password_hash = password_hash
+    db.commit()
+
+
+# The auth handlers are async so that bcrypt can be awaited on the password
+# process pool; their blocking database calls go through run_in_threadpool.
 @app.post('/api/v1/auth/register', response_model=TokenResponse)
-def register(request: RegisterRequest, req: Request, db: Session = Depends(get_db)):
+async def register(request: RegisterRequest, req: Request, db: Session = Depends(get_db)):
     """Register a new user with email."""
     try:
         # Validate password length
@@ -211,25 +357,18 @@ def register(request: RegisterRequest, req: Request, db: Session = Depends(get_d
         
         # Validate email format (handled by EmailStr)
         # Check if email or username is taken
-        is_taken, reason = is_email_or_username_taken(db, request.email, request.username)
+        is_taken, reason = await run_in_threadpool(is_email_or_username_taken, db, request.email, request.username)
         if is_taken:
             raise HTTPException(status_code=400, detail=reason)
         
         # Generate unique short_id
-        max_attempts = 10
-        short_id = None
-        for _ in range(max_attempts):
-            candidate_id = generate_short_id()
-            existing = db.query(User).filter(User.short_id == candidate_id).first()
-            if not existing:
-                short_id = candidate_id
-                break
+        short_id = await run_in_threadpool(_find_unused_short_id, db)
         
         if short_id is None:
             raise HTTPException(status_code=500, detail="生成唯一ID失败，请重试")
         
         # Create user
-        password_hash = get_password_hash(request.password)
+        password_hash = await get_password_hash_async(request.password)
         user = User(
             email=request.email,
             username=request.username,
@@ -239,11 +378,8 @@ def register(request: RegisterRequest, req: Request, db: Session = Depends(get_d
         )
         
         try:
-            db.add(user)
-            db.commit()
-            db.refresh(user)
+            await run_in_threadpool(_insert_user, db, user)
         except Exception as e:
-            db.rollback()
             error_msg = str(e)
             # 提取更友好的错误信息
             if "Duplicate entry" in error_msg or "UNIQUE constraint" in error_msg:
@@ -260,7 +396,7 @@ def register(request: RegisterRequest, req: Request, db: Session = Depends(get_d
         try:
             client_ip = req.client.host if req and req.client else None
             user_agent = req.headers.get('user-agent') if req else None
-            log_operation(db, 'register', user.id, f"Email: {request.email}", client_ip, user_agent)
+            await _log_operation_async(db, 'register', user.id, f"Email: {request.email}", client_ip, user_agent)
         except Exception as log_error:
             # Log error but don't fail registration
             print(f"Failed to log operation: {log_error}")
@@ -281,14 +417,16 @@ def register(request: RegisterRequest, req: Request, db: Session = Depends(get_d
         )
     except HTTPException:
         raise
+    except ExecutorFull:
+        raise _busy_exception()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"注册失败: {str(e)}")
 
 
 @app.post('/api/v1/auth/login', response_model=TokenResponse)
-def login(request: LoginRequest, req: Request, db: Session = Depends(get_db)):
+async def login(request: LoginRequest, req: Request, db: Session = Depends(get_db)):
     """Login with email or username and password."""
-    user = get_user_by_email_or_username(db, request.email_or_username)
+    user = await run_in_threadpool(get_user_by_email_or_username, db, request.email_or_username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -296,12 +434,16 @@ def login(request: LoginRequest, req: Request, db: Session = Depends(get_db)):
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not verify_password(request.password, user.password_hash):
+    try:
+        password_ok = await verify_password_async(request.password, user.password_hash)
+    except ExecutorFull:
+        raise _busy_exception()
+    if not password_ok:
         # Log failed login attempt (don't fail if logging fails)
         try:
             client_ip = req.client.host if req and req.client else None
             user_agent = req.headers.get('user-agent') if req else None
-            log_operation(db, 'login_failed', user.id, f"Email: {request.email_or_username}", client_ip, user_agent)
+            await _log_operation_async(db, 'login_failed', user.id, f"Email: {request.email_or_username}", client_ip, user_agent)
         except Exception:
             pass
         raise HTTPException(
@@ -314,7 +456,7 @@ def login(request: LoginRequest, req: Request, db: Session = Depends(get_db)):
     try:
         client_ip = req.client.host if req and req.client else None
         user_agent = req.headers.get('user-agent') if req else None
-        log_operation(db, 'login', user.id, f"Email: {user.email}", client_ip, user_agent)
+        await _log_operation_async(db, 'login', user.id, f"Email: {user.email}", client_ip, user_agent)
     except Exception:
         pass
     
@@ -375,6 +517,7 @@ def verify_email(request: VerifyCodeRequest, db: Session = Depends(get_db)):
     
     user.email_verified = True
     db.commit()
+    invalidate_user(user.id)
     
     log_operation(db, 'email_verified', user.id, f"Email: {request.email}")
     
@@ -396,22 +539,26 @@ def request_password_reset(request: PasswordResetRequest, db: Session = Depends(
 
 
 @app.post('/api/v1/auth/reset-password')
-def reset_password(request: PasswordResetConfirmRequest, db: Session = Depends(get_db)):
+async def reset_password(request: PasswordResetConfirmRequest, db: Session = Depends(get_db)):
     """Reset password with verification code."""
-    user = db.query(User).filter(User.email == request.email).first()
+    user = await run_in_threadpool(lambda: db.query(User).filter(User.email == request.email).first())
     if not user:
         raise HTTPException(status_code=404, detail="邮箱未注册")
     
-    if not verify_code(db, request.email, request.code, 'password_reset'):
+    if not await run_in_threadpool(verify_code, db, request.email, request.code, 'password_reset'):
         raise HTTPException(status_code=400, detail="验证码无效或已过期")
     
     if len(request.new_password) < 6:
         raise HTTPException(status_code=400, detail="密码长度至少6位")
     
-    user.password_hash = get_password_hash(request.new_password)
-    db.commit()
+    try:
+        password_hash = await get_password_hash_async(request.new_password)
+    except ExecutorFull:
+        raise _busy_exception()
+    await run_in_threadpool(_commit_password_hash, db, user, password_hash)
+    invalidate_user(user.id)
     
-    log_operation(db, 'password_reset', user.id, f"Email: {request.email}")
+    await _log_operation_async(db, 'password_reset', user.id, f"Email: {request.email}")
     
     return {"message": "密码重置成功"}
 
@@ -434,6 +581,7 @@ def update_profile(
         current_user.username = request.username
     
     db.commit()
+    invalidate_user(current_user.id)
     db.refresh(current_user)
     
     log_operation(db, 'profile_updated', current_user.id, f"Username: {current_user.username}")
@@ -448,57 +596,182 @@ def update_profile(
 
 
 @app.post('/api/v1/auth/change-password')
-def change_password(
+async def change_password(
     request: ChangePasswordRequest,
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Change password."""
-    if not verify_password(request.old_password, current_user.password_hash):
-        raise HTTPException(status_code=400, detail="原密码错误")
-    
-    if len(request.new_password) < 6:
-        raise HTTPException(status_code=400, detail="新密码长度至少6位")
-    
-    current_user.password_hash = get_password_hash(request.new_password)
-    db.commit()
+    try:
+        if not await verify_password_async(request.old_password, current_user.password_hash):
+            raise HTTPException(status_code=400, detail="原密码错误")
+        
+        if len(request.new_password) < 6:
+            raise HTTPException(status_code=400, detail="新密码长度至少6位")
+        
+        password_hash = await get_password_hash_async(request.new_password)
+    except ExecutorFull:
+        raise _busy_exception()
+    await run_in_threadpool(_commit_password_hash, db, current_user, password_hash)
+    invalidate_user(current_user.id)
     
-    log_operation(db, 'password_changed', current_user.id, f"Email: {current_user.email}")
+    await _log_operation_async(db, 'password_changed', current_user.id, f"Email: {current_user.email}")
     
     return {"message": "密码修改成功"}
 
 
+def _describe_model(info: ModelInfo, resident: dict, snapshot: dict) -> dict:
+    replicas = resident.get(os.path.normpath(info.model_path), 0)
+    if replicas:
+        load_state = 'loaded'
+    elif info.name in snapshot['errors']:
+        load_state = 'failed'
+    else:
+        load_state = 'not_loaded'
+    return {**info.describe(), 'load_state': load_state, 'loaded_replicas': replicas}
+
+
 @app.get('/api/v1/models')
 def list_models():
-    base = DEFAULT_MODELS_DIR
-    if not base.exists():
-        return {'models': []}
-    models = [p.name for p in base.iterdir() if p.is_dir()]
-    return {'models': models}
+    """Models under saved_models/ with their format, signature shapes, size on disk and load state.
+
+    ``models`` keeps the plain list of names older clients expect; the
+    metadata is under ``details``.
+    """
+    resident = pool.resident_models()
+    snapshot = readiness.snapshot()
+    infos = model_registry.models()
+    default = model_registry.default()
+    return {
+        'models': [info.name for info in infos],
+        'details': [_describe_model(info, resident, snapshot) for info in infos],
+        'default': _describe_model(default, resident, snapshot) if default is not None else None,
+    }
+
+
+@app.post('/api/v1/models/reload')
+def reload_models(x_admin_token: Optional[str] = Header(None)):
+    """Rescan saved_models/ now instead of waiting for the background refresh; needs ADMIN_TOKEN."""
+    if not ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='无权限执行此操作')
+    changed = model_registry.scan()
+    return {'changed': changed, 'models': model_registry.names()}
+
+
+def _busy_exception() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail='服务器繁忙，请稍后重试',
+        headers={'Retry-After': str(INFERENCE_RETRY_AFTER)},
+    )
+
+
+async def _log_operation_async(*args) -> None:
+    # Queuing is non-blocking; only the synchronous fallback has to leave the event loop
+    if log_writer.running:
+        log_operation(*args)
+    else:
+        await run_in_threadpool(log_operation, *args)
+
+
+def _encode_upload(
+    fileobj, filename: Optional[str], model_path: str, message: str, full_resolution: bool,
+    fmt: OutputFormat, options: dict,
+) -> Tuple[Optional[str], Optional[bytes], Optional[Image.Image]]:
+    """Runs on the inference executor: return ``(cache_key, cached_bytes, watermarked_image)``.
+
+    On a result-cache hit the encoded file comes back as ``cached_bytes``
+    and no inference runs; otherwise the watermarked image is returned for
+    the caller to encode (and store under ``cache_key``).
+    """
+    cache_key = None
+    if encode_cache.enabled:
+        cache_key = result_key(
+            hash_upload(fileobj), model_path, 'encode', message, full_resolution, fmt.name, sorted(options.items())
+        )
+        cached = encode_cache.get(cache_key)
+        if cached is not None:
+            return cache_key, cached, None
+
+    # Full-resolution output needs every pixel; otherwise let JPEG decode near 400x400
+    pil_img = open_image(fileobj, draft_size=None if full_resolution else MODEL_INPUT_SIZE)
+    im_hidden, im_raw, im_residual = scheduler.encode(model_path, pil_img, message, full_resolution)
+
+    # Optional debug save
+    if os.environ.get('DEBUG_SAVE', '').lower() in ('1', 'true', 'yes'):
+        TMP_DIR.mkdir(parents=True, exist_ok=True)
+        base = Path(filename or 'upload').stem
+        im_raw.save(TMP_DIR / f'{base}_raw.png')
+        im_hidden.save(TMP_DIR / f'{base}_hidden.png')
+        im_residual.save(TMP_DIR / f'{base}_residual.png')
+    return cache_key, None, im_hidden
+
+
+def _write_output(
+    im_hidden: Image.Image, fmt: OutputFormat, options: dict, stream: ChunkStream, cache_key: Optional[str]
+) -> None:
+    """Runs on the inference executor: encode the output image into ``stream`` and cache the bytes."""
+    with STAGE_SECONDS.time(stage=f'{fmt.name}_encode'):
+        write_image(im_hidden, fmt, options, stream)
+    if cache_key is not None and stream.tee is not None:
+        encode_cache.put(cache_key, stream.tee.getvalue())
+
+
+def _report_write_failure(future: Future) -> None:
+    # The response has already started, so a failed write only cuts the stream short
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Failed to write output: {future.exception()}")
+
+
+def _decode_upload(fileobj, model_path: str) -> Tuple[Optional[str], bool]:
+    """Runs on the inference executor: extract the watermark; returns ``(code, cache_hit)``."""
+    cache_key = None
+    if decode_cache.enabled:
+        cache_key = result_key(hash_upload(fileobj), model_path, 'decode')
+        found, code = decode_cache.get(cache_key)
+        if found:
+            return code, True
+    pil_img = open_image(fileobj)
+    code = scheduler.decode(model_path, pil_img)
+    if cache_key is not None:
+        decode_cache.put(cache_key, code)
+    return code, False
 
 
 @app.post('/api/v1/encode')
-def encode_image(
+async def encode_image(
     image: UploadFile = File(...),
     message: str = Form(...),
     model: Optional[str] = Form(None),
+    full_resolution: Optional[bool] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    quality: Optional[int] = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     req: Request = None,
 ):
+    _observe_upload(req)
     if not MESSAGE_RE.match(message):
         raise HTTPException(status_code=400, detail='message must be 7 alphanumeric chars')
 
     model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
+    if full_resolution is None:
+        full_resolution = ENCODE_FULL_RESOLUTION
+    # Explicit form field wins over the Accept header; PNG is the default
+    try:
+        fmt = negotiate(output_format, req.headers.get('accept') if req else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    options = save_options(fmt, compress_level, quality)
     try:
-        with global_lock:
-            # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
-            model_path = str(model_dir / "model")
-            runner.load(model_path)
-            pil_img = Image.open(image.file)
-            # Apply EXIF orientation to fix rotation issues
-            pil_img = ImageOps.exif_transpose(pil_img)
-            im_hidden, im_raw, im_residual = runner.encode(pil_img, message)
+        cache_key, cached, im_hidden = await inference_executor.run(
+            _encode_upload, image.file, image.filename, model_path, message, full_resolution, fmt, options
+        )
+    except ExecutorFull:
+        raise _busy_exception()
     except HTTPException:
         raise
     except Exception as e:
@@ -507,42 +780,47 @@ def encode_image(
     # Log operation
     client_ip = req.client.host if req else None
     user_agent = req.headers.get('user-agent') if req else None
-    log_operation(db, 'encode', current_user.id, f"Message: {message}, Model: {model}", client_ip, user_agent)
-
-    # PNG-only response
-    buf = io.BytesIO()
-    im_hidden.save(buf, format='PNG')
-    buf.seek(0)
+    encode_mode = 'full' if full_resolution else '400'
+    await _log_operation_async(
+        db, 'encode', current_user.id,
+        f"Message: {message}, Model: {model}, Mode: {encode_mode}, Format: {fmt.name}", client_ip, user_agent
+    )
 
-    # Optional debug save
-    if os.environ.get('DEBUG_SAVE', '').lower() in ('1', 'true', 'yes'):
-        TMP_DIR.mkdir(parents=True, exist_ok=True)
-        base = Path(image.filename or 'upload').stem
-        im_raw.save(TMP_DIR / f'{base}_raw.png')
-        im_hidden.save(TMP_DIR / f'{base}_hidden.png')
-        im_residual.save(TMP_DIR / f'{base}_residual.png')
+    headers = {'X-Encode-Mode': encode_mode, 'X-Encode-Format': fmt.name, 'Vary': 'Accept'}
+    if not fmt.lossless:
+        headers['X-Encode-Warning'] = JPEG_WARNING
+    if cached is not None:
+        headers['X-Cache'] = 'hit'
+        return Response(content=cached, media_type=fmt.media_type, headers=headers)
 
-    return StreamingResponse(buf, media_type='image/png')
+    # Encode on the inference executor and send each chunk as soon as the encoder writes it
+    stream = ChunkStream(asyncio.get_running_loop(), tee=io.BytesIO() if cache_key is not None else None)
+    try:
+        written = inference_executor.submit(_write_output, im_hidden, fmt, options, stream, cache_key)
+    except ExecutorFull:
+        raise _busy_exception()
+    written.add_done_callback(_report_write_failure)
+    headers['X-Cache'] = 'miss'
+    return StreamingResponse(stream, media_type=fmt.media_type, headers=headers)
 
 
 @app.post('/api/v1/decode', response_model=DecodeResponse)
-def decode_image(
+async def decode_image(
     image: UploadFile = File(...),
     model: Optional[str] = Form(None),
     current_user: User = Depends(get_current_user),
     db: Session = Depends(get_db),
     req: Request = None,
+    response: Response = None,
 ):
+    _observe_upload(req)
     model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
     try:
-        with global_lock:
-            # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
-            model_path = str(model_dir / "model")
-            runner.load(model_path)
-            pil_img = Image.open(image.file)
-            # Apply EXIF orientation to fix rotation issues
-            pil_img = ImageOps.exif_transpose(pil_img)
-            code = runner.decode(pil_img)
+        code, cache_hit = await inference_executor.run(_decode_upload, image.file, model_path)
+    except ExecutorFull:
+        raise _busy_exception()
     except HTTPException:
         raise
     except Exception as e:
@@ -552,8 +830,426 @@ def decode_image(
     client_ip = req.client.host if req else None
     user_agent = req.headers.get('user-agent') if req else None
     decoded_message = code.strip() if code else None
-    log_operation(db, 'decode', current_user.id, f"Decoded: {decoded_message}, Model: {model}", client_ip, user_agent)
+    if response is not None:
+        response.headers['X-Cache'] = 'hit' if cache_hit else 'miss'
+    await _log_operation_async(
+        db, 'decode', current_user.id, f"Decoded: {decoded_message}, Model: {model}", client_ip, user_agent
+    )
 
     if code is None:
         return DecodeResponse(success=False, error='未能解析出有效水印信息')
     return DecodeResponse(success=True, data={'message': code.strip(), 'model_used': Path(model_dir).name})
+
+
+def _open_batch_item(fileobj, full_resolution: bool = False) -> Image.Image:
+    return open_image(fileobj, draft_size=None if full_resolution else MODEL_INPUT_SIZE)
+
+
+def _encode_batch_job(
+    files: list, messages: List[str], model_path: str, full_resolution: bool, fmt: OutputFormat, options: dict,
+    opened: Future, outputs: List[Future],
+) -> None:
+    """Runs on the inference executor: one job per batch request, setting ``outputs`` to each item's file bytes.
+
+    Every upload is handed to the scheduler as soon as it is decoded, so
+    inference of the first items overlaps decoding of the rest and the
+    items share batches. ``opened`` is set once every upload has been read
+    (the files are closed when the handler returns); the results are then
+    encoded in upload order.
+    """
+    queued = []
+    try:
+        for fileobj, message, output in zip(files, messages, outputs):
+            try:
+                pil_img = _open_batch_item(fileobj, full_resolution)
+                queued.append((output, scheduler.submit_encode(model_path, pil_img, message, full_resolution)))
+            except Exception as e:
+                output.set_exception(e)
+    finally:
+        opened.set_result(None)
+    for output, future in queued:
+        try:
+            im_hidden = future.result()[0]
+            with STAGE_SECONDS.time(stage=f'{fmt.name}_encode'):
+                output.set_result(encode_bytes(im_hidden, fmt, options))
+        except Exception as e:
+            output.set_exception(e)
+
+
+def _decode_batch_job(files: list, model_path: str) -> list:
+    """Runs on the inference executor: one job per batch request; returns a code, None or the exception per item."""
+    queued = []
+    for fileobj in files:
+        try:
+            queued.append(scheduler.submit_decode(model_path, _open_batch_item(fileobj)))
+        except Exception as e:
+            queued.append(e)
+    results = []
+    for future in queued:
+        if isinstance(future, BaseException):
+            results.append(future)
+            continue
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+def _item_error(exc: BaseException) -> str:
+    if isinstance(exc, ExecutorFull):
+        return '服务器繁忙，请稍后重试'
+    if isinstance(exc, UnidentifiedImageError):
+        return '无法识别的图片文件'
+    return f'{type(exc).__name__}: {exc}'
+
+
+def _check_batch(images: List[UploadFile]) -> None:
+    if not images:
+        raise HTTPException(status_code=400, detail='no images uploaded')
+    if len(images) > BATCH_MAX_IMAGES:
+        raise HTTPException(status_code=400, detail=f'at most {BATCH_MAX_IMAGES} images per batch')
+
+
+@app.post('/api/v1/encode/batch')
+async def encode_batch(
+    images: List[UploadFile] = File(...),
+    message: Optional[str] = Form(None),
+    messages: List[str] = Form(None),
+    model: Optional[str] = Form(None),
+    full_resolution: Optional[bool] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    quality: Optional[int] = Form(None),
+    response_format: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    req: Request = None,
+):
+    """Encode many images in one request and stream the results back as a zip or multipart/mixed.
+
+    Every image uses ``message`` unless ``messages`` gives one per image.
+    The batch runs as one inference executor job that queues each item on
+    the scheduler as soon as it is decoded, so the items share batches of up
+    to INFER_MAX_BATCH; when the executor is full the whole request gets a
+    503. A failed item is reported in the zip's manifest.json (or as a JSON
+    part) without failing the rest.
+    """
+    _observe_upload(req)
+    _check_batch(images)
+    if messages:
+        if len(messages) != len(images):
+            raise HTTPException(status_code=400, detail='messages must have one entry per image')
+    elif message:
+        messages = [message] * len(images)
+    else:
+        raise HTTPException(status_code=400, detail='message or messages is required')
+    if not all(MESSAGE_RE.match(m) for m in messages):
+        raise HTTPException(status_code=400, detail='message must be 7 alphanumeric chars')
+
+    model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
+    if full_resolution is None:
+        full_resolution = ENCODE_FULL_RESOLUTION
+    accept = req.headers.get('accept') if req else None
+    try:
+        fmt = negotiate(output_format, None)
+        writer = response_writer(response_format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    options = save_options(fmt, compress_level, quality)
+
+    # The whole batch takes one executor slot; a full executor rejects it as a whole
+    opened, outputs = Future(), [Future() for _ in images]
+    try:
+        inference_executor.submit(
+            _encode_batch_job, [image.file for image in images], messages, model_path, full_resolution, fmt, options,
+            opened, outputs,
+        )
+    except ExecutorFull:
+        raise _busy_exception()
+    await asyncio.wrap_future(opened)
+
+    client_ip = req.client.host if req else None
+    user_agent = req.headers.get('user-agent') if req else None
+    encode_mode = 'full' if full_resolution else '400'
+    await _log_operation_async(
+        db, 'encode_batch', current_user.id,
+        f"Images: {len(images)}, Model: {model}, Mode: {encode_mode}, Format: {fmt.name}", client_ip, user_agent
+    )
+
+    async def body():
+        for index, output in enumerate(outputs):
+            name = Path(images[index].filename or f'image_{index}').stem
+            item = {'index': index, 'filename': images[index].filename, 'message': messages[index]}
+            try:
+                data = await asyncio.wrap_future(output)
+            except Exception as e:
+                yield writer.add_error({**item, 'success': False, 'error': _item_error(e)})
+                continue
+            yield writer.add(f'{index:03d}_{name}{fmt.extension}', data, fmt.media_type, {**item, 'success': True})
+        yield writer.close()
+
+    headers = {'X-Encode-Mode': encode_mode, 'X-Encode-Format': fmt.name, 'X-Batch-Size': str(len(images))}
+    if not fmt.lossless:
+        headers['X-Encode-Warning'] = JPEG_WARNING
+    if writer.media_type == 'application/zip':
+        headers['Content-Disposition'] = 'attachment; filename="encoded.zip"'
+    return StreamingResponse(body(), media_type=writer.media_type, headers=headers)
+
+
+@app.post('/api/v1/decode/batch', response_model=DecodeResponse)
+async def decode_batch(
+    images: List[UploadFile] = File(...),
+    model: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    db: Session = Depends(get_db),
+    req: Request = None,
+):
+    """Decode many images in one request; ``data.results`` has one entry per image, in upload order."""
+    _observe_upload(req)
+    model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
+
+    _check_batch(images)
+    try:
+        codes = await inference_executor.run(_decode_batch_job, [image.file for image in images], model_path)
+    except ExecutorFull:
+        raise _busy_exception()
+
+    results = []
+    for index, code in enumerate(codes):
+        item = {'index': index, 'filename': images[index].filename}
+        if isinstance(code, BaseException):
+            results.append({**item, 'success': False, 'error': _item_error(code)})
+        elif code is None:
+            results.append({**item, 'success': False, 'error': '未能解析出有效水印信息'})
+        else:
+            results.append({**item, 'success': True, 'message': code.strip()})
+
+    client_ip = req.client.host if req else None
+    user_agent = req.headers.get('user-agent') if req else None
+    decoded_count = sum(1 for r in results if r['success'])
+    await _log_operation_async(
+        db, 'decode_batch', current_user.id,
+        f"Images: {len(images)}, Decoded: {decoded_count}, Model: {model}", client_ip, user_agent
+    )
+    return DecodeResponse(success=True, data={'results': results, 'model_used': Path(model_dir).name})
+
+
+def _log_from_worker(*args) -> None:
+    """``log_operation`` from an executor thread, which has no request-scoped session."""
+    if log_writer.running:
+        log_operation(None, *args)
+        return
+    db = SessionLocal()
+    try:
+        log_operation(db, *args)
+    finally:
+        db.close()
+
+
+def _encode_job(
+    data: bytes, filename: Optional[str], model_path: str, message: str, full_resolution: bool,
+    fmt: OutputFormat, options: dict, log_args: tuple,
+) -> dict:
+    """Runs on the inference executor: watermark an uploaded image and keep the encoded file as the job result."""
+    try:
+        cache_key, encoded, im_hidden = _encode_upload(
+            io.BytesIO(data), filename, model_path, message, full_resolution, fmt, options
+        )
+    except Exception as e:
+        raise RuntimeError(_item_error(e)) from e
+    cache = 'hit'
+    if encoded is None:
+        cache = 'miss'
+        with STAGE_SECONDS.time(stage=f'{fmt.name}_encode'):
+            encoded = encode_bytes(im_hidden, fmt, options)
+        if cache_key is not None:
+            encode_cache.put(cache_key, encoded)
+    _log_from_worker(*log_args)
+    return {'data': encoded, 'cache': cache}
+
+
+def _decode_job(data: bytes, model_path: str, model_used: str, log_args: tuple) -> dict:
+    """Runs on the inference executor: extract the watermark from an uploaded image."""
+    try:
+        code, cache_hit = _decode_upload(io.BytesIO(data), model_path)
+    except Exception as e:
+        raise RuntimeError(_item_error(e)) from e
+    operation_type, user_id, detail, client_ip, user_agent = log_args
+    decoded_message = code.strip() if code else None
+    _log_from_worker(operation_type, user_id, f"Decoded: {decoded_message}, {detail}", client_ip, user_agent)
+    result = {'cache': 'hit' if cache_hit else 'miss'}
+    if code is None:
+        return {**result, 'success': False, 'error': '未能解析出有效水印信息'}
+    return {**result, 'success': True, 'data': {'message': code.strip(), 'model_used': model_used}}
+
+
+def _job_view(job: Job) -> dict:
+    """Status payload for a job; finished jobs carry their decode result or a link to the encoded file."""
+    view = job_store.snapshot(job)
+    view['request_id'] = job.id
+    view['status_url'] = f'/api/v1/jobs/{job.id}'
+    view['events_url'] = f'/api/v1/jobs/{job.id}/events'
+    if job.status == SUCCEEDED:
+        view['result_url'] = f'/api/v1/jobs/{job.id}/result'
+        if job.kind == 'decode':
+            view['result'] = {key: value for key, value in job.result.items() if key != 'cache'}
+    return view
+
+
+async def _submit_job(kind: str, user_id: int, fn, *args, info: Optional[dict] = None) -> JSONResponse:
+    try:
+        job = job_store.submit(kind, user_id, fn, *args, info=info)
+    except (ExecutorFull, JobStoreFull):
+        raise _busy_exception()
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=_job_view(job),
+        headers={'X-Request-ID': job.id, 'Location': f'/api/v1/jobs/{job.id}'},
+    )
+
+
+def _get_job(job_id: str, current_user: User) -> Job:
+    job = job_store.get(job_id, current_user.id)
+    if job is None:
+        raise HTTPException(status_code=404, detail='任务不存在或已过期')
+    return job
+
+
+@app.post('/api/v1/jobs/encode', status_code=status.HTTP_202_ACCEPTED)
+async def submit_encode_job(
+    image: UploadFile = File(...),
+    message: str = Form(...),
+    model: Optional[str] = Form(None),
+    full_resolution: Optional[bool] = Form(None),
+    output_format: Optional[str] = Form(None),
+    compress_level: Optional[int] = Form(None),
+    quality: Optional[int] = Form(None),
+    current_user: User = Depends(get_current_user),
+    req: Request = None,
+):
+    """Queue an encode and return its job id at once; same form fields as ``/api/v1/encode``.
+
+    Poll ``status_url`` or subscribe to ``events_url``; once the job has
+    succeeded the encoded image is served from ``result_url`` until the job
+    expires (JOB_RESULT_TTL seconds after it finished).
+    """
+    _observe_upload(req)
+    if not MESSAGE_RE.match(message):
+        raise HTTPException(status_code=400, detail='message must be 7 alphanumeric chars')
+    model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
+    if full_resolution is None:
+        full_resolution = ENCODE_FULL_RESOLUTION
+    try:
+        fmt = negotiate(output_format, req.headers.get('accept') if req else None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    options = save_options(fmt, compress_level, quality)
+
+    # The upload is closed once this handler returns, so the job gets its bytes
+    data = await image.read()
+    client_ip = req.client.host if req else None
+    user_agent = req.headers.get('user-agent') if req else None
+    encode_mode = 'full' if full_resolution else '400'
+    log_args = (
+        'encode', current_user.id,
+        f"Message: {message}, Model: {model}, Mode: {encode_mode}, Format: {fmt.name}", client_ip, user_agent,
+    )
+    return await _submit_job(
+        'encode', current_user.id, _encode_job,
+        data, image.filename, model_path, message, full_resolution, fmt, options, log_args,
+        info={'format': fmt, 'mode': encode_mode, 'filename': image.filename},
+    )
+
+
+@app.post('/api/v1/jobs/decode', status_code=status.HTTP_202_ACCEPTED)
+async def submit_decode_job(
+    image: UploadFile = File(...),
+    model: Optional[str] = Form(None),
+    current_user: User = Depends(get_current_user),
+    req: Request = None,
+):
+    """Queue a decode and return its job id at once; the result is part of the job status when done."""
+    _observe_upload(req)
+    model_dir = resolve_model_dir(model)
+    # model_dir 是模型根目录（如 stega/），需要加上 "model" 子目录
+    model_path = str(model_dir / "model")
+    data = await image.read()
+    client_ip = req.client.host if req else None
+    user_agent = req.headers.get('user-agent') if req else None
+    log_args = ('decode', current_user.id, f"Model: {model}", client_ip, user_agent)
+    return await _submit_job(
+        'decode', current_user.id, _decode_job, data, model_path, Path(model_dir).name, log_args
+    )
+
+
+@app.get('/api/v1/jobs/{job_id}')
+def get_job(job_id: str, current_user: User = Depends(get_current_user)):
+    """Current status of a job, with ``queue_position`` while it waits and the result once done."""
+    job = _get_job(job_id, current_user)
+    return JSONResponse(content=_job_view(job), headers={'X-Request-ID': job.id})
+
+
+@app.get('/api/v1/jobs/{job_id}/result')
+def get_job_result(job_id: str, current_user: User = Depends(get_current_user)):
+    """The encoded image of a finished encode job, or the ``DecodeResponse`` of a decode job."""
+    job = _get_job(job_id, current_user)
+    if not job.finished:
+        raise HTTPException(status_code=409, detail='任务尚未完成', headers={'Retry-After': '1'})
+    if job.status != SUCCEEDED:
+        raise HTTPException(status_code=500, detail=f'{job.kind} failed: {job.error}')
+    headers = {'X-Request-ID': job.id, 'X-Cache': job.result['cache']}
+    if job.kind == 'decode':
+        return JSONResponse(content=_job_view(job)['result'], headers=headers)
+
+    fmt = job.info['format']
+    headers.update({'X-Encode-Mode': job.info['mode'], 'X-Encode-Format': fmt.name})
+    if not fmt.lossless:
+        headers['X-Encode-Warning'] = JPEG_WARNING
+    return Response(content=job.result['data'], media_type=fmt.media_type, headers=headers)
+
+
+def _sse(event: str, payload: dict) -> bytes:
+    return f'event: {event}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n'.encode('utf-8')
+
+
+@app.get('/api/v1/jobs/{job_id}/events')
+async def job_events(job_id: str, current_user: User = Depends(get_current_user)):
+    """Server-sent events for one job: a ``status`` event on every change, ending once it has finished.
+
+    Queue position is re-checked every second while the job waits, so it
+    counts down as jobs ahead of it start.
+    """
+    job = _get_job(job_id, current_user)
+
+    async def events():
+        queue = job_store.subscribe(job)
+        try:
+            last = None
+            idle = 0.0
+            while True:
+                view = _job_view(job)
+                if view != last:
+                    yield _sse('status', view)
+                    last = view
+                    idle = 0.0
+                if job.finished:
+                    return
+                if idle >= JOB_EVENTS_KEEPALIVE:
+                    yield b': keep-alive\n\n'
+                    idle = 0.0
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    idle += 1.0
+        finally:
+            job_store.unsubscribe(job, queue)
+
+    headers = {'X-Request-ID': job.id, 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
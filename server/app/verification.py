@@ -3,8 +3,8 @@ from datetime import datetime, timedelta
 from typing import Optional
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
-from .models import VerificationCode
-from .email_service import generate_verification_code, send_verification_email
+from .models import EmailOutbox, VerificationCode
+from .email_service import email_outbox, generate_verification_code, send_verification_email
 
 
 def create_verification_code(
@@ -14,6 +14,10 @@ def create_verification_code(
     expires_minutes: int = 10
 ) -> str:
     """Create and send a verification code.
+
+    When the outbox sender is running the email is queued in the same
+    transaction as the code and sent in the background; otherwise it is
+    sent before returning.
     
     Args:
         db: Database session
@@ -46,6 +50,14 @@ def create_verification_code(
     )
     
     db.add(verification_code)
+
+    if email_outbox.running:
+        db.flush()
+        db.add(EmailOutbox(verification_code_id=verification_code.id, next_attempt_at=datetime.utcnow()))
+        db.commit()
+        email_outbox.notify()
+        return code
+
     db.commit()
     
     # Send email
@@ -0,0 +1,162 @@
+"""Model preload and warm-up at startup."""
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from .model_registry import ModelInfo, ModelRegistry
+from .model_runner import RunnerPool
+
+logger = logging.getLogger(__name__)
+
+# Comma-separated model names under saved_models/ to preload, '*' for all, empty for none
+PRELOAD_MODELS = os.getenv('PRELOAD_MODELS', '*')
+# Seconds between retries of models that failed to warm up (e.g. until a broken model is replaced); 0 disables
+WARMUP_RETRY_SECONDS = float(os.getenv('WARMUP_RETRY_SECONDS', '60'))
+WARMUP_MESSAGE = 'WARMUP0'
+
+
+def select_models(available: List[str], spec: str = PRELOAD_MODELS) -> List[str]:
+    spec = spec.strip()
+    if spec == '*':
+        return list(available)
+    wanted = [name.strip() for name in spec.split(',') if name.strip()]
+    missing = [name for name in wanted if name not in available]
+    if missing:
+        logger.warning(f"PRELOAD_MODELS names not found in saved_models: {', '.join(missing)}")
+    return [name for name in wanted if name in available]
+
+
+class Readiness:
+    """Tracks whether the inference path is warm enough to take traffic.
+
+    The instance is ready once the default model (``MODEL_DIR``, or the only
+    model) is warm; with no default, once any model is. Other models that
+    fail are listed in ``errors`` and retried, without taking the instance
+    out of rotation.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.state = 'starting'  # starting -> warming -> ready | failed
+        self.models: List[str] = []
+        self.default: Optional[str] = None
+        self.warmed: Dict[str, float] = {}
+        self.errors: Dict[str, str] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.state == 'ready'
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                'ready': self.ready,
+                'state': self.state,
+                'models': list(self.models),
+                'default': self.default,
+                'warmup_seconds': dict(self.warmed),
+                'errors': dict(self.errors),
+            }
+
+    def _set(self, **fields) -> None:
+        with self._lock:
+            for name, value in fields.items():
+                setattr(self, name, value)
+
+    def _settle(self) -> None:
+        """Derive ``state`` from the models warmed so far."""
+        with self._lock:
+            if self.default is not None:
+                ready = self.default in self.warmed
+            else:
+                ready = bool(self.warmed) or not self.models
+            self.state = 'ready' if ready else 'failed'
+            self.finished_at = time.monotonic()
+
+
+def _default_model(registry: ModelRegistry) -> Optional[ModelInfo]:
+    """The model a request without ``model`` is served by, as resolve_model_dir picks it."""
+    default = registry.default()
+    if default is not None:
+        return default
+    infos = registry.models()
+    return infos[0] if len(infos) == 1 else None
+
+
+def _warm_model(pool: RunnerPool, info: ModelInfo, readiness: Readiness, dummy: Image.Image) -> None:
+    """Load ``info`` into every replica and push a dummy encode/decode through each."""
+    started = time.monotonic()
+    succeeded = 0
+    error = info.error
+    if error is None:
+        for index in range(pool.size):
+            try:
+                with pool.acquire_replica(index) as runner:
+                    runner.load(info.model_path)
+                    im_hidden, _, _ = runner.encode(dummy, WARMUP_MESSAGE)
+                    runner.decode(im_hidden)
+                succeeded += 1
+            except Exception as exc:
+                error = f'replica {index}: {exc}'
+    with readiness._lock:
+        if succeeded:
+            readiness.warmed[info.name] = round(time.monotonic() - started, 3)
+            readiness.errors.pop(info.name, None)
+            return
+        # Retries keep failing the same way until the model is fixed; log only when that changes
+        changed = readiness.errors.get(info.name) != error
+        readiness.errors[info.name] = error
+    if changed:
+        logger.error(f'Warm-up of model {info.name} failed: {error}')
+
+
+def warm_up(pool: RunnerPool, registry: ModelRegistry, readiness: Readiness, spec: str = PRELOAD_MODELS,
+            retry_seconds: float = WARMUP_RETRY_SECONDS) -> None:
+    """Warm up the selected models from ``registry``, then keep retrying the ones that failed.
+
+    A model counts as warm once it worked on at least one replica. Retries
+    look the model up in the registry again, so a broken model directory
+    that gets replaced is picked up without a restart.
+    """
+    default = _default_model(registry)
+    names = select_models(registry.names(), spec)
+    if default is not None and default.name not in names and spec.strip() == '*':
+        names.append(default.name)  # MODEL_DIR outside saved_models/
+    readiness._set(state='warming', models=names, started_at=time.monotonic(),
+                   default=default.name if default is not None and default.name in names else None)
+    if names and len(names) > pool.replicas[0].cache_stats()['max_size']:
+        logger.warning('More models selected for preload than MODEL_CACHE_SIZE; early ones will be evicted')
+
+    dummy = Image.new('RGB', (400, 400), (128, 128, 128))
+    pending = names
+    while True:
+        for name in pending:
+            current = registry.default()
+            info = current if current is not None and current.name == name else registry.get(name)
+            if info is not None:
+                _warm_model(pool, info, readiness, dummy)
+        readiness._settle()
+        with readiness._lock:
+            pending = [name for name in names if name not in readiness.warmed]
+        if not pending or retry_seconds <= 0:
+            return
+        time.sleep(retry_seconds)
+
+
+def start_warm_up(pool: RunnerPool, registry: ModelRegistry, readiness: Readiness) -> threading.Thread:
+    """Run ``warm_up`` in a background thread so liveness checks answer immediately."""
+    thread = threading.Thread(
+        target=warm_up, args=(pool, registry, readiness), name='model-warmup', daemon=True
+    )
+    thread.start()
+    return thread
+
+
+# Global shared state
+readiness = Readiness()
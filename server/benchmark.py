@@ -0,0 +1,220 @@
+"""Offline microbenchmarks for the ModelRunner encode/decode path.
+
+Times each stage separately -- upload preprocessing, BCH pack/unpack,
+encoder/decoder inference, PNG encoding and the 4-rotation decode loop --
+over several input sizes and batch sizes, and writes the results as JSON
+so that runs can be compared.
+
+Without --model-dir, tiny stand-in TF1 and TF2 SavedModels are generated
+into a temporary directory (see make_stub_models.py), so no real weights
+are needed.
+
+Usage:
+    python server/benchmark.py --output bench.json
+    python server/benchmark.py --model-dir server/saved_models/stega/model --batch-sizes 1,4,16
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import numpy as np
+import PIL
+from PIL import Image, ImageOps
+
+from app.model_runner import ModelRunner
+from app.preprocess import open_image, to_model_input
+from eval_common import summarize, synthetic_jpeg
+
+ROTATION_COUNT = 4
+
+
+def _parse_sizes(text: str) -> List[tuple]:
+    sizes = []
+    for item in text.split(','):
+        width, height = item.lower().split('x')
+        sizes.append((int(width), int(height)))
+    return sizes
+
+
+def _parse_ints(text: str) -> List[int]:
+    return [int(item) for item in text.split(',') if item]
+
+
+def _time(fn: Callable[[], object], repeat: int, warmup: int = 1) -> List[float]:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+class Bench:
+    def __init__(self, repeat: int) -> None:
+        self.repeat = repeat
+        self.results: List[dict] = []
+
+    def record(self, stage: str, params: dict, fn: Callable[[], object], items: int = 1) -> None:
+        try:
+            entry = summarize(_time(fn, self.repeat), items)
+        except Exception as e:
+            entry = {'error': f'{type(e).__name__}: {e}'}
+        self.results.append({'stage': stage, 'params': params, **entry})
+        shown = entry.get('mean_ms', entry.get('error'))
+        print(f'{stage:<14} {json.dumps(params):<60} {shown}')
+
+    def skip(self, stage: str, params: dict, reason: str) -> None:
+        self.results.append({'stage': stage, 'params': params, 'skipped': reason})
+        print(f'{stage:<14} {json.dumps(params):<60} skipped: {reason}')
+
+
+def bench_preprocess(bench: Bench, sizes: List[tuple]) -> None:
+    for size in sizes:
+        data = synthetic_jpeg(size)
+        params = {'size': f'{size[0]}x{size[1]}'}
+
+        def fast(data=data):
+            return to_model_input(open_image(io.BytesIO(data)))
+
+        def baseline(data=data):
+            pil_img = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+            image = np.array(ImageOps.fit(ImageOps.exif_transpose(pil_img).convert('RGB'), (400, 400)), dtype=np.float32)
+            image /= 255.0
+            return image
+
+        bench.record('preprocess', {**params, 'path': 'draft'}, fast)
+        bench.record('preprocess', {**params, 'path': 'full_decode'}, baseline)
+
+
+def bench_bch(bench: Bench, runner: ModelRunner, batch_sizes: List[int]) -> bool:
+    try:
+        runner._get_bch()
+    except RuntimeError as e:
+        for batch in batch_sizes:
+            bench.skip('bch', {'batch': batch}, str(e))
+        return False
+    for batch in batch_sizes:
+        secrets = [f'{i:07d}'[-7:] for i in range(batch)]
+        bits = runner._compute_secret_bits(secrets)
+        bench.record('bch_pack', {'batch': batch, 'cache': False},
+                     lambda: runner._compute_secret_bits(secrets), batch)
+        bench.record('bch_pack', {'batch': batch, 'cache': True},
+                     lambda: runner._encode_secrets_to_bits(secrets), batch)
+        bench.record('bch_unpack', {'batch': batch}, lambda: runner._bits_to_messages(bits), batch)
+    return True
+
+
+def bench_model(bench: Bench, model_dir: str, batch_sizes: List[int], sizes: List[tuple], has_bch: bool) -> None:
+    runner = ModelRunner()
+    started = time.perf_counter()
+    runner.load(model_dir)
+    name = Path(model_dir).parent.name
+    bench.results.append({
+        'stage': 'load', 'params': {'model': name, 'format': runner._mode},
+        'mean_ms': round((time.perf_counter() - started) * 1000.0, 4), 'repeat': 1,
+    })
+
+    rng = np.random.default_rng(0)
+    for batch in batch_sizes:
+        images = rng.random((batch, 400, 400, 3), dtype=np.float32)
+        secrets = rng.integers(0, 2, (batch, 100)).astype(np.float32)
+        params = {'model': name, 'format': runner._mode, 'batch': batch}
+        bench.record('infer_encode', params, lambda: runner._run_batched(runner._run_encoder, images, secrets), batch)
+        bench.record('infer_decode', params, lambda: runner._run_batched(runner._run_decoder, images), batch)
+
+    image = Image.fromarray(_synthetic_pixels((400, 400)))
+    if not has_bch:
+        bench.skip('decode_loop', {'model': name}, 'BCH library not available')
+        bench.skip('png_encode', {'model': name}, 'BCH library not available')
+        return
+
+    for batched in (False, True):
+        bench.record('decode_loop', {'model': name, 'rotations': ROTATION_COUNT, 'batched': batched},
+                     lambda: runner.decode(image, batched=batched))
+    # The 400x400 output doesn't depend on the input size; full-resolution output does
+    hidden = runner.encode(image, 'BENCH00')[0]
+    bench.record('png_encode', {'model': name, 'size': '400x400', 'mode': '400'},
+                 lambda: hidden.save(io.BytesIO(), format='PNG'))
+    for size in sizes:
+        source = Image.fromarray(_synthetic_pixels(size))
+        bench.record('encode_full', {'model': name, 'size': f'{size[0]}x{size[1]}'},
+                     lambda source=source: runner.encode_batch([source], ['BENCH00'], full_resolution=True))
+        full = runner.encode_batch([source], ['BENCH00'], full_resolution=True)[0][0]
+        bench.record('png_encode', {'model': name, 'size': f'{full.width}x{full.height}', 'mode': 'full'},
+                     lambda full=full: full.save(io.BytesIO(), format='PNG'))
+
+
+def _synthetic_pixels(size: tuple) -> np.ndarray:
+    return np.asarray(Image.open(io.BytesIO(synthetic_jpeg(size))).convert('RGB'))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-dir', action='append', default=[],
+                        help='SavedModel directory (…/<name>/model); repeatable. Default: generated stubs')
+    parser.add_argument('--sizes', default='640x480,1920x1080,4032x3024', help='input sizes WxH, comma separated')
+    parser.add_argument('--batch-sizes', default='1,4,8,16', help='batch sizes, comma separated')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default='benchmark_results.json', help='JSON output path')
+    parser.add_argument('--skip-models', action='store_true', help='only run the stages that need no TensorFlow')
+    args = parser.parse_args()
+
+    sizes = _parse_sizes(args.sizes)
+    batch_sizes = _parse_ints(args.batch_sizes)
+    bench = Bench(args.repeat)
+
+    bench_preprocess(bench, sizes)
+    has_bch = bench_bch(bench, ModelRunner(), batch_sizes)
+
+    tf_version: Optional[str] = None
+    if not args.skip_models:
+        model_dirs = list(args.model_dir)
+        stub_root = None
+        if not model_dirs:
+            try:
+                import tensorflow as tf  # type: ignore
+                import make_stub_models
+            except ImportError as e:
+                print(f'TensorFlow not available, skipping model stages: {e}')
+            else:
+                stub_root = tempfile.TemporaryDirectory(prefix='stega_stub_')
+                root = Path(stub_root.name)
+                make_stub_models.build_tf1(tf, np, root / 'stub_tf1' / 'model')
+                make_stub_models.build_tf2(tf, np, root / 'stub_tf2' / 'model')
+                model_dirs = [str(root / 'stub_tf1' / 'model'), str(root / 'stub_tf2' / 'model')]
+        for model_dir in model_dirs:
+            bench_model(bench, model_dir, batch_sizes, sizes, has_bch)
+        if model_dirs:
+            import tensorflow as tf  # type: ignore
+            tf_version = tf.__version__
+        if stub_root is not None:
+            stub_root.cleanup()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'tensorflow': tf_version,
+            'args': vars(args),
+        },
+        'results': bench.results,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f'Results written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,312 @@
+"""Export a StegaStamp SavedModel's encoder and decoder to TFLite for the tflite backend.
+
+Reads <model>/model (TF1 serving signature or TF2 hide/reveal functions),
+writes <model>/tflite/encoder.tflite and decoder.tflite, checks them against
+the SavedModel on random inputs and writes <model>/backend.json so the
+server serves the model with the TFLite interpreter (XNNPACK on CPU).
+
+Ops without a TFLite builtin kernel are kept as TensorFlow ops (flex);
+such models need the full TensorFlow package at runtime, which is
+reported and recorded in backend.json.
+
+With --quantize the files are written as a separate model next to the
+source one, <model>-<mode>, selectable by that name like any other model:
+
+* ``dynamic``: int8 weights, activations quantized on the fly
+* ``fp16``: float16 weights, float32 compute
+* ``int8``: int8 weights and activations, with ranges calibrated on the
+  images in --calibration-dir (inputs and outputs stay float32)
+
+Quantized variants are not held to the float tolerances; compare them with
+the float model using evaluate_models.py before selecting them.
+
+Usage:
+    python server/convert_tflite.py server/saved_models/stega
+    python server/convert_tflite.py server/saved_models/stega --no-activate   # keep serving with TensorFlow
+    python server/convert_tflite.py server/saved_models/stega --quantize fp16
+    python server/convert_tflite.py server/saved_models/stega --quantize int8 --calibration-dir samples/
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+SECRET_SIZE = 100
+IMAGE_SIZE = 400
+ENCODER_FILE = 'encoder.tflite'
+DECODER_FILE = 'decoder.tflite'
+# Largest stegastamp/residual difference from the SavedModel accepted for a converted encoder
+ENCODER_TOLERANCE = 1e-3
+# Smallest share of decoded bits that must match the SavedModel for a converted decoder
+DECODER_MIN_AGREEMENT = 0.99
+# Largest difference between XNNPACK and the builtin kernels accepted for a quantized encoder
+QUANTIZED_ENCODER_TOLERANCE = 1e-2
+QUANTIZE_MODES = ('dynamic', 'fp16', 'int8')
+
+
+def _tf1_signature_names(model_dir: Path) -> dict:
+    """Graph tensor names of the serving_default signature, keyed by signature key."""
+    from tensorflow.core.protobuf import saved_model_pb2  # type: ignore
+
+    saved_model = saved_model_pb2.SavedModel()
+    saved_model.ParseFromString((model_dir / 'saved_model.pb').read_bytes())
+    sig = saved_model.meta_graphs[0].signature_def.get('serving_default')
+    if sig is None:
+        return {}
+    return {**{k: v.name for k, v in sig.inputs.items()}, **{k: v.name for k, v in sig.outputs.items()}}
+
+
+def build_functions(tf, model_dir: Path) -> Tuple[str, object, object, object]:
+    """Return ``(source_format, encode_fn, decode_fn, trackable)`` with the tflite backend's signatures.
+
+    ``encode(secret [N, 100], image [N, 400, 400, 3]) -> {stegastamp, residual}``
+    ``decode(image [N, 400, 400, 3]) -> {decoded}`` with bits rounded to 0/1,
+    matching what ModelRunner gets from the TF1 and TF2 backends.
+    """
+    secret_spec = tf.TensorSpec([None, SECRET_SIZE], tf.float32, name='secret')
+    image_spec = tf.TensorSpec([None, IMAGE_SIZE, IMAGE_SIZE, 3], tf.float32, name='image')
+    loaded = tf.saved_model.load(str(model_dir))
+    names = _tf1_signature_names(model_dir)
+
+    if all(k in names for k in ('secret', 'image', 'stegastamp', 'residual', 'decoded')):
+        # Prune the single TF1 graph into an encoder and a decoder so neither computes the other
+        encoder = loaded.prune(feeds=[names['secret'], names['image']], fetches=[names['stegastamp'], names['residual']])
+        decoder = loaded.prune(feeds=[names['image']], fetches=[names['decoded']])
+
+        @tf.function(input_signature=[secret_spec, image_spec])
+        def encode(secret, image):
+            stegastamp, residual = encoder(secret, image)
+            return {'stegastamp': stegastamp, 'residual': residual}
+
+        @tf.function(input_signature=[image_spec])
+        def decode(image):
+            return {'decoded': decoder(image)[0]}
+
+        return 'tf1', encode, decode, loaded
+
+    if hasattr(loaded, 'hide') and hasattr(loaded, 'reveal'):
+        @tf.function(input_signature=[secret_spec, image_spec])
+        def encode(secret, image):
+            outputs = loaded.hide(secret=tf.expand_dims(secret, axis=1), image=image)
+            return {'stegastamp': outputs['stega'], 'residual': outputs['residual']}
+
+        @tf.function(input_signature=[image_spec])
+        def decode(image):
+            return {'decoded': tf.round(tf.sigmoid(loaded.reveal(image=image)['decoded']))}
+
+        return 'tf2', encode, decode, loaded
+
+    raise RuntimeError(f'{model_dir} has neither TF1 serving signatures nor TF2 hide/reveal functions')
+
+
+def calibration_images(folder: Path, limit: int) -> np.ndarray:
+    """Up to ``limit`` images from ``folder``, preprocessed like uploads, as [N, 400, 400, 3]."""
+    from eval_common import load_images, model_input
+
+    images = [model_input(img) for img in load_images(str(folder), limit)]
+    if not images:
+        raise RuntimeError(f'No readable images in {folder}')
+    return np.stack(images)
+
+
+def representative_data(part: str, images: np.ndarray, seed: int = 0) -> Callable[[], Iterator[List[np.ndarray]]]:
+    """Calibration samples in the function's input order; the encoder gets random secrets with each image."""
+    def samples():
+        rng = np.random.default_rng(seed)
+        for image in images:
+            if part == 'encoder':
+                yield [rng.integers(0, 2, (1, SECRET_SIZE)).astype(np.float32), image[None]]
+            else:
+                yield [image[None]]
+    return samples
+
+
+def convert(tf, fn, trackable, quantize: Optional[str] = None, representative=None) -> Tuple[bytes, bool]:
+    """Convert one function; returns ``(flatbuffer, uses_flex_ops)``.
+
+    ``quantize`` is one of ``QUANTIZE_MODES``; ``int8`` needs a
+    ``representative`` dataset to calibrate activation ranges. Ops without an
+    int8 kernel stay float, and the model's inputs and outputs stay float32
+    so the backend feeds every variant the same way.
+    """
+    def run(ops):
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([fn.get_concrete_function()], trackable)
+        converter.target_spec.supported_ops = ops
+        if quantize is not None:
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantize == 'fp16':
+            converter.target_spec.supported_types = [tf.float16]
+        elif quantize == 'int8':
+            converter.representative_dataset = representative
+        return converter.convert()
+
+    try:
+        return run([tf.lite.OpsSet.TFLITE_BUILTINS]), False
+    except Exception as e:
+        print(f"Builtin ops only failed ({type(e).__name__}), retrying with TensorFlow (flex) ops")
+        return run([tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]), True
+
+
+def _runner(tf, path: Path, xnnpack: bool):
+    options = {} if xnnpack else {
+        'experimental_op_resolver_type': tf.lite.experimental.OpResolverType.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+    }
+    return tf.lite.Interpreter(model_path=str(path), **options).get_signature_runner()
+
+
+def check(tf, encode, decode, encoder_path: Path, decoder_path: Path, batch: int = 2, seed: int = 0,
+          quantized: bool = False) -> dict:
+    """Compare the TFLite files with the SavedModel on random inputs, with and without XNNPACK.
+
+    A part is served with XNNPACK only if its outputs match there
+    (stegastamp/residual within ``ENCODER_TOLERANCE``, decoded bits agreeing
+    at least ``DECODER_MIN_AGREEMENT``); otherwise it falls back to the
+    builtin kernels, if those match. A ``quantized`` file is not expected to
+    match the SavedModel that closely: its differences are only reported,
+    and XNNPACK is used if it agrees with the builtin kernels on the same
+    file (encoder within ``QUANTIZED_ENCODER_TOLERANCE``).
+    """
+    rng = np.random.default_rng(seed)
+    images = rng.random((batch, IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.float32)
+    secrets = rng.integers(0, 2, (batch, SECRET_SIZE)).astype(np.float32)
+    expected = {k: v.numpy() for k, v in encode(tf.constant(secrets), tf.constant(images)).items()}
+    expected_bits = decode(tf.constant(images))['decoded'].numpy()
+
+    result = {'batch': batch}
+    use_xnnpack = {}
+    outputs = {}
+    for label, xnnpack in (('xnnpack', True), ('builtin', False)):
+        got = _runner(tf, encoder_path, xnnpack)(secret=secrets, image=images)
+        bits = _runner(tf, decoder_path, xnnpack)(image=images)['decoded']
+        outputs[label] = (got, bits)
+        diff = max(float(np.max(np.abs(got[k] - expected[k]))) for k in ('stegastamp', 'residual'))
+        agreement = float(np.mean(bits == expected_bits))
+        result[f'encoder_max_abs_diff_{label}'] = diff
+        result[f'decoded_bit_agreement_{label}'] = agreement
+        if quantized:
+            continue
+        matched = {'encoder': diff <= ENCODER_TOLERANCE, 'decoder': agreement >= DECODER_MIN_AGREEMENT}
+        for part, ok in matched.items():
+            if ok and part not in use_xnnpack:
+                use_xnnpack[part] = xnnpack
+        if len(use_xnnpack) == 2:
+            break
+    if quantized:
+        (got, bits), (ref, ref_bits) = outputs['xnnpack'], outputs['builtin']
+        diff = max(float(np.max(np.abs(got[k] - ref[k]))) for k in ('stegastamp', 'residual'))
+        use_xnnpack = {
+            'encoder': diff <= QUANTIZED_ENCODER_TOLERANCE,
+            'decoder': float(np.mean(bits == ref_bits)) >= DECODER_MIN_AGREEMENT,
+        }
+    result['xnnpack'] = use_xnnpack
+    return result
+
+
+def signatures_of(tf, path: Path) -> dict:
+    runner = tf.lite.Interpreter(model_path=str(path)).get_signature_runner()
+    shapes = {}
+    for kind, details in (('inputs', runner.get_input_details()), ('outputs', runner.get_output_details())):
+        shapes[kind] = {name: [None if d < 0 else int(d) for d in detail['shape_signature']]
+                        for name, detail in sorted(details.items())}
+    return shapes
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('model', help='model directory under saved_models/ (the one containing model/)')
+    parser.add_argument('--out', default='tflite', help='output sub-directory, relative to the model directory')
+    parser.add_argument('--no-activate', action='store_true',
+                        help='write the files but keep serving the model with TensorFlow')
+    parser.add_argument('--skip-check', action='store_true', help='do not compare the outputs with the SavedModel')
+    parser.add_argument('--quantize', choices=QUANTIZE_MODES,
+                        help='write a quantized variant as a separate model, <model>-<mode>')
+    parser.add_argument('--name', help='directory name of the quantized variant (default: <model>-<mode>)')
+    parser.add_argument('--calibration-dir', help='folder of sample images to calibrate int8 activations on')
+    parser.add_argument('--calibration-limit', type=int, default=100, help='most calibration images to use')
+    args = parser.parse_args()
+
+    root = Path(args.model)
+    model_dir = root / 'model'
+    if not (model_dir / 'saved_model.pb').is_file():
+        print(f"No SavedModel at {model_dir}", file=sys.stderr)
+        return 1
+    if args.quantize and args.no_activate:
+        print("A quantized variant has no SavedModel of its own; --no-activate does not apply", file=sys.stderr)
+        return 1
+    if args.quantize == 'int8' and not args.calibration_dir:
+        print("--quantize int8 needs --calibration-dir", file=sys.stderr)
+        return 1
+    try:
+        import tensorflow as tf  # type: ignore
+    except ImportError as e:
+        print(f"TensorFlow is required for conversion: {e}", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    calibration = None
+    if args.calibration_dir and args.quantize == 'int8':
+        try:
+            calibration = calibration_images(Path(args.calibration_dir), args.calibration_limit)
+        except (OSError, RuntimeError) as e:
+            print(f"Failed to read calibration images: {e}", file=sys.stderr)
+            return 1
+        print(f"Calibrating on {len(calibration)} images from {args.calibration_dir}")
+
+    source_format, encode, decode, trackable = build_functions(tf, model_dir)
+    target = root.parent / (args.name or f'{root.name}-{args.quantize}') if args.quantize else root
+    out_dir = target / args.out
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = {}
+    flex = False
+    for part, fn, filename in (('encoder', encode, ENCODER_FILE), ('decoder', decode, DECODER_FILE)):
+        representative = representative_data(part, calibration) if calibration is not None else None
+        data, uses_flex = convert(tf, fn, trackable, args.quantize, representative)
+        flex = flex or uses_flex
+        paths[part] = out_dir / filename
+        paths[part].write_bytes(data)
+        print(f"Wrote {paths[part]} ({len(data) / 1e6:.1f} MB{', flex ops' if uses_flex else ''})")
+
+    config = {
+        'backend': 'tf' if args.no_activate else 'tflite',
+        'encoder': os.path.relpath(paths['encoder'], target),
+        'decoder': os.path.relpath(paths['decoder'], target),
+        'source_format': source_format,
+        'flex_ops': flex,
+        'signatures': {'encoder': signatures_of(tf, paths['encoder']), 'decoder': signatures_of(tf, paths['decoder'])},
+        'tensorflow_version': tf.__version__,
+        'converted_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if args.quantize:
+        config['quantization'] = {
+            'mode': args.quantize,
+            'base_model': root.name,
+            'calibration_images': len(calibration) if calibration is not None else 0,
+        }
+    if not args.skip_check:
+        result = check(tf, encode, decode, paths['encoder'], paths['decoder'], quantized=bool(args.quantize))
+        print(f"Check against SavedModel: {json.dumps(result)}")
+        missing = [part for part in ('encoder', 'decoder') if part not in result['xnnpack']]
+        if missing:
+            print(f"TFLite output of the {' and '.join(missing)} does not match the SavedModel", file=sys.stderr)
+            return 1
+        config['xnnpack'] = result.pop('xnnpack')
+        config['check'] = result
+        for part, enabled in config['xnnpack'].items():
+            if not enabled:
+                print(f"Note: the {part} does not match with XNNPACK; it will run on the builtin kernels")
+    (target / 'backend.json').write_text(json.dumps(config, indent=2) + '\n', encoding='utf-8')
+    print(f"Wrote {target / 'backend.json'} (backend: {config['backend']}) in {time.perf_counter() - started:.1f}s")
+    if flex:
+        print("Note: flex ops need the full tensorflow package at runtime, not ai-edge-litert/tflite-runtime")
+    if args.quantize:
+        print(f"Select it as model '{target.name}'; compare it with the float model using evaluate_models.py")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
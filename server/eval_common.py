@@ -0,0 +1,69 @@
+"""Helpers shared by the offline benchmark and evaluation scripts in server/.
+
+Sample images (from a folder, or synthetic photos when there is none),
+random messages to embed, model input preparation and latency summaries.
+"""
+import io
+import string
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.preprocess import apply_orientation, open_image, to_model_input
+
+IMAGE_SUFFIXES = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+MESSAGE_ALPHABET = string.ascii_uppercase + string.digits
+
+
+def summarize(samples: List[float], items: int = 1) -> Dict[str, float]:
+    """Mean, p50, p95 and min of latency ``samples`` in milliseconds, plus the mean per item of a batch."""
+    arr = np.asarray(samples)
+    return {
+        'repeat': len(samples),
+        'mean_ms': round(float(arr.mean()), 4),
+        'p50_ms': round(float(np.percentile(arr, 50)), 4),
+        'p95_ms': round(float(np.percentile(arr, 95)), 4),
+        'min_ms': round(float(arr.min()), 4),
+        'per_item_ms': round(float(arr.mean()) / max(1, items), 4),
+    }
+
+
+def synthetic_jpeg(size: tuple, seed: int = 0) -> bytes:
+    # Smooth gradients plus noise compress like a photo rather than like white noise
+    rng = np.random.default_rng(seed)
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    pixels = np.clip(base + rng.normal(0, 12, base.shape), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def load_images(folder: Optional[str], limit: int) -> List[Image.Image]:
+    """Sample images from ``folder``, or synthetic photos when no folder is given."""
+    if not folder:
+        return [Image.open(io.BytesIO(synthetic_jpeg((640, 480), seed=i))).convert('RGB') for i in range(limit)]
+    images = []
+    for path in sorted(p for p in Path(folder).rglob('*') if p.suffix.lower() in IMAGE_SUFFIXES):
+        try:
+            with open(path, 'rb') as f:
+                images.append(open_image(f).convert('RGB'))
+        except Exception as e:
+            print(f'Skipping {path}: {e}')
+            continue
+        if len(images) >= limit:
+            break
+    return images
+
+
+def random_messages(rng: np.random.Generator, count: int) -> List[str]:
+    """``count`` random 7-character messages to embed."""
+    return [''.join(rng.choice(list(MESSAGE_ALPHABET), 7)) for _ in range(count)]
+
+
+def model_input(img: Image.Image) -> np.ndarray:
+    """``img`` as the [400, 400, 3] float array the models take, prepared like an upload."""
+    return to_model_input(apply_orientation(img))
@@ -0,0 +1,242 @@
+"""Compare models (e.g. quantized variants) with a reference model on watermark recovery and latency.
+
+Every sample image is watermarked once by the reference model with a random
+7-character message. Each model then decodes those images and is scored on:
+
+* bit accuracy: share of the 96 BCH-packet bits its decoder recovers
+  (upright image)
+* BCH success: share of images whose full decode (all rotations plus BCH
+  error correction) returns the embedded message
+* agreement with the reference decoder's bits
+* latency per image: the decoder on all four rotations, the full decode
+  (with BCH) and the encoder
+
+Each model also runs its own encoder: ``roundtrip`` scores its watermarked
+images decoded by itself, plus their PSNR against the reference model's
+watermarked images. The exit status is 1 if a model's BCH success (its bit
+accuracy when bchlib is missing) is more than --max-regression below the
+reference, so the script can gate rolling a variant out.
+
+Models are looked up by name in --models-dir, like the ``model`` form field.
+By default every variant written by ``convert_tflite.py --quantize`` from
+the reference model is evaluated.
+
+Usage:
+    python server/evaluate_models.py --reference stega --images samples/
+    python server/evaluate_models.py --reference stega --models stega-fp16,stega-int8 --output eval.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+from app.model_registry import DEFAULT_MODELS_DIR, ModelInfo, ModelRegistry
+from app.model_runner import ModelRunner
+from app.preprocess import rotations
+from eval_common import load_images, model_input, random_messages, summarize
+
+PACKET_BITS = 96
+
+
+def _psnr(a: Image.Image, b: Image.Image) -> float:
+    diff = np.asarray(a, dtype=np.float32) - np.asarray(b, dtype=np.float32)
+    mse = float(np.mean(diff * diff))
+    return float('inf') if mse == 0 else round(10.0 * np.log10(255.0 ** 2 / mse), 3)
+
+
+def _timed(fn) -> tuple:
+    started = time.perf_counter()
+    result = fn()
+    return result, (time.perf_counter() - started) * 1000.0
+
+
+def encode_one(runner: ModelRunner, img: Image.Image, secret: np.ndarray) -> Image.Image:
+    """The 400x400 watermarked image, as ``ModelRunner.encode`` returns it, for already packed secret bits."""
+    stegastamp, _residual = runner.encode_bits(model_input(img)[np.newaxis], secret[np.newaxis])
+    return Image.fromarray((stegastamp[0] * 255).astype(np.uint8))
+
+
+def score(runner: ModelRunner, hidden: List[Image.Image], messages: List[str], secrets: np.ndarray,
+          has_bch: bool, reference_bits: Optional[np.ndarray] = None) -> dict:
+    """Decode ``hidden`` with the active model and score it against the embedded ``messages``."""
+    images = np.stack([model_input(img) for img in hidden])
+    bits = runner.decode_bits(images)
+    result = {'bit_accuracy': round(float(np.mean(bits[:, :PACKET_BITS] == secrets[:, :PACKET_BITS])), 4)}
+    if reference_bits is not None:
+        result['agreement_with_reference'] = round(float(np.mean(bits == reference_bits)), 4)
+    samples = []
+    for image in images:
+        batch = rotations(image)
+        samples.append(_timed(lambda batch=batch: runner.decode_bits(batch))[1])
+    result['decoder_latency'] = summarize(samples)
+    if has_bch:
+        codes = []
+        samples = []
+        for img in hidden:
+            code, ms = _timed(lambda img=img: runner.decode(img))
+            codes.append(code)
+            samples.append(ms)
+        result['bch_success'] = round(float(np.mean([c == m for c, m in zip(codes, messages)])), 4)
+        result['decode_latency'] = summarize(samples)
+    result['_bits'] = bits
+    return result
+
+
+def evaluate(runner: ModelRunner, info: ModelInfo, sources: List[Image.Image], messages: List[str],
+             secrets: np.ndarray, has_bch: bool, reference: Optional[dict]) -> dict:
+    started = time.perf_counter()
+    runner.load(info.model_path)
+    entry = {
+        'model': info.name,
+        'backend': info.backend,
+        'quantization': (info.quantization or {}).get('mode'),
+        'size_bytes': info.size_bytes,
+        'load_ms': round((time.perf_counter() - started) * 1000.0, 4),
+    }
+    # Warm up so the first timed call doesn't pay for lazy initialisation
+    encode_one(runner, sources[0], secrets[0])
+
+    encoded = []
+    samples = []
+    for img, secret in zip(sources, secrets):
+        hidden, ms = _timed(lambda img=img, secret=secret: encode_one(runner, img, secret))
+        encoded.append(hidden)
+        samples.append(ms)
+    entry['encode_latency'] = summarize(samples)
+
+    if reference is None:
+        entry['_hidden'] = encoded
+        clean = score(runner, encoded, messages, secrets, has_bch)
+    else:
+        clean = score(runner, reference['_hidden'], messages, secrets, has_bch, reference['clean']['_bits'])
+        roundtrip = score(runner, encoded, messages, secrets, has_bch)
+        for key in ('_bits', 'decoder_latency', 'decode_latency'):
+            roundtrip.pop(key, None)
+        roundtrip['psnr_vs_reference'] = round(float(np.mean(
+            [_psnr(a, b) for a, b in zip(encoded, reference['_hidden'])])), 3)
+        entry['roundtrip'] = roundtrip
+    entry['clean'] = clean
+    return entry
+
+
+def _public(entry: dict) -> dict:
+    """The entry without the intermediate arrays and images."""
+    if isinstance(entry, dict):
+        return {k: _public(v) for k, v in entry.items() if not k.startswith('_')}
+    return entry
+
+
+def _print_row(entry: dict, reference: dict) -> None:
+    clean = entry['clean']
+    latency = clean['decoder_latency']['mean_ms']
+    speedup = reference['clean']['decoder_latency']['mean_ms'] / latency if latency else float('nan')
+    print(f"{entry['model']:<24} {str(entry['quantization'] or 'float'):<8} {entry['size_bytes'] / 1e6:>8.2f} "
+          f"{clean['bit_accuracy']:>8.4f} {clean.get('bch_success', float('nan')):>8.4f} "
+          f"{latency:>10.2f} {speedup:>7.2f}x")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models-dir', default=str(DEFAULT_MODELS_DIR), help='directory holding the models')
+    parser.add_argument('--reference', required=True, help='name of the (float) model to compare against')
+    parser.add_argument('--models', default='',
+                        help='models to evaluate, comma separated (default: quantized variants of --reference)')
+    parser.add_argument('--images', help='folder of sample images (default: synthetic images)')
+    parser.add_argument('--limit', type=int, default=50, help='most images to use')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the embedded messages')
+    parser.add_argument('--max-regression', type=float, default=0.01,
+                        help='largest drop in BCH success (or bit accuracy) accepted against the reference')
+    parser.add_argument('--output', default='evaluation_results.json', help='JSON output path')
+    args = parser.parse_args()
+
+    registry = ModelRegistry(Path(args.models_dir), refresh_seconds=0)
+    registry.scan()
+    reference_info = registry.get(args.reference)
+    if reference_info is None:
+        print(f'Unknown model {args.reference} in {args.models_dir}', file=sys.stderr)
+        return 1
+    names = [name for name in args.models.split(',') if name] or [
+        info.name for info in registry.models()
+        if (info.quantization or {}).get('base_model') == args.reference
+    ]
+    infos = []
+    for name in names:
+        info = registry.get(name)
+        if info is None:
+            print(f'Unknown model {name} in {args.models_dir}', file=sys.stderr)
+            return 1
+        infos.append(info)
+    if not infos:
+        print(f'No variants of {args.reference} found; create them with convert_tflite.py --quantize')
+
+    sources = load_images(args.images, args.limit)
+    if not sources:
+        print(f'No readable images in {args.images}', file=sys.stderr)
+        return 1
+    rng = np.random.default_rng(args.seed)
+    messages = random_messages(rng, len(sources))
+
+    runner = ModelRunner(cache_size=len(infos) + 1)
+    try:
+        runner.check_bch()
+        has_bch = True
+    except RuntimeError as e:
+        print(f'{e}; reporting bit accuracy only')
+        has_bch = False
+    # Without BCH the messages can't be packed; random bits still measure bit accuracy
+    secrets = runner.secret_bits(messages) if has_bch else \
+        rng.integers(0, 2, (len(messages), 100)).astype(np.float32)
+
+    reference = evaluate(runner, reference_info, sources, messages, secrets, has_bch, None)
+    results: List[Dict] = [reference]
+    for info in infos:
+        try:
+            results.append(evaluate(runner, info, sources, messages, secrets, has_bch, reference))
+        except Exception as e:
+            print(f'Failed to evaluate {info.name}: {e}')
+            results.append({'model': info.name, 'error': f'{type(e).__name__}: {e}'})
+    runner.close()
+
+    metric = 'bch_success' if has_bch else 'bit_accuracy'
+    print(f"\n{'model':<24} {'quant':<8} {'MB':>8} {'bit_acc':>8} {'bch_ok':>8} {'infer_ms':>10} {'speedup':>8}")
+    regressions = []
+    for entry in results:
+        if 'error' in entry:
+            print(f"{entry['model']:<24} error: {entry['error']}")
+            regressions.append(entry['model'])
+            continue
+        _print_row(entry, reference)
+        drop = reference['clean'][metric] - entry['clean'][metric]
+        if entry is not reference and drop > args.max_regression:
+            regressions.append(entry['model'])
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'images': len(sources),
+            'bch': has_bch,
+            'args': vars(args),
+        },
+        'reference': args.reference,
+        'results': [_public(entry) for entry in results],
+        'regressions': regressions,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f'Results written to {args.output}')
+    if regressions:
+        print(f"{metric} regressed by more than {args.max_regression} for: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
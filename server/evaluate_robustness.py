@@ -0,0 +1,228 @@
+"""Measure watermark recovery and decode throughput on distorted copies of encoded images.
+
+Every image is encoded with ``ModelRunner.encode`` and a random 7-character
+message, then each distortion in the grid is applied to every encoded
+image. The distorted copies are decoded with ``ModelRunner.decode_batch``,
+--batch-size images per call, on --workers runner replicas in parallel.
+For each distortion the report gives the decode rate (share of images whose
+message comes back exactly) and the decode throughput in images per second.
+
+A distortion is ``kind:value``; join several with ``+`` to apply them in
+order. ``none`` is the undistorted image.
+
+* ``jpeg:Q``     re-encode as JPEG at quality Q
+* ``blur:R``     Gaussian blur with radius R pixels
+* ``crop:F``     keep the centered F share of each side
+* ``rotate:D``   rotate D degrees counter-clockwise (90/180/270 are exact)
+* ``resize:F``   scale both sides by F
+
+Usage:
+    python server/evaluate_robustness.py --model stega --images samples/
+    python server/evaluate_robustness.py --model stega --model stega-int8 --workers 4 \\
+        --distortions none,jpeg:50,blur:2,crop:0.8,jpeg:70+rotate:90 --output robustness.json
+"""
+import argparse
+import io
+import json
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+from app.model_registry import DEFAULT_MODELS_DIR, ModelRegistry
+from app.model_runner import RunnerPool
+from eval_common import load_images, random_messages
+
+DEFAULT_DISTORTIONS = (
+    'none,jpeg:90,jpeg:70,jpeg:50,blur:1,blur:2,crop:0.9,crop:0.75,'
+    'rotate:90,rotate:180,rotate:270,resize:0.5,resize:2,jpeg:70+rotate:90'
+)
+
+
+def _jpeg(img: Image.Image, quality: float) -> Image.Image:
+    buf = io.BytesIO()
+    img.convert('RGB').save(buf, format='JPEG', quality=int(quality))
+    buf.seek(0)
+    return Image.open(buf).convert('RGB')
+
+
+def _crop(img: Image.Image, share: float) -> Image.Image:
+    width, height = max(1, round(img.width * share)), max(1, round(img.height * share))
+    left, top = (img.width - width) // 2, (img.height - height) // 2
+    return img.crop((left, top, left + width, top + height))
+
+
+def _rotate(img: Image.Image, degrees: float) -> Image.Image:
+    if degrees % 90 == 0:
+        return img.rotate(degrees, expand=True)
+    return img.rotate(degrees, resample=Image.BILINEAR)
+
+
+def _resize(img: Image.Image, scale: float) -> Image.Image:
+    return img.resize((max(1, round(img.width * scale)), max(1, round(img.height * scale))), Image.BILINEAR)
+
+
+DISTORTIONS: Dict[str, Callable[[Image.Image, float], Image.Image]] = {
+    'jpeg': _jpeg,
+    'blur': lambda img, radius: img.filter(ImageFilter.GaussianBlur(radius)),
+    'crop': _crop,
+    'rotate': _rotate,
+    'resize': _resize,
+}
+
+
+def parse_distortions(text: str) -> List[Tuple[str, List[Tuple[str, float]]]]:
+    """``'none,jpeg:50+blur:1'`` -> ``[('none', []), ('jpeg:50+blur:1', [('jpeg', 50.0), ('blur', 1.0)])]``."""
+    grid = []
+    for spec in (item.strip() for item in text.split(',')):
+        if not spec:
+            continue
+        steps = []
+        if spec != 'none':
+            for step in spec.split('+'):
+                kind, _, value = step.partition(':')
+                if kind not in DISTORTIONS or not value:
+                    raise ValueError(f'Invalid distortion "{step}", expected one of {", ".join(DISTORTIONS)} as kind:value')
+                steps.append((kind, float(value)))
+        grid.append((spec, steps))
+    return grid
+
+
+def distort(img: Image.Image, steps: List[Tuple[str, float]]) -> Image.Image:
+    for kind, value in steps:
+        img = DISTORTIONS[kind](img, value)
+    return img
+
+
+def decode_all(pool: RunnerPool, model_dir: str, images: List[Image.Image], batch_size: int,
+               batched: bool) -> Tuple[List[Optional[str]], float]:
+    """Decode ``images`` in chunks spread over the pool's replicas; returns ``(codes, seconds)``."""
+    def run(chunk: List[Image.Image]) -> List[Optional[str]]:
+        with pool.acquire(model_dir) as runner:
+            runner.load(model_dir)
+            return runner.decode_batch(chunk, batched=batched)
+
+    chunks = [images[i:i + batch_size] for i in range(0, len(images), batch_size)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        results = list(executor.map(run, chunks))
+    return [code for chunk in results for code in chunk], time.perf_counter() - started
+
+
+def evaluate(pool: RunnerPool, name: str, model_dir: str, sources: List[Image.Image], messages: List[str],
+             grid: List[Tuple[str, List[Tuple[str, float]]]], batch_size: int, batched: bool,
+             full_resolution: bool) -> List[dict]:
+    with pool.acquire(model_dir) as runner:
+        runner.load(model_dir)
+        started = time.perf_counter()
+        encoded = [hidden for hidden, _raw, _residual in
+                   runner.encode_batch(sources, messages, full_resolution=full_resolution)]
+        encode_seconds = time.perf_counter() - started
+    print(f'{name}: encoded {len(encoded)} images in {encode_seconds:.2f}s')
+
+    # Warm every replica up so model loading isn't counted against the first distortion
+    for index in range(pool.size):
+        with pool.acquire_replica(index) as runner:
+            runner.load(model_dir)
+            runner.decode_batch(encoded[:1], batched=batched)
+
+    rows = []
+    for spec, steps in grid:
+        distorted = [distort(img, steps) for img in encoded]
+        codes, seconds = decode_all(pool, model_dir, distorted, batch_size, batched)
+        recovered = sum(code == message for code, message in zip(codes, messages))
+        row = {
+            'model': name,
+            'distortion': spec,
+            'images': len(distorted),
+            'decode_rate': round(recovered / len(distorted), 4),
+            'images_per_second': round(len(distorted) / seconds, 3) if seconds > 0 else None,
+            'ms_per_image': round(seconds * 1000.0 / len(distorted), 3),
+        }
+        rows.append(row)
+        print(f"{name:<20} {spec:<24} {row['decode_rate']:>8.4f} {row['images_per_second'] or 0:>10.2f} "
+              f"{row['ms_per_image']:>10.2f}")
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', action='append', required=True, help='model name in --models-dir; repeatable')
+    parser.add_argument('--models-dir', default=str(DEFAULT_MODELS_DIR), help='directory holding the models')
+    parser.add_argument('--images', help='folder of sample images (default: synthetic images)')
+    parser.add_argument('--limit', type=int, default=50, help='most images to use')
+    parser.add_argument('--distortions', default=DEFAULT_DISTORTIONS, help='comma separated distortion grid')
+    parser.add_argument('--batch-size', type=int, default=8, help='images per decode_batch call')
+    parser.add_argument('--workers', type=int, default=2, help='runner replicas decoding in parallel')
+    parser.add_argument('--threads', type=int, default=0, help='intra-op threads per replica (0 = library default)')
+    parser.add_argument('--sequential-rotations', action='store_true',
+                        help='try rotations one at a time instead of as one batch (DECODE_BATCH_ROTATIONS=0)')
+    parser.add_argument('--full-resolution', action='store_true', help='encode at the source resolution')
+    parser.add_argument('--seed', type=int, default=0, help='seed for the embedded messages')
+    parser.add_argument('--output', default='robustness_results.json', help='JSON output path')
+    args = parser.parse_args()
+
+    try:
+        grid = parse_distortions(args.distortions)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    registry = ModelRegistry(Path(args.models_dir), refresh_seconds=0)
+    registry.scan()
+    models = []
+    for name in args.model:
+        info = registry.get(name)
+        if info is None:
+            print(f'Unknown model {name} in {args.models_dir}', file=sys.stderr)
+            return 1
+        models.append(info)
+
+    sources = load_images(args.images, args.limit)
+    if not sources:
+        print(f'No readable images in {args.images}', file=sys.stderr)
+        return 1
+    rng = np.random.default_rng(args.seed)
+    messages = random_messages(rng, len(sources))
+
+    pool = RunnerPool(size=args.workers, intra_op_threads=args.threads)
+    try:
+        pool.replicas[0].check_bch()
+    except RuntimeError as e:
+        print(f'{e}; the decode rate needs the BCH codec', file=sys.stderr)
+        return 1
+
+    print(f"{'model':<20} {'distortion':<24} {'rate':>8} {'images/s':>10} {'ms/image':>10}")
+    rows: List[dict] = []
+    for info in models:
+        try:
+            rows.extend(evaluate(pool, info.name, info.model_path, sources, messages, grid, max(1, args.batch_size),
+                                 not args.sequential_rotations, args.full_resolution))
+        except Exception as e:
+            print(f'Failed to evaluate {info.name}: {e}')
+            rows.append({'model': info.name, 'error': f'{type(e).__name__}: {e}'})
+    for replica in pool.replicas:
+        replica.close()
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'images': len(sources),
+            'args': vars(args),
+        },
+        'results': rows,
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2), encoding='utf-8')
+    print(f'Results written to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
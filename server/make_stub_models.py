@@ -0,0 +1,132 @@
+"""Generate tiny stand-in SavedModels with the StegaStamp signatures.
+
+The real weights in saved_models/ are not in the repository. These stubs
+have the same inputs and outputs (TF1: secret/image -> stegastamp/residual/
+decoded; TF2: hide/reveal functions) and a few small convolutions so that
+ModelRunner can be exercised and benchmarked offline. They do not hide a
+recoverable watermark.
+
+Usage:
+    python server/make_stub_models.py --out /tmp/stub_models
+    # -> /tmp/stub_models/stub_tf1/model and /tmp/stub_models/stub_tf2/model
+"""
+import argparse
+import sys
+from pathlib import Path
+
+SECRET_SIZE = 100
+IMAGE_SIZE = 400
+
+
+def _conv_weights(np, rng, shape):
+    return (rng.standard_normal(shape) * 0.05).astype(np.float32)
+
+
+def build_tf1(tf, np, model_dir: Path, seed: int = 0) -> None:
+    """Write a TF1 SavedModel with the serving signature ModelRunner expects."""
+    rng = np.random.default_rng(seed)
+    graph = tf.Graph()
+    with graph.as_default():
+        v1 = tf.compat.v1
+        secret = v1.placeholder(tf.float32, [None, SECRET_SIZE], name='input_prep')
+        image = v1.placeholder(tf.float32, [None, IMAGE_SIZE, IMAGE_SIZE, 3], name='input_hide')
+
+        # Encoder: project the secret to a 50x50 map, upsample, mix with a conv of the image
+        dense = tf.constant(_conv_weights(np, rng, (SECRET_SIZE, 50 * 50 * 3)))
+        secret_map = tf.reshape(tf.matmul(secret - 0.5, dense), [-1, 50, 50, 3])
+        secret_map = tf.image.resize(secret_map, [IMAGE_SIZE, IMAGE_SIZE])
+        features = tf.nn.relu(tf.nn.conv2d(image, tf.constant(_conv_weights(np, rng, (3, 3, 3, 8))), 1, 'SAME'))
+        mixed = tf.nn.conv2d(features, tf.constant(_conv_weights(np, rng, (3, 3, 8, 3))), 1, 'SAME')
+        residual = tf.identity(0.02 * tf.tanh(secret_map + mixed), name='residual')
+        stegastamp = tf.clip_by_value(image + residual, 0.0, 1.0, name='stegastamp')
+
+        # Decoder: strided convs down to a 100-wide logit vector, rounded to bits
+        x = tf.nn.relu(tf.nn.conv2d(image - 0.5, tf.constant(_conv_weights(np, rng, (3, 3, 3, 16))), 4, 'SAME'))
+        x = tf.nn.relu(tf.nn.conv2d(x, tf.constant(_conv_weights(np, rng, (3, 3, 16, 16))), 4, 'SAME'))
+        x = tf.reduce_mean(x, axis=[1, 2])
+        logits = tf.matmul(x, tf.constant(_conv_weights(np, rng, (16, SECRET_SIZE))))
+        decoded = tf.round(tf.sigmoid(logits), name='decoded')
+
+        sess = v1.Session(graph=graph)
+        builder = v1.saved_model.Builder(str(model_dir))
+        info = v1.saved_model.utils.build_tensor_info
+        signature = v1.saved_model.signature_def_utils.build_signature_def(
+            inputs={'secret': info(secret), 'image': info(image)},
+            outputs={
+                'stegastamp': info(stegastamp),
+                'residual': info(residual),
+                'decoded': info(decoded),
+            },
+            method_name=v1.saved_model.signature_constants.PREDICT_METHOD_NAME,
+        )
+        builder.add_meta_graph_and_variables(
+            sess,
+            [v1.saved_model.tag_constants.SERVING],
+            signature_def_map={v1.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY: signature},
+        )
+        builder.save()
+        sess.close()
+
+
+def build_tf2(tf, np, model_dir: Path, seed: int = 0) -> None:
+    """Write a TF2 SavedModel exposing ``hide`` and ``reveal`` functions."""
+    rng = np.random.default_rng(seed)
+
+    class StubStega(tf.Module):
+        def __init__(self):
+            super().__init__()
+            self.dense = tf.Variable(_conv_weights(np, rng, (SECRET_SIZE, 50 * 50 * 3)))
+            self.enc1 = tf.Variable(_conv_weights(np, rng, (3, 3, 3, 8)))
+            self.enc2 = tf.Variable(_conv_weights(np, rng, (3, 3, 8, 3)))
+            self.dec1 = tf.Variable(_conv_weights(np, rng, (3, 3, 3, 16)))
+            self.dec2 = tf.Variable(_conv_weights(np, rng, (3, 3, 16, 16)))
+            self.dec3 = tf.Variable(_conv_weights(np, rng, (16, SECRET_SIZE)))
+
+        @tf.function(input_signature=[
+            tf.TensorSpec([None, 1, SECRET_SIZE], tf.float32),
+            tf.TensorSpec([None, IMAGE_SIZE, IMAGE_SIZE, 3], tf.float32),
+        ])
+        def hide(self, secret, image):
+            secret_map = tf.reshape(tf.matmul(secret[:, 0, :] - 0.5, self.dense), [-1, 50, 50, 3])
+            secret_map = tf.image.resize(secret_map, [IMAGE_SIZE, IMAGE_SIZE])
+            features = tf.nn.relu(tf.nn.conv2d(image, self.enc1, 1, 'SAME'))
+            residual = 0.02 * tf.tanh(secret_map + tf.nn.conv2d(features, self.enc2, 1, 'SAME'))
+            return {'stega': tf.clip_by_value(image + residual, 0.0, 1.0), 'residual': residual}
+
+        @tf.function(input_signature=[tf.TensorSpec([None, IMAGE_SIZE, IMAGE_SIZE, 3], tf.float32)])
+        def reveal(self, image):
+            x = tf.nn.relu(tf.nn.conv2d(image - 0.5, self.dec1, 4, 'SAME'))
+            x = tf.nn.relu(tf.nn.conv2d(x, self.dec2, 4, 'SAME'))
+            # ModelRunner applies sigmoid + round to TF2 outputs itself, so return logits
+            return {'decoded': tf.matmul(tf.reduce_mean(x, axis=[1, 2]), self.dec3)}
+
+    module = StubStega()
+    tf.saved_model.save(module, str(model_dir))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', required=True, help='directory to create stub_tf1/ and stub_tf2/ in')
+    parser.add_argument('--format', choices=('tf1', 'tf2', 'both'), default='both')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    try:
+        import numpy as np
+        import tensorflow as tf  # type: ignore
+    except ImportError as e:
+        print(f'TensorFlow is required to build stub models: {e}')
+        return 1
+
+    out = Path(args.out)
+    if args.format in ('tf1', 'both'):
+        build_tf1(tf, np, out / 'stub_tf1' / 'model', args.seed)
+        print(f'TF1 stub written to {out / "stub_tf1" / "model"}')
+    if args.format in ('tf2', 'both'):
+        build_tf2(tf, np, out / 'stub_tf2' / 'model', args.seed)
+        print(f'TF2 stub written to {out / "stub_tf2" / "model"}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
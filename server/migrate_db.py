@@ -87,6 +87,37 @@ def migrate():
             else:
                 print("[OK] operation_logs 表已存在")
             
+            # Check if email_outbox table exists
+            result = conn.execute(text("""
+                SELECT COUNT(*) as count 
+                FROM information_schema.TABLES 
+                WHERE TABLE_SCHEMA = 'stegacam_db' 
+                AND TABLE_NAME = 'email_outbox'
+            """))
+            count = result.fetchone()[0]
+            
+            if count == 0:
+                print("创建 email_outbox 表...")
+                conn.execute(text("""
+                    CREATE TABLE email_outbox (
+                        id INT AUTO_INCREMENT PRIMARY KEY,
+                        verification_code_id INT NOT NULL,
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        attempts INT NOT NULL DEFAULT 0,
+                        next_attempt_at DATETIME NOT NULL,
+                        claimed_at DATETIME NULL,
+                        last_error TEXT NULL,
+                        created_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                        sent_at DATETIME NULL,
+                        INDEX idx_status_next_attempt (status, next_attempt_at),
+                        FOREIGN KEY (verification_code_id) REFERENCES verification_codes(id) ON DELETE CASCADE
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci
+                """))
+                conn.commit()
+                print("[OK] email_outbox 表已创建")
+            else:
+                print("[OK] email_outbox 表已存在")
+            
             print("\n数据库迁移完成！")
         except Exception as e:
             print(f"迁移失败: {e}")
@@ -0,0 +1,366 @@
+"""Multi-process launcher: preload once, fork N uvicorn workers and keep them healthy.
+
+``uvicorn --workers N`` starts every worker from scratch: each one imports
+TensorFlow and loads the models itself, and if ``JWT_SECRET_KEY`` is unset
+each generates its own signing key, so a token issued by one worker is
+rejected by the others. This launcher instead:
+
+* imports the app, NumPy and TensorFlow in the master, creates the runner
+  replicas and builds the TFLite interpreters of the preloaded models
+  (PRELOAD_MODELS), then forks the workers, so the imported code and the
+  models' flatbuffers are shared copy-on-write. Only the flatbuffer is
+  shared: XNNPACK packs its weights and the interpreter allocates its
+  tensor arena on the first invoke, which happens in each worker, so every
+  worker still holds its own copy of those
+* has every worker inherit the master's signing key, including workers
+  restarted later (set JWT_SECRET_KEY anyway so tokens survive a restart)
+* splits the CPU cores between workers: RUNNER_INTRA_OP_THREADS defaults to
+  cores / (workers * RUNNER_POOL_SIZE) and RUNNER_INTER_OP_THREADS to 1
+* replaces a worker whose resident set size (pages shared with the master
+  included) exceeds --max-rss-mb, and any worker that exits
+
+TensorFlow sessions and SavedModels cannot be created before fork (their
+thread pools don't survive it and the worker hangs on first use), nor can
+TFLite interpreters that have already run. So the launcher defaults
+MODEL_BACKEND to ``prefer_tflite``: a SavedModel model that has a TFLite
+copy checked by ``convert_tflite.py --no-activate`` is served from that
+copy and preloaded. --convert-tflite writes the missing copies first (in a
+child process, so the master stays fork-safe). A model without a copy is
+still loaded by each worker after it starts, so its weights are not
+shared; set MODEL_BACKEND=auto to keep serving SavedModels even where a
+copy exists. Warm-up inference always runs in the workers.
+
+Each worker keeps its own in-memory state: asynchronous jobs
+(/api/v1/jobs), result caches and /metrics. A job status request that
+lands on another worker gets 404, so use --workers 1 for clients that rely
+on the job API, or poll over one keep-alive connection. The user cache of
+the authentication path is turned off with more than one worker
+(SERVE_WORKERS), because a profile or password change only invalidates
+the worker that handled it; verified tokens are still cached per worker,
+as a token is valid until its ``exp`` whichever worker checks it.
+
+Requires fork (Linux/macOS).
+
+Usage:
+    python server/serve.py --workers 4 --port 8080
+    python server/serve.py --workers 4 --max-rss-mb 3000
+    python server/serve.py --workers 4 --convert-tflite   # preload SavedModel models from TFLite copies
+"""
+import argparse
+import gc
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+# Seconds between worker health checks
+CHECK_INTERVAL = 5.0
+# Seconds a replaced or stopping worker gets to finish in-flight requests before SIGKILL
+GRACEFUL_TIMEOUT = 30.0
+# Shortest time between two starts of the same worker slot, so a crashing worker doesn't spin
+RESTART_BACKOFF = 1.0
+# Seconds a new worker may warm up before its RSS is checked
+RSS_GRACE_SECONDS = 30.0
+# Signals the master handles itself; a new worker must not run the master's handlers for them
+MASTER_SIGNALS = (signal.SIGTERM, signal.SIGINT, signal.SIGCHLD)
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    """Resident set size of ``pid`` from /proc, or None where that isn't available."""
+    try:
+        with open(f'/proc/{pid}/status', encoding='ascii') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        return None
+    return None
+
+
+def _describe_status(status: int) -> str:
+    if os.WIFSIGNALED(status):
+        return f'signal {os.WTERMSIG(status)}'
+    return f'exit code {os.WEXITSTATUS(status)}'
+
+
+def configure_threads(workers: int) -> None:
+    """Default the per-replica thread counts so the workers together use each core once."""
+    pool_size = max(1, int(os.getenv('RUNNER_POOL_SIZE', '1')))
+    intra = max(1, (os.cpu_count() or 1) // (workers * pool_size))
+    os.environ.setdefault('RUNNER_INTRA_OP_THREADS', str(intra))
+    os.environ.setdefault('RUNNER_INTER_OP_THREADS', '1')
+
+
+def convert_to_tflite(root: str) -> bool:
+    """Run convert_tflite.py --no-activate on a model in a child process, keeping the master fork-safe."""
+    script = Path(__file__).resolve().parent / 'convert_tflite.py'
+    print(f"Converting {root} to TFLite for sharing between workers")
+    return subprocess.run([sys.executable, str(script), root, '--no-activate']).returncode == 0
+
+
+def preload(app_module, convert: bool = False) -> None:
+    """Import TensorFlow and build the TFLite interpreters of the preloaded models in every replica.
+
+    With ``convert``, models that only have a SavedModel are first given a
+    checked TFLite copy, which MODEL_BACKEND=prefer_tflite then serves.
+    Nothing is run here: warm-up happens in each worker after fork.
+    """
+    from app.backends import MODEL_BACKEND, import_tensorflow
+    from app.model_runner import RUNNER_INTER_OP_THREADS, RUNNER_INTRA_OP_THREADS
+    from app.warmup import select_models
+
+    registry = app_module.model_registry
+    registry.scan()
+    names = select_models(registry.names())
+    if convert and MODEL_BACKEND == 'prefer_tflite':
+        infos = [registry.get(name) for name in names]
+        converted = [convert_to_tflite(info.root) for info in infos
+                     if info is not None and not info.error and info.backend == 'tf']
+        if any(converted):
+            registry.scan()
+    try:
+        import_tensorflow(RUNNER_INTRA_OP_THREADS, RUNNER_INTER_OP_THREADS)
+    except RuntimeError as e:
+        print(f"TensorFlow not preloaded: {e}")
+    for name in names:
+        info = registry.get(name)
+        if info is None or info.error:
+            continue
+        if info.backend != 'tflite':
+            print(f"Model {name} has no checked TFLite copy; each worker loads its SavedModel after fork "
+                  f"(run with --convert-tflite to share it)")
+            continue
+        started = time.perf_counter()
+        try:
+            for replica in app_module.pool.replicas:
+                replica.load(info.model_path)
+        except Exception as e:
+            print(f"Failed to preload model {name}: {e}")
+            continue
+        print(f"Preloaded model {name} into {app_module.pool.size} replica(s) "
+              f"in {time.perf_counter() - started:.2f}s")
+
+
+class Supervisor:
+    """Forks the workers from the preloaded master and replaces dead or oversized ones."""
+
+    def __init__(self, app, sock: socket.socket, workers: int, max_rss_bytes: int, uvicorn_options: dict) -> None:
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.max_rss_bytes = max_rss_bytes
+        self.uvicorn_options = uvicorn_options
+        self._slots: Dict[int, int] = {}  # pid -> slot
+        self._started: Dict[int, float] = {}  # slot -> last start time
+        self._born: Dict[int, float] = {}  # pid -> start time
+        self._next_check = 0.0
+        self._retiring: Dict[int, float] = {}  # pid -> SIGKILL deadline
+        self._stopping = False
+        # Signals wake the main loop through this pipe instead of waiting out the check interval
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+
+    def _spawn(self, slot: int) -> None:
+        wait = self._started.get(slot, 0.0) + RESTART_BACKOFF - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._started[slot] = time.monotonic()
+        # Held back until the child has reset the handlers, so a SIGTERM sent right after fork isn't lost
+        signal.pthread_sigmask(signal.SIG_BLOCK, MASTER_SIGNALS)
+        try:
+            pid = os.fork()
+            if pid == 0:
+                self._run_worker(slot)
+        finally:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+        self._slots[pid] = slot
+        self._born[pid] = time.monotonic()
+        print(f"Started worker {slot} (pid {pid})")
+
+    def _run_worker(self, slot: int) -> None:
+        code = 0
+        try:
+            signal.set_wakeup_fd(-1)
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            for sig in MASTER_SIGNALS:
+                signal.signal(sig, signal.SIG_DFL)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, MASTER_SIGNALS)
+            import uvicorn
+
+            config = uvicorn.Config(self.app, **self.uvicorn_options)
+            uvicorn.Server(config).run(sockets=[self.sock])
+        except BaseException as e:
+            print(f"Worker {slot} failed: {e}")
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _reap(self) -> None:
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            slot = self._slots.pop(pid, None)
+            self._retiring.pop(pid, None)
+            self._born.pop(pid, None)
+            if slot is None or self._stopping:
+                continue
+            print(f"Worker {slot} (pid {pid}) exited with {_describe_status(status)}; restarting it")
+            self._spawn(slot)
+
+    def _check_memory(self) -> None:
+        now = time.monotonic()
+        if self.max_rss_bytes <= 0 or now < self._next_check:
+            return
+        self._next_check = now + CHECK_INTERVAL
+        for pid, slot in list(self._slots.items()):
+            if now - self._born.get(pid, now) < RSS_GRACE_SECONDS:
+                continue
+            rss = _rss_bytes(pid)
+            if rss is None or rss <= self.max_rss_bytes:
+                continue
+            print(f"Worker {slot} (pid {pid}) RSS {rss / 2**20:.0f} MB exceeds "
+                  f"{self.max_rss_bytes / 2**20:.0f} MB; replacing it")
+            # Start the replacement before stopping the old worker, which drains its in-flight requests
+            self._spawn(slot)
+            self._retire(pid)
+
+    def _retire(self, pid: int) -> None:
+        self._slots.pop(pid, None)
+        self._retiring[pid] = time.monotonic() + GRACEFUL_TIMEOUT
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def _kill_overdue(self) -> None:
+        now = time.monotonic()
+        for pid, deadline in list(self._retiring.items()):
+            if now >= deadline:
+                print(f"Worker pid {pid} did not stop in {GRACEFUL_TIMEOUT:.0f}s; killing it")
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self._retiring[pid] = float('inf')
+
+    def _handle_stop(self, signum, _frame) -> None:
+        self._stopping = True
+
+    def _wait(self, timeout: float) -> None:
+        """Sleep up to ``timeout`` seconds, returning early when a signal arrives."""
+        try:
+            select.select([self._wake_r], [], [], timeout)
+        except InterruptedError:
+            pass
+        try:
+            while os.read(self._wake_r, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def run(self) -> int:
+        signal.set_wakeup_fd(self._wake_w)
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        # A no-op handler, so a worker exiting wakes the loop and is replaced right away
+        signal.signal(signal.SIGCHLD, lambda _signum, _frame: None)
+        for slot in range(self.workers):
+            self._spawn(slot)
+
+        while not self._stopping:
+            self._reap()
+            self._check_memory()
+            self._kill_overdue()
+            self._wait(CHECK_INTERVAL)
+
+        print(f"Stopping {len(self._slots)} worker(s)")
+        for pid in list(self._slots):
+            self._retire(pid)
+        while self._retiring:
+            self._reap()
+            self._kill_overdue()
+            self._wait(0.5)
+        return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', '2')))
+    parser.add_argument('--max-rss-mb', type=int, default=int(os.getenv('WORKER_MAX_RSS_MB', '0')),
+                        help='replace a worker whose RSS exceeds this many MB (0 = never)')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--log-level', default='info')
+    parser.add_argument('--no-preload', action='store_true', help='fork before building any model interpreter')
+    parser.add_argument('--convert-tflite', action='store_true',
+                        help='give preloaded models without a TFLite copy one first (convert_tflite.py --no-activate)')
+    args = parser.parse_args()
+
+    if not hasattr(os, 'fork'):
+        print("serve.py needs os.fork; on this platform run uvicorn with a single worker", file=sys.stderr)
+        return 1
+    workers = max(1, args.workers)
+    configure_threads(workers)
+    os.environ['SERVE_WORKERS'] = str(workers)
+    # Serve checked TFLite copies of SavedModel models, as only those can be loaded before fork
+    os.environ.setdefault('MODEL_BACKEND', 'prefer_tflite')
+
+    # The app package reads its settings from the environment at import, so import it only now
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from app import server as app_module
+
+    if not os.getenv('JWT_SECRET_KEY'):
+        print("Warning: JWT_SECRET_KEY is not set; all workers share a key generated for this run, "
+              "and tokens become invalid when the launcher restarts")
+    if workers > 1:
+        print("Note: asynchronous jobs, result caches and /metrics are per worker")
+        from app.auth import user_cache
+        if user_cache.enabled:
+            print(f"Warning: AUTH_USER_CACHE_TTL is set; a changed user may stay cached in the other workers "
+                  f"for up to {user_cache.ttl:g}s")
+    # Create the tables once here, as workers starting together would race on CREATE TABLE
+    from app import database
+    try:
+        database.init_db()
+    except Exception as e:
+        print(f"Failed to initialize database: {e}")
+    # Pooled connections must not be shared with the forked workers
+    database.engine.dispose()
+    if not args.no_preload:
+        preload(app_module, args.convert_tflite)
+
+    sock = socket.socket(socket.AF_INET6 if ':' in args.host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((args.host, args.port))
+    except OSError as e:
+        print(f"Failed to bind {args.host}:{args.port}: {e}", file=sys.stderr)
+        return 1
+    sock.listen(args.backlog)
+    sock.set_inheritable(True)
+    print(f"Listening on {args.host}:{args.port} with {workers} worker(s), "
+          f"{os.environ['RUNNER_INTRA_OP_THREADS']} intra-op thread(s) per replica")
+
+    # Keep the preloaded objects out of the collector so its bookkeeping doesn't copy their pages
+    gc.collect()
+    gc.freeze()
+    options = {'log_level': args.log_level, 'backlog': args.backlog}
+    return Supervisor(app_module.app, sock, workers, args.max_rss_mb * 2**20, options).run()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
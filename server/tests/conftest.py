@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Tests import the service the same way the scripts in server/ do: ``from app import ...``
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,160 @@
+"""Token and user caches behind get_current_user: expiry, invalidation and the no-query merge path."""
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.orm import sessionmaker
+
+from app import auth, server
+from app.auth import TTLCache, create_access_token, get_password_hash, get_user_by_id_cached, verify_token_cached
+from app.database import Base, get_db
+from app.models import User
+
+
+@pytest.fixture(autouse=True)
+def caches(monkeypatch):
+    monkeypatch.setattr(auth, 'token_cache', TTLCache(300))
+    monkeypatch.setattr(auth, 'user_cache', TTLCache(30))
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "auth.db"}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def user_id(session_factory) -> int:
+    db = session_factory()
+    try:
+        user = User(email='alice@stegacam.test', username='alice', short_id='Alice01',
+                    password_hash=get_password_hash('old-password'))
+        db.add(user)
+        db.commit()
+        return user.id
+    finally:
+        db.close()
+
+
+@pytest.fixture
+def client(session_factory):
+    from fastapi.testclient import TestClient
+
+    def override_get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    server.app.dependency_overrides[get_db] = override_get_db
+    # Not used as a context manager, so the startup hooks (database, model warm-up) don't run
+    yield TestClient(server.app)
+    server.app.dependency_overrides.pop(get_db, None)
+
+
+def count_queries(session_factory) -> list:
+    statements = []
+    event.listen(session_factory.kw['bind'], 'before_cursor_execute',
+                 lambda conn, cursor, statement, *args: statements.append(statement))
+    return statements
+
+
+def cached_subjects() -> set:
+    return {value['sub'] for _, value in auth.token_cache._entries.values()}
+
+
+def test_token_entry_expires_at_exp_not_ttl(monkeypatch):
+    token = create_access_token({'sub': '7'}, expires_delta=timedelta(seconds=60))
+    payload = verify_token_cached(token)
+    exp = payload['exp']
+    key = auth._token_key(token)
+    deadline, cached = auth.token_cache._entries[key]
+    assert cached == {'sub': '7', 'exp': exp}
+    # The TTL is 300s, but the entry must not outlive the token
+    assert deadline == exp
+
+    clock = SimpleNamespace(time=lambda: exp - 1)
+    monkeypatch.setattr(auth, 'time', clock)
+    assert auth.token_cache.get(key) == cached
+    clock.time = lambda: exp + 1
+    assert auth.token_cache.get(key) is None
+
+
+def test_token_without_exp_is_not_cached():
+    token = auth.jwt.encode({'sub': '7'}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    assert verify_token_cached(token) == {'sub': '7'}
+    assert auth.token_cache.stats()['size'] == 0
+
+
+def test_cached_user_is_merged_without_a_query(session_factory, user_id):
+    db = session_factory()
+    try:
+        first = get_user_by_id_cached(db, user_id)
+        assert first.username == 'alice'
+    finally:
+        db.close()
+
+    statements = count_queries(session_factory)
+    db = session_factory()
+    try:
+        user = get_user_by_id_cached(db, user_id)
+        assert statements == []
+        assert user in db and inspect(user).persistent
+        assert (user.id, user.email, user.short_id) == (user_id, 'alice@stegacam.test', 'Alice01')
+
+        # The merged instance is a normal session object: changes to it are flushed on commit
+        user.username = 'renamed'
+        db.commit()
+    finally:
+        db.close()
+
+    db = session_factory()
+    try:
+        assert db.get(User, user_id).username == 'renamed'
+    finally:
+        db.close()
+
+
+def test_profile_update_invalidates_caches(client, user_id):
+    headers = {'Authorization': f'Bearer {create_access_token({"sub": str(user_id)})}'}
+    assert client.get('/api/v1/auth/me', headers=headers).json()['username'] == 'alice'
+    assert user_id in auth.user_cache._entries
+    assert cached_subjects() == {str(user_id)}
+
+    response = client.put('/api/v1/auth/profile', json={'username': 'bob'}, headers=headers)
+    assert response.status_code == 200
+    assert user_id not in auth.user_cache._entries
+    assert cached_subjects() == set()
+    assert client.get('/api/v1/auth/me', headers=headers).json()['username'] == 'bob'
+
+
+def test_password_change_invalidates_caches(client, user_id, monkeypatch):
+    # Hash in-process rather than on the bcrypt process pool
+    async def verify_password_async(plain, hashed):
+        return auth.verify_password(plain, hashed)
+
+    async def get_password_hash_async(password):
+        return get_password_hash(password)
+
+    monkeypatch.setattr(server, 'verify_password_async', verify_password_async)
+    monkeypatch.setattr(server, 'get_password_hash_async', get_password_hash_async)
+
+    headers = {'Authorization': f'Bearer {create_access_token({"sub": str(user_id)})}'}
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 200
+    stale_hash = auth.user_cache._entries[user_id][1]['password_hash']
+
+    response = client.post('/api/v1/auth/change-password', headers=headers,
+                           json={'old_password': 'old-password', 'new_password': 'new-password'})
+    assert response.status_code == 200
+    assert user_id not in auth.user_cache._entries
+    assert cached_subjects() == set()
+
+    # The next lookup reloads the user, so the old password no longer verifies
+    assert client.get('/api/v1/auth/me', headers=headers).status_code == 200
+    password_hash = auth.user_cache._entries[user_id][1]['password_hash']
+    assert password_hash != stale_hash
+    assert auth.verify_password('new-password', password_hash)
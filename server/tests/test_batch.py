@@ -0,0 +1,29 @@
+"""Multipart part headers built from client-supplied upload names."""
+from app.batch import MultipartWriter, content_disposition
+
+
+def part_headers(name: str) -> list:
+    writer = MultipartWriter(boundary='b')
+    part = writer.add(name, b'data', 'image/png', {'index': 0})
+    head = part.split(b'\r\n\r\n', 1)[0].decode('ascii')
+    return head.split('\r\n')[1:]
+
+
+def test_plain_name_is_unchanged():
+    assert content_disposition('000_photo.png') == 'attachment; filename="000_photo.png"'
+
+
+def test_quotes_and_line_breaks_cannot_break_out_of_the_header():
+    headers = part_headers('000_a"; filename="evil.sh\r\nX-Injected: 1.png')
+    assert [h.split(':', 1)[0] for h in headers] == [
+        'Content-Type', 'Content-Disposition', 'Content-Length', 'X-Item-Index', 'X-Item-Status',
+    ]
+    assert headers[1] == (
+        'Content-Disposition: attachment; filename="000_a_; filename=_evil.shX-Injected: 1.png"; '
+        "filename*=UTF-8''000_a%22%3B%20filename%3D%22evil.shX-Injected%3A%201.png"
+    )
+
+
+def test_non_ascii_name_gets_an_rfc5987_filename():
+    value = content_disposition('000_照片.png')
+    assert value == "attachment; filename=\"000___.png\"; filename*=UTF-8''000_%E7%85%A7%E7%89%87.png"
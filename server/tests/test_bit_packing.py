@@ -0,0 +1,139 @@
+"""The numpy bit packing in ModelRunner must match the original string-based code bit for bit."""
+import hashlib
+
+import numpy as np
+import pytest
+
+from app.model_runner import ModelRunner
+
+
+class HashECC:
+    """Deterministic stand-in for the BCH codec: 5 ecc bytes, decode succeeds when they match.
+
+    Only the packing around the codec is under test here, so any codec with the
+    bchlib 0.x interface (``ecc_bytes``, ``encode``, ``decode_inplace``) will do.
+    """
+    ecc_bytes = 5
+
+    def encode(self, data: bytearray) -> bytearray:
+        return bytearray(hashlib.sha256(bytes(data)).digest()[:self.ecc_bytes])
+
+    def decode_inplace(self, data: bytearray, ecc: bytearray) -> int:
+        return 0 if self.encode(data) == ecc else -1
+
+
+# Reference implementations, as they were before packing was vectorized
+
+def reference_secret_bits(bch, secret_str: str) -> list:
+    data = bytearray(secret_str + ' ' * (7 - len(secret_str)), 'utf-8')
+    ecc = bch.encode(data)
+    packet = data + ecc
+    packet_binary = ''.join(format(x, '08b') for x in packet)
+    bits = [int(x) for x in packet_binary]
+    bits.extend([0, 0, 0, 0])
+    return bits
+
+
+def reference_packet(secret_bits) -> bytearray:
+    packet_binary = ''.join([str(int(round(bit))) for bit in secret_bits[:96]])
+    return bytearray(bytes(int(packet_binary[i:i + 8], 2) for i in range(0, len(packet_binary), 8)))
+
+
+def reference_message(bch, secret_bits):
+    packet = reference_packet(secret_bits)
+    data, ecc = packet[:-bch.ecc_bytes], packet[-bch.ecc_bytes:]
+    if bch.decode_inplace(data, ecc) != -1:
+        try:
+            return data.decode('utf-8')
+        except Exception:
+            return None
+    return None
+
+
+ALPHABET = list('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789')
+
+
+@pytest.fixture
+def runner():
+    runner = ModelRunner()
+    runner._bch = HashECC()
+    return runner
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(7)
+
+
+def random_secrets(rng, count):
+    return [''.join(rng.choice(ALPHABET, rng.integers(0, 8))) for _ in range(count)]
+
+
+def test_secret_bits_match_reference(runner, rng):
+    secrets = random_secrets(rng, 300) + ['', 'A', 'zzzzzzz']
+    bits = runner._compute_secret_bits(secrets)
+    assert bits.shape == (len(secrets), 100)
+    assert bits.dtype == np.float32
+    expected = np.array([reference_secret_bits(runner._bch, s) for s in secrets], dtype=np.float32)
+    np.testing.assert_array_equal(bits, expected)
+
+
+def test_secret_bits_too_long(runner):
+    with pytest.raises(ValueError):
+        runner._compute_secret_bits(['ABCDEFGH'])
+
+
+def test_pack_random_rows_match_reference(rng):
+    rows = rng.random((500, 100), dtype=np.float32)
+    packets = ModelRunner._pack_bits(rows)
+    assert packets.shape == (500, 12)
+    for row, packet in zip(rows, packets):
+        assert packet.tobytes() == bytes(reference_packet(row))
+
+
+def test_pack_edge_values_match_reference():
+    # Exactly 0.5 rounds down (round-half-to-even), like the old int(round(bit))
+    rows = np.array([
+        np.full(100, 0.5),
+        np.zeros(100),
+        np.ones(100),
+        np.tile([0.0, 0.5, 1.0, np.nextafter(0.5, 1.0)], 25),
+        np.tile([np.nextafter(0.5, 0.0), 1.0, 0.5, 0.0], 25),
+    ], dtype=np.float32)
+    packets = ModelRunner._pack_bits(rows)
+    for row, packet in zip(rows, packets):
+        assert packet.tobytes() == bytes(reference_packet(row.tolist()))
+    assert packets[0].tobytes() == bytes(12)
+    assert packets[2].tobytes() == b'\xff' * 12
+
+
+def test_pack_single_row_matches_batch(rng):
+    rows = rng.random((4, 100)).astype(np.float32)
+    packets = ModelRunner._pack_bits(rows)
+    for row, packet in zip(rows, packets):
+        np.testing.assert_array_equal(ModelRunner._pack_bits(row), packet)
+
+
+def test_round_trip_messages_match_reference(runner, rng):
+    secrets = [''.join(rng.choice(ALPHABET, 7)) for _ in range(64)]
+    bits = runner._compute_secret_bits(secrets)
+    # Decoder output is soft; keep every bit on its side of 0.5, and flip one row so it fails ECC
+    noise = rng.uniform(0.0, 0.49, bits.shape).astype(np.float32)
+    soft = np.where(bits > 0.5, 1.0 - noise, noise)
+    soft[3, 10] = 1.0 - soft[3, 10]
+    messages = runner._bits_to_messages(soft)
+    expected = [reference_message(runner._bch, row.tolist()) for row in soft]
+    assert messages == expected
+    assert messages[3] is None
+    assert [m for i, m in enumerate(messages) if i != 3] == [s for i, s in enumerate(secrets) if i != 3]
+    assert runner._bits_to_message(soft[0]) == secrets[0]
+
+
+def test_first_valid_code_follows_rotation_order(runner, rng):
+    secrets = ['AAAAAAA', 'BBBBBBB']
+    bits = runner._compute_secret_bits(secrets)
+    garbage = np.zeros((1, 100), dtype=np.float32)
+    # Four rotations per image: the first decodable rotation wins
+    batch = np.concatenate([garbage, bits[1:2], bits[0:1], garbage])
+    assert runner._first_valid_code(ModelRunner._pack_bits(batch)) == 'BBBBBBB'
+    assert runner._first_valid_code(ModelRunner._pack_bits(np.repeat(garbage, 4, axis=0))) is None
@@ -0,0 +1,224 @@
+"""EmailOutboxSender and SMTPConnection against a local aiosmtpd server."""
+import socket
+import threading
+from datetime import datetime, timedelta
+from email import message_from_bytes
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+pytest.importorskip('aiosmtpd')
+from aiosmtpd.controller import Controller  # noqa: E402
+from aiosmtpd.smtp import AuthResult  # noqa: E402
+
+from app import email_service  # noqa: E402
+from app.database import Base  # noqa: E402
+from app.email_service import EmailOutboxSender, SMTPConnection, build_verification_message  # noqa: E402
+from app.models import EmailOutbox, VerificationCode  # noqa: E402
+
+
+class Mailbox:
+    """aiosmtpd handler that keeps the delivered messages and can reject the next few with a 451."""
+
+    def __init__(self) -> None:
+        self.messages = []
+        self.transient_failures = 0
+        self._lock = threading.Lock()
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            if self.transient_failures:
+                self.transient_failures -= 1
+                return '451 Try again later'
+            self.messages.append(message_from_bytes(envelope.content))
+        return '250 OK'
+
+    def recipients(self):
+        with self._lock:
+            return [msg['To'] for msg in self.messages]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def mailbox(monkeypatch):
+    handler = Mailbox()
+    controller = Controller(
+        handler, hostname='127.0.0.1', port=free_port(), auth_require_tls=False,
+        authenticator=lambda *args: AuthResult(success=True),
+    )
+    controller.start()
+    monkeypatch.setattr(email_service, 'SMTP_HOST', controller.hostname)
+    monkeypatch.setattr(email_service, 'SMTP_PORT', controller.port)
+    monkeypatch.setattr(email_service, 'SMTP_USER', 'stegacam')
+    monkeypatch.setattr(email_service, 'SMTP_PASSWORD', 'secret')
+    monkeypatch.setattr(email_service, 'SMTP_FROM', 'noreply@stegacam.test')
+    monkeypatch.setattr(email_service, 'SMTP_STARTTLS', False)
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "outbox.db"}', connect_args={'timeout': 30})
+    Base.metadata.create_all(engine)
+    yield sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    engine.dispose()
+
+
+def queue_emails(session_factory, count: int) -> None:
+    db = session_factory()
+    try:
+        now = datetime.utcnow()
+        for i in range(count):
+            code = VerificationCode(email=f'user{i}@stegacam.test', code=f'{i:06d}', code_type='email_verify',
+                                    expires_at=now + timedelta(minutes=10))
+            db.add(code)
+            db.flush()
+            db.add(EmailOutbox(verification_code_id=code.id, next_attempt_at=now))
+        db.commit()
+    finally:
+        db.close()
+
+
+def outbox_rows(session_factory):
+    db = session_factory()
+    try:
+        return db.query(EmailOutbox).order_by(EmailOutbox.id).all()
+    finally:
+        db.close()
+
+
+def test_outbox_sends_over_one_connection(mailbox, session_factory):
+    queue_emails(session_factory, 3)
+    sender = EmailOutboxSender(session_factory)
+    assert sender._drain_once() == 3
+    assert sorted(mailbox.recipients()) == [f'user{i}@stegacam.test' for i in range(3)]
+    assert [row.status for row in outbox_rows(session_factory)] == ['sent'] * 3
+    assert sender._connection.connects == 1
+    sender._connection.close()
+
+
+def test_transient_failure_is_retried_with_backoff(mailbox, session_factory, monkeypatch):
+    monkeypatch.setattr(email_service, 'EMAIL_RETRY_BASE_SECONDS', 30.0)
+    queue_emails(session_factory, 1)
+    mailbox.transient_failures = 2
+    sender = EmailOutboxSender(session_factory)
+
+    assert sender._drain_once() == 1
+    row = outbox_rows(session_factory)[0]
+    assert (row.status, row.attempts) == ('pending', 1)
+    assert '451' in row.last_error
+    delay = (row.next_attempt_at - datetime.utcnow()).total_seconds()
+    assert 25 < delay <= 30
+    # Not due yet
+    assert sender._drain_once() == 0
+
+    def make_due():
+        db = session_factory()
+        db.query(EmailOutbox).update({'next_attempt_at': datetime.utcnow() - timedelta(seconds=1)})
+        db.commit()
+        db.close()
+
+    make_due()
+    assert sender._drain_once() == 1
+    row = outbox_rows(session_factory)[0]
+    assert (row.status, row.attempts) == ('pending', 2)
+    # The delay doubles per failed attempt
+    assert 55 < (row.next_attempt_at - datetime.utcnow()).total_seconds() <= 60
+
+    make_due()
+    assert sender._drain_once() == 1
+    row = outbox_rows(session_factory)[0]
+    assert (row.status, row.attempts) == ('sent', 3)
+    assert mailbox.recipients() == ['user0@stegacam.test']
+    sender._connection.close()
+
+
+def test_gives_up_after_max_attempts(mailbox, session_factory, monkeypatch):
+    monkeypatch.setattr(email_service, 'EMAIL_RETRY_BASE_SECONDS', 0.0)
+    queue_emails(session_factory, 1)
+    mailbox.transient_failures = 5
+    sender = EmailOutboxSender(session_factory, max_attempts=2)
+    sender._drain_once()
+    sender._drain_once()
+    row = outbox_rows(session_factory)[0]
+    assert (row.status, row.attempts) == ('failed', 2)
+    assert sender._drain_once() == 0
+    assert mailbox.recipients() == []
+
+
+def test_claim_is_won_by_one_sender(session_factory):
+    queue_emails(session_factory, 1)
+    first, second = EmailOutboxSender(session_factory), EmailOutboxSender(session_factory)
+    db_a, db_b = session_factory(), session_factory()
+    try:
+        # Both senders picked the row up as a candidate before either claimed it
+        row_id = db_a.query(EmailOutbox.id).scalar()
+        now = datetime.utcnow()
+        assert first._claim(db_a, row_id, now)
+        assert not second._claim(db_b, row_id, now)
+        assert db_b.get(EmailOutbox, row_id).status == 'sending'
+        # A claim abandoned for longer than EMAIL_CLAIM_TIMEOUT_SECONDS is taken over
+        later = now + timedelta(seconds=email_service.EMAIL_CLAIM_TIMEOUT_SECONDS + 1)
+        assert second._claim(db_b, row_id, later)
+        assert not first._claim(db_a, row_id, later)
+    finally:
+        db_a.close()
+        db_b.close()
+
+
+def test_racing_senders_send_each_email_once(mailbox, session_factory):
+    queue_emails(session_factory, 20)
+    senders = [EmailOutboxSender(session_factory, batch_size=20) for _ in range(2)]
+    start = threading.Barrier(len(senders))
+    processed = [0] * len(senders)
+
+    def drain(index: int) -> None:
+        start.wait()
+        processed[index] = senders[index]._drain_once()
+
+    threads = [threading.Thread(target=drain, args=(i,)) for i in range(len(senders))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    for sender in senders:
+        sender._connection.close()
+
+    assert sum(processed) == 20
+    assert sorted(mailbox.recipients()) == sorted(f'user{i}@stegacam.test' for i in range(20))
+    assert all(row.status == 'sent' and row.attempts == 1 for row in outbox_rows(session_factory))
+
+
+def test_pooled_connection_reopens_after_idle_close(mailbox):
+    connection = SMTPConnection(idle_timeout=60.0)
+    connection.send(build_verification_message('a@stegacam.test', '111111'))
+    connection.send(build_verification_message('b@stegacam.test', '222222'))
+    assert connection.connects == 1
+    connection.close_if_idle()
+    assert connection._server is not None
+
+    connection.idle_timeout = 0.0
+    connection.close_if_idle()
+    assert connection._server is None
+    connection.send(build_verification_message('c@stegacam.test', '333333'))
+    assert connection.connects == 2
+    assert mailbox.recipients() == ['a@stegacam.test', 'b@stegacam.test', 'c@stegacam.test']
+    connection.close()
+
+
+def test_pooled_connection_reconnects_when_dropped(mailbox):
+    connection = SMTPConnection()
+    connection.send(build_verification_message('a@stegacam.test', '111111'))
+    # The session went away without a QUIT (server restart, network drop)
+    connection._server.sock.shutdown(socket.SHUT_RDWR)
+    connection.send(build_verification_message('b@stegacam.test', '222222'))
+    assert connection.connects == 2
+    assert mailbox.recipients() == ['a@stegacam.test', 'b@stegacam.test']
+    connection.close()
@@ -0,0 +1,143 @@
+"""JobStore retention, capacity, queue positions and subscriber notifications on a real executor."""
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.executor import BoundedExecutor, ExecutorFull
+from app.jobs import FAILED, RUNNING, SUCCEEDED, JobStore, JobStoreFull
+
+
+class Gate:
+    """Work function that blocks until released, so tests decide when each job finishes."""
+
+    def __init__(self) -> None:
+        self._event = threading.Event()
+
+    def __call__(self, value):
+        if not self._event.wait(10):
+            raise TimeoutError('gate was never opened')
+        return value
+
+    def open(self) -> None:
+        self._event.set()
+
+
+def wait_until(predicate, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError('condition not reached in time')
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def make_store():
+    executors = []
+
+    def make(ttl: float = 60, max_jobs: int = 16, workers: int = 1, queue_size: int = 16) -> JobStore:
+        executor = BoundedExecutor(workers, queue_size, 'test-jobs')
+        executors.append(executor)
+        return JobStore(executor, ttl=ttl, max_jobs=max_jobs)
+
+    yield make
+    for executor in executors:
+        executor.shutdown(wait=True)
+
+
+def test_finished_jobs_expire_after_ttl(make_store):
+    store = make_store(ttl=0.2)
+    ok = store.submit('encode', 1, lambda: b'png')
+    failed = store.submit('decode', 1, lambda: 1 / 0)
+    wait_until(lambda: ok.finished and failed.finished)
+
+    assert store.get(ok.id).result == b'png'
+    assert (failed.status, failed.error) == (FAILED, 'division by zero')
+    assert store.get(ok.id, user_id=2) is None  # other users never see it
+
+    wait_until(lambda: store.get(ok.id) is None)
+    assert store.get(failed.id) is None
+    assert store.purge() == 2
+    assert store.stats()['jobs'] == 0
+
+
+def test_submissions_beyond_max_jobs_are_rejected(make_store):
+    store = make_store(ttl=0.1, max_jobs=2)
+    gate = Gate()
+    jobs = [store.submit('encode', 1, gate, i) for i in range(2)]
+    with pytest.raises(JobStoreFull):
+        store.submit('encode', 1, gate, 2)
+    assert store.stats()['jobs'] == 2
+
+    # Finished jobs keep their slot until they expire
+    gate.open()
+    wait_until(lambda: all(job.finished for job in jobs))
+    with pytest.raises(JobStoreFull):
+        store.submit('encode', 1, gate, 2)
+    time.sleep(0.15)
+    job = store.submit('encode', 1, gate, 2)
+    wait_until(lambda: job.status == SUCCEEDED)
+    assert job.result == 2
+
+
+def test_executor_full_does_not_keep_the_job(make_store):
+    store = make_store(workers=1, queue_size=0)
+    gate = Gate()
+    store.submit('encode', 1, gate, 0)
+    with pytest.raises(ExecutorFull):
+        store.submit('encode', 1, gate, 1)
+    assert store.stats()['jobs'] == 1
+    gate.open()
+
+
+def test_queue_position_counts_earlier_queued_jobs(make_store):
+    store = make_store(workers=1)
+    first, second = Gate(), Gate()
+    running = store.submit('encode', 1, first, 'a')
+    wait_until(lambda: running.status == RUNNING)
+    queued = [store.submit('decode', 2, second, i) for i in range(3)]
+
+    assert store.queue_position(running) is None
+    assert [store.queue_position(job) for job in queued] == [1, 2, 3]
+    assert store.snapshot(queued[2])['queue_position'] == 3
+
+    first.open()
+    wait_until(lambda: queued[0].status == RUNNING)
+    assert [store.queue_position(job) for job in queued] == [None, 1, 2]
+    second.open()
+    wait_until(lambda: all(job.finished for job in queued))
+    assert [store.queue_position(job) for job in queued] == [None, None, None]
+
+
+def test_subscribers_are_notified_on_the_event_loop(make_store):
+    store = make_store(workers=1)
+    blocker, gate = Gate(), Gate()
+
+    async def watch():
+        store.submit('encode', 1, blocker, None)
+        job = store.submit('encode', 1, gate, 'done')
+        queue = store.subscribe(job)
+        other = store.subscribe(job)
+        store.unsubscribe(job, other)
+
+        # Record which thread each snapshot is put on: call_soon_threadsafe must run it on the loop
+        put_threads = []
+        put_nowait = queue.put_nowait
+        queue.put_nowait = lambda item: (put_threads.append(threading.get_ident()), put_nowait(item))
+
+        blocker.open()
+        gate.open()
+        statuses = []
+        while not statuses or statuses[-1] not in (SUCCEEDED, FAILED):
+            snapshot = await asyncio.wait_for(queue.get(), 5)
+            statuses.append(snapshot['status'])
+        store.unsubscribe(job, queue)
+        return job, statuses, put_threads, threading.get_ident(), other.qsize()
+
+    job, statuses, put_threads, loop_thread, unsubscribed = asyncio.run(watch())
+    assert statuses == [RUNNING, SUCCEEDED]
+    assert put_threads == [loop_thread, loop_thread]
+    assert unsubscribed == 0
+    assert store._subscribers == {}
+    assert job.result == 'done'
@@ -0,0 +1,45 @@
+"""EncodedFileCache size accounting when several processes share one directory."""
+import multiprocessing
+
+from app.result_cache import EncodedFileCache
+
+KB = 1024
+
+
+def directory_bytes(directory) -> int:
+    return sum(p.stat().st_size for p in directory.glob('*/*') if not p.name.startswith('.tmp-'))
+
+
+def fill(directory: str, worker: int, count: int) -> None:
+    cache = EncodedFileCache(directory, max_bytes=20 * KB)
+    for i in range(count):
+        cache.put(f'{worker:02x}{i:062x}', bytes(KB))
+
+
+def test_replacing_a_key_does_not_double_count(tmp_path):
+    cache = EncodedFileCache(str(tmp_path), max_bytes=20 * KB)
+    for size in (4 * KB, 4 * KB, 2 * KB):
+        cache.put('ab' * 32, bytes(size))
+    assert cache._read_total() == 2 * KB == directory_bytes(tmp_path)
+    assert cache.get('ab' * 32) == bytes(2 * KB)
+
+
+def test_total_is_shared_between_instances(tmp_path):
+    caches = [EncodedFileCache(str(tmp_path), max_bytes=20 * KB) for _ in range(4)]
+    for i in range(15):
+        for n, cache in enumerate(caches):
+            cache.put(f'{n:02x}{i:062x}', bytes(KB))
+            assert directory_bytes(tmp_path) <= 20 * KB
+    assert caches[0]._read_total() == directory_bytes(tmp_path)
+
+
+def test_cap_holds_across_processes(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=fill, args=(str(tmp_path), n, 40)) for n in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(30)
+        assert worker.exitcode == 0
+    assert directory_bytes(tmp_path) <= 20 * KB
+    assert EncodedFileCache(str(tmp_path))._read_total() == directory_bytes(tmp_path)
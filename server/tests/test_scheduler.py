@@ -0,0 +1,109 @@
+"""InferenceScheduler batching, result routing and per-job fallback, against a fake runner pool."""
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+
+from app.scheduler import InferenceScheduler
+
+MODEL = '/models/fake/model'
+
+
+class FakeRunner:
+    """Echoes its inputs back; any batch containing ``bad`` fails as a whole."""
+
+    def __init__(self) -> None:
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def load(self, model_path: str) -> None:
+        assert model_path == MODEL
+
+    def _record(self, kind: str, items: list) -> None:
+        with self.lock:
+            self.batches.append((kind, list(items)))
+        if 'bad' in items:
+            raise ValueError('cannot read image')
+
+    def encode_batch(self, images, secrets, full_resolution=False):
+        self._record('encode_full' if full_resolution else 'encode', images)
+        return [(image, secret) for image, secret in zip(images, secrets)]
+
+    def decode_batch(self, images):
+        self._record('decode', images)
+        return [f'decoded:{image}' for image in images]
+
+
+class FakePool:
+    size = 1
+
+    def __init__(self) -> None:
+        self.runner = FakeRunner()
+
+    @contextmanager
+    def acquire(self, model_path: str):
+        yield self.runner
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(max_batch: int, max_wait_ms: float) -> InferenceScheduler:
+        scheduler = InferenceScheduler(FakePool(), max_batch=max_batch, max_wait_ms=max_wait_ms)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler.stop()
+
+
+def test_flushes_as_soon_as_max_batch_is_queued(make_scheduler):
+    # max_wait is far longer than the test: only a full batch can trigger the flush
+    scheduler = make_scheduler(max_batch=4, max_wait_ms=60_000)
+    started = time.monotonic()
+    futures = [scheduler.submit_decode(MODEL, f'img{i}') for i in range(4)]
+    assert [f.result(timeout=5) for f in futures] == [f'decoded:img{i}' for i in range(4)]
+    assert time.monotonic() - started < 5
+    assert scheduler._pool.runner.batches == [('decode', ['img0', 'img1', 'img2', 'img3'])]
+
+
+def test_flushes_a_partial_batch_after_max_wait(make_scheduler):
+    scheduler = make_scheduler(max_batch=8, max_wait_ms=100)
+    started = time.monotonic()
+    futures = [scheduler.submit_decode(MODEL, f'img{i}') for i in range(2)]
+    assert [f.result(timeout=5) for f in futures] == ['decoded:img0', 'decoded:img1']
+    assert time.monotonic() - started >= 0.09
+    assert scheduler._pool.runner.batches == [('decode', ['img0', 'img1'])]
+
+
+def test_results_go_to_the_matching_futures(make_scheduler):
+    scheduler = make_scheduler(max_batch=3, max_wait_ms=60_000)
+    encodes = [scheduler.submit_encode(MODEL, f'img{i}', f'msg{i}') for i in range(3)]
+    decodes = [scheduler.submit_decode(MODEL, f'img{i}') for i in range(3)]
+    full = [scheduler.submit_encode(MODEL, f'big{i}', f'msg{i}', full_resolution=True) for i in range(3)]
+
+    assert [f.result(timeout=5) for f in encodes] == [(f'img{i}', f'msg{i}') for i in range(3)]
+    assert [f.result(timeout=5) for f in decodes] == [f'decoded:img{i}' for i in range(3)]
+    assert [f.result(timeout=5) for f in full] == [(f'big{i}', f'msg{i}') for i in range(3)]
+    # Each kind is its own queue, so nothing is mixed into another kind's batch
+    kinds = sorted(kind for kind, _ in scheduler._pool.runner.batches)
+    assert kinds == ['decode', 'encode', 'encode_full']
+
+
+def test_failed_batch_falls_back_per_job(make_scheduler):
+    scheduler = make_scheduler(max_batch=3, max_wait_ms=60_000)
+    futures = [scheduler.submit_decode(MODEL, image) for image in ('img0', 'bad', 'img2')]
+
+    assert futures[0].result(timeout=5) == 'decoded:img0'
+    with pytest.raises(ValueError, match='cannot read image'):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5) == 'decoded:img2'
+    assert scheduler._pool.runner.batches == [
+        ('decode', ['img0', 'bad', 'img2']),
+        ('decode', ['img0']),
+        ('decode', ['bad']),
+        ('decode', ['img2']),
+    ]